@@ -1,7 +1,9 @@
 import logging
 import os
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from glob import glob
+from itertools import combinations
 
 import numpy as np
 import pandas as pd
@@ -165,6 +167,165 @@ def _make_dot_graph(links, show_all, names1, names2):
     return dot
 
 
+class OrthologMap(object):
+    """
+    Class representation of the orthologs in a bidirectional best hit (BBH) file.
+    Integer positions of orthologs are computed once for a pair of gene orders,
+    so that any number of M, X or A-aligned tables can be re-indexed by position.
+    """
+
+    # Recently loaded BBH files, keyed by path, least recently used first
+    _cache = {}
+    _cache_size = 4
+    _max_positions = 8
+
+    def __init__(self, ortho_file):
+        """
+        Initialize OrthologMap object
+
+        Parameters
+        ----------
+        ortho_file : str or ~pandas.DataFrame
+            Path to orthology file between organisms, or the BBH table itself
+        """
+
+        if isinstance(ortho_file, pd.DataFrame):
+            DF_orth = ortho_file
+        else:
+            DF_orth = pd.read_csv(ortho_file)
+
+        self.genes = DF_orth.gene.values
+        self.subjects = DF_orth.subject.values
+        self._positions = []
+
+    @classmethod
+    def from_file(cls, ortho_file):
+        """
+        Load an OrthologMap from a BBH file, re-using the previously loaded
+        object if the file has not been modified since
+
+        Parameters
+        ----------
+        ortho_file : str
+            Path to orthology file between organisms
+
+        Returns
+        -------
+        OrthologMap
+            Orthologs in the BBH file
+        """
+
+        path = os.path.abspath(ortho_file)
+        mtime = os.path.getmtime(path)
+        cached = cls._cache.pop(path, None)
+        if cached is None or cached[0] != mtime:
+            if len(cls._cache) >= cls._cache_size:
+                cls._cache.pop(next(iter(cls._cache)))
+            cached = (mtime, cls(path))
+        cls._cache[path] = cached
+        return cached[1]
+
+    def positions(self, index1, index2):
+        """
+        Get the integer positions of orthologous genes in two gene orders
+
+        Parameters
+        ----------
+        index1 : ~pandas.Index
+            Genes from the first organism (the 'gene' column of the BBH file)
+        index2 : ~pandas.Index
+            Genes from the second organism (the 'subject' column of the BBH file)
+
+        Returns
+        -------
+        pos1: ~numpy.ndarray
+            Positions of the orthologs in index1
+        pos2: ~numpy.ndarray
+            Positions of the orthologs in index2
+        names: ~numpy.ndarray
+            Names of the orthologs in the first organism
+        """
+
+        # Indexes are immutable, so identical objects have identical positions
+        for idx1, idx2, result in self._positions:
+            if idx1 is index1 and idx2 is index2:
+                return result
+
+        if index1.is_unique and index2.is_unique:
+            pos1 = index1.get_indexer(self.genes)
+            pos2 = index2.get_indexer(self.subjects)
+            keep = (pos1 >= 0) & (pos2 >= 0)
+            result = (pos1[keep], pos2[keep], self.genes[keep])
+        else:
+            result = self._non_unique_positions(index1, index2)
+
+        self._positions.append((index1, index2, result))
+        if len(self._positions) > self._max_positions:
+            self._positions.pop(0)
+        return result
+
+    def _non_unique_positions(self, index1, index2):
+        """
+        Get the positions of orthologs in gene orders with duplicate genes.
+        Like label-based indexing, every copy of a gene is kept, so each BBH
+        pair yields all combinations of its copies in the two gene orders.
+        """
+        pairs = pd.DataFrame(
+            {
+                "gene": self.genes,
+                "subject": self.subjects,
+                "pair": np.arange(len(self.genes)),
+            }
+        )
+        pos1 = pd.DataFrame(
+            {"gene": np.asarray(index1), "pos1": np.arange(len(index1))}
+        )
+        pos2 = pd.DataFrame(
+            {"subject": np.asarray(index2), "pos2": np.arange(len(index2))}
+        )
+        merged = pairs.merge(pos1, on="gene").merge(pos2, on="subject")
+        merged = merged.sort_values(["pair", "pos1", "pos2"])
+        return (
+            merged.pos1.values,
+            merged.pos2.values,
+            self.genes[merged.pair.values],
+        )
+
+    def remap(self, df1, df2, keep_locus=False):
+        """
+        Reorganizes and renames genes in two dataframes to be consistent with
+        the first organism
+
+        Parameters
+        ----------
+        df1 : ~pandas.DataFrame
+            Dataframe from the first organism
+        df2 : ~pandas.DataFrame
+            Dataframe from the second organism
+        keep_locus : bool
+            If True, keep old locus tags as a column (default: False)
+
+        Returns
+        -------
+        df1_new: ~pandas.DataFrame
+            Dataframe for organism 1 with indexes translated into orthologs
+        df2_new: ~pandas.DataFrame
+            Dataframe for organism 2 with indexes translated into orthologs
+        """
+
+        pos1, pos2, names = self.positions(df1.index, df2.index)
+        df1_new = df1.iloc[pos1]
+        df2_new = df2.iloc[pos2].copy()
+
+        # Reset index of df2 to conform with df1
+        if keep_locus:
+            df2_new.index.name = "locus_tag"
+            df2_new.reset_index(inplace=True)
+        df2_new.index = pd.Index(names)
+
+        return df1_new, df2_new
+
+
 def convert_gene_index(df1, df2, ortho_file=None, keep_locus=False):
     """
     Reorganizes and renames genes in a dataframe to be consistent with
@@ -176,7 +337,7 @@ def convert_gene_index(df1, df2, ortho_file=None, keep_locus=False):
         Dataframe from the first object/organism
     df2 : ~pandas.DataFrame
         Dataframe from the second object/organism
-    ortho_file : str or ~pandas.DataFrame, optional
+    ortho_file : str or ~pandas.DataFrame or OrthologMap, optional
         Path to orthology file between organisms (default: None)
     keep_locus : bool
         If True, keep old locus tags as a column (default: False)
@@ -194,26 +355,14 @@ def convert_gene_index(df1, df2, ortho_file=None, keep_locus=False):
         df1_new = df1.loc[common_genes]
         df2_new = df2.loc[common_genes]
     else:
-
-        try:
-            DF_orth = pd.read_csv(ortho_file)
-        except (ValueError, TypeError):
-            DF_orth = ortho_file
-
-        DF_orth = DF_orth[
-            DF_orth.gene.isin(df1.index) & DF_orth.subject.isin(df2.index)
-        ]
-        subject2gene = DF_orth.set_index("subject").gene.to_dict()
-        df1_new = df1.loc[DF_orth.gene]
-        df2_new = df2.loc[DF_orth.subject]
-
-        # Reset index of df2 to conform with df1
-        if keep_locus:
-            df2_new.index.name = "locus_tag"
-            df2_new.reset_index(inplace=True)
-            df2_new.index = [subject2gene[idx] for idx in df2_new.locus_tag]
+        if isinstance(ortho_file, OrthologMap):
+            ortho_map = ortho_file
+        elif isinstance(ortho_file, pd.DataFrame):
+            ortho_map = OrthologMap(ortho_file)
         else:
-            df2_new.index = [subject2gene[idx] for idx in df2_new.index]
+            ortho_map = OrthologMap.from_file(ortho_file)
+
+        df1_new, df2_new = ortho_map.remap(df1, df2, keep_locus=keep_locus)
 
     if len(df1_new) == 0 or len(df2_new) == 0:
         raise ValueError(
@@ -309,7 +458,9 @@ def make_prots(gbk, out_path, lt_key="locus_tag"):
                 recorded.add(lt)
 
 
-def make_prot_db(fasta_file, outname=None, combined="combined.fa"):
+def make_prot_db(
+    fasta_file, outname=None, combined="combined.fa", makeblastdb="makeblastdb"
+):
     """
     Creates GenBank Databases from Protein FASTA of an organism
 
@@ -321,6 +472,8 @@ def make_prot_db(fasta_file, outname=None, combined="combined.fa"):
         Name of BLAST database to be created. If None, it uses fasta_file name
     combined : str
         Path to combined fasta file; only used if multiple fasta files are passed
+    makeblastdb : str
+        Path to the makeblastdb executable (default: "makeblastdb")
     Returns
     -------
     None : None
@@ -342,7 +495,7 @@ def make_prot_db(fasta_file, outname=None, combined="combined.fa"):
         print("BLAST DB files already exist")
         return None
 
-    cmd_line = ["makeblastdb", "-in", fasta_file, "-parse_seqids", "-dbtype", "prot"]
+    cmd_line = [makeblastdb, "-in", fasta_file, "-parse_seqids", "-dbtype", "prot"]
 
     if outname:
         cmd_line.extend(["-out", outname])
@@ -376,6 +529,7 @@ def get_bbh(
     threads=1,
     force=False,
     savefiles=True,
+    blastp="blastp",
 ):
     """
     Runs Bidirectional Best Hit BLAST to find orthologs utilizing two protein
@@ -402,6 +556,8 @@ def get_bbh(
         If True, overwrite existing files (default: False)
     savefiles : bool
         If True, save files to 'outdir' (default: True)
+    blastp : str
+        Path to the blastp executable (default: "blastp")
 
     Returns
     -------
@@ -420,8 +576,8 @@ def get_bbh(
     bres1 = os.path.join(outdir, "{}_vs_{}.txt".format(on2, on1))
     bres2 = os.path.join(outdir, "{}_vs_{}.txt".format(on1, on2))
 
-    _run_blastp(db1, db2, bres1, evalue, threads, force)
-    _run_blastp(db2, db1, bres2, evalue, threads, force)
+    _run_blastp(db1, db2, bres1, evalue, threads, force, blastp)
+    _run_blastp(db2, db1, bres2, evalue, threads, force, blastp)
 
     db1_lengths = _get_gene_lens(db1)
     db2_lengths = _get_gene_lens(db2)
@@ -438,77 +594,328 @@ def get_bbh(
         return out
     print("parsing BBHs for", on1, on2)
 
-    cols = [
-        "gene",
-        "subject",
-        "PID",
-        "alnLength",
-        "mismatchCount",
-        "gapOpenCount",
-        "queryStart",
-        "queryEnd",
-        "subjectStart",
-        "subjectEnd",
-        "eVal",
-        "bitScore",
-    ]
+    bbh_file1 = os.path.join(outdir, "{}_vs_{}.txt".format(on1, on2))
+    bbh_file2 = os.path.join(outdir, "{}_vs_{}.txt".format(on2, on1))
+
+    out = _parse_bbh(bbh_file1, bbh_file2, db1_lengths, db2_lengths, mincov)
+
+    if savefiles:
+        print("Saving results to: " + out_file)
+        out.to_csv(out_file)
+    else:
+        os.remove(bbh_file1)
+        os.remove(bbh_file2)
+    return out
+
+
+def run_bbh_matrix(
+    fasta_files,
+    outdir="bbh",
+    mincov=0.8,
+    evalue=0.001,
+    threads=1,
+    processes=None,
+    force=False,
+    blastp="blastp",
+    makeblastdb="makeblastdb",
+):
+    """
+    Runs Bidirectional Best Hit BLAST between every pair of protein FASTA files.
+    All BLASTP jobs are scheduled across a pool of workers, and the BBH table for
+    each pair of organisms is parsed as soon as both of its BLASTP runs finish.
+    Outputs a CSV file of orthologous genes for every ordered pair of organisms.
+
+    Parameters
+    ----------
+    fasta_files : list
+        Paths to the protein FASTA files of all organisms
+    outdir : str
+        Path to output directory (default: "bbh")
+    mincov : float
+        Minimum coverage to call hits in BLAST, must be between 0 and 1
+        (default: 0.8)
+    evalue : float
+        E-value threshold for BlAST hist (default: .001)
+    threads : int
+        Number of threads to use for each BLAST job (default: 1)
+    processes : int, optional
+        Number of BLAST jobs to run at once. If None, uses the number of CPUs
+        divided by 'threads' (default: None)
+    force : bool
+        If True, overwrite existing files. Otherwise, only jobs whose outputs are
+        missing or older than their inputs are run (default: False)
+    blastp : str
+        Path to the blastp executable (default: "blastp")
+    makeblastdb : str
+        Path to the makeblastdb executable (default: "makeblastdb")
+
+    Returns
+    -------
+    results: dict
+        Dictionary mapping (organism 1, organism 2) name pairs to tables of
+        bi-directional BLAST hits, indexed like the <org1>_vs_<org2>_parsed.csv files
+    """
+
+    if not 0 < mincov <= 1:
+        raise ValueError("Coverage must be greater than 0 and less than or equal to 1")
+
+    names = [".".join(os.path.split(f)[-1].split(".")[:-1]) for f in fasta_files]
+    if len(set(names)) != len(names):
+        raise ValueError("Protein FASTA files must have unique file names")
+    fasta_dict = dict(zip(names, fasta_files))
+
+    if not os.path.isdir(outdir):
+        print("Making the output directory: " + outdir)
+        os.makedirs(outdir)
+
+    if processes is None:
+        processes = max(1, (os.cpu_count() or 1) // threads)
+
+    # BLAST databases are needed before any BLASTP job can start
+    for fasta in fasta_files:
+        make_prot_db(fasta, makeblastdb=makeblastdb)
+
+    # Each unordered pair needs two BLASTP runs (one in each direction)
+    pairs = list(combinations(names, 2))
+    jobs = {}
+    for on1, on2 in pairs:
+        for query, db in [(on1, on2), (on2, on1)]:
+            out = os.path.join(outdir, "{}_vs_{}.txt".format(query, db))
+            if force or not _up_to_date(out, fasta_dict[query], fasta_dict[db]):
+                jobs[(query, db)] = out
+
+    print(
+        "running {} of {} BLASTP jobs with {} workers".format(
+            len(jobs), 2 * len(pairs), processes
+        )
+    )
+
+    gene_lens = {}
+    results = {}
+
+    def parse_pair(on1, on2):
+        for org1, org2 in [(on1, on2), (on2, on1)]:
+            results[(org1, org2)] = _parse_bbh_pair(
+                org1, org2, fasta_dict, outdir, mincov, force, gene_lens
+            )
+
+    # Pairs whose BLASTP outputs are both up to date can be parsed right away
+    remaining = {}
+    for on1, on2 in pairs:
+        n_jobs = ((on1, on2) in jobs) + ((on2, on1) in jobs)
+        if n_jobs == 0:
+            parse_pair(on1, on2)
+        else:
+            remaining[frozenset([on1, on2])] = n_jobs
+
+    with ThreadPoolExecutor(max_workers=processes) as executor:
+        futures = {
+            executor.submit(
+                _run_blastp_job,
+                fasta_dict[db],
+                fasta_dict[query],
+                out,
+                evalue,
+                threads,
+                blastp,
+            ): (query, db)
+            for (query, db), out in jobs.items()
+        }
+
+        for future in as_completed(futures):
+            query, db = futures[future]
+            future.result()
+
+            pair = frozenset([query, db])
+            remaining[pair] -= 1
+            if remaining[pair] == 0:
+                parse_pair(query, db)
+
+    return results
+
+
+def _run_blastp_job(db1, db2, out, evalue, threads, blastp):
+    """
+    Runs BLASTP into a temporary file, so that interrupted runs are never mistaken
+    for finished outputs
+    """
+    tmp_out = out + ".tmp"
+    _run_blastp(db1, db2, tmp_out, evalue, threads, True, blastp)
+    os.replace(tmp_out, out)
+    return out
+
+
+def _parse_bbh_pair(on1, on2, fasta_dict, outdir, mincov, force, gene_lens):
+    """Parses and saves the BBH table for an ordered pair of organisms"""
 
     bbh_file1 = os.path.join(outdir, "{}_vs_{}.txt".format(on1, on2))
     bbh_file2 = os.path.join(outdir, "{}_vs_{}.txt".format(on2, on1))
+    out_file = os.path.join(outdir, "{}_vs_{}_parsed.csv".format(on1, on2))
 
-    bbh = pd.read_csv(bbh_file1, sep="\t", names=cols)
-    bbh = pd.merge(bbh, db1_lengths)
+    if not force and _up_to_date(out_file, bbh_file1, bbh_file2):
+        print("bbh already parsed for", on1, on2)
+        return pd.read_csv(out_file, index_col=0)
+
+    print("parsing BBHs for", on1, on2)
+    for name in [on1, on2]:
+        if name not in gene_lens:
+            gene_lens[name] = _get_gene_lens(fasta_dict[name])
 
-    bbh["COV"] = bbh["alnLength"] / bbh["gene_length"]
+    out = _parse_bbh(bbh_file1, bbh_file2, gene_lens[on1], gene_lens[on2], mincov)
+    out.to_csv(out_file)
+    return out
 
-    bbh2 = pd.read_csv(bbh_file2, sep="\t", names=cols)
-    bbh2 = pd.merge(bbh2, db2_lengths)
-    bbh2["COV"] = bbh2["alnLength"] / bbh2["gene_length"]
 
-    # Strip "lcl|" from protein files taken from NCBI
-    bbh.gene = bbh.gene.str.strip("lcl|")
-    bbh.subject = bbh.subject.str.strip("lcl|")
-    bbh2.gene = bbh2.gene.str.strip("lcl|")
-    bbh2.subject = bbh2.subject.str.strip("lcl|")
+def _up_to_date(out, *inputs):
+    """Checks that an output file exists and is newer than all of its inputs"""
+    if not os.path.isfile(out):
+        return False
+    out_time = os.path.getmtime(out)
+    return all(os.path.getmtime(f) <= out_time for f in inputs)
+
+
+BLAST_COLS = [
+    "gene",
+    "subject",
+    "PID",
+    "alnLength",
+    "mismatchCount",
+    "gapOpenCount",
+    "queryStart",
+    "queryEnd",
+    "subjectStart",
+    "subjectEnd",
+    "eVal",
+    "bitScore",
+]
+
+
+def _parse_bbh(
+    bbh_file1, bbh_file2, db1_lengths, db2_lengths, mincov, chunksize=100000
+):
+    """
+    Finds bidirectional best hits from a pair of BLAST tabular outputs
 
-    # FILTER GENES THAT HAVE COVERAGE < mincov
-    bbh = bbh[bbh.COV >= mincov]
-    bbh2 = bbh2[bbh2.COV >= mincov]
-    list2struct = []
+    Parameters
+    ----------
+    bbh_file1 : str
+        BLAST output with organism 1 as the query
+    bbh_file2 : str
+        BLAST output with organism 2 as the query
+    db1_lengths : ~pandas.DataFrame
+        Table of gene lengths for organism 1
+    db2_lengths : ~pandas.DataFrame
+        Table of gene lengths for organism 2
+    mincov : float
+        Minimum coverage to call hits in BLAST
+    chunksize : int
+        Number of BLAST hits to read at a time (default: 100000)
 
-    # find if genes are directionally best hits of each other
-    for g in bbh.gene.unique():
-        res = bbh[bbh.gene == g]
-        if len(res) == 0:
-            continue
+    Returns
+    -------
+    out: ~pandas.DataFrame
+        Table of bi-directional BLAST hits between the two organisms
+    """
+
+    best1 = _read_best_hits(bbh_file1, db1_lengths, mincov, chunksize)
+    best2 = _read_best_hits(bbh_file2, db2_lengths, mincov, chunksize)
 
-        # find BLAST hit with highest percent identity (PID)
-        best_hit = res.loc[res.PID.idxmax()].copy()
-        res2 = bbh2[bbh2.gene == best_hit.subject]
-        if len(res2) == 0:  # no match
+    # if doing forward then reciprocal BLAST nets the same gene -> BBH
+    reciprocal = best1.subject.map(best2.set_index("gene").subject)
+    out = best1[reciprocal == best1.gene].copy()
+    out["BBH"] = "<=>"
+    return out
+
+
+def _read_best_hits(bbh_file, gene_lengths, mincov, chunksize=100000):
+    """
+    Streams a BLAST tabular (outfmt 6) file and keeps the best hit (highest
+    percent identity) for each query gene. Gene lengths, coverage filtering and
+    "lcl|" prefix removal are applied chunk by chunk, so memory use is bounded by
+    the chunk size and the number of query genes.
+
+    Parameters
+    ----------
+    bbh_file : str
+        Path to BLAST output
+    gene_lengths : ~pandas.DataFrame
+        Table of gene lengths for the query organism
+    mincov : float
+        Minimum coverage to call hits in BLAST
+    chunksize : int
+        Number of BLAST hits to read at a time (default: 100000)
+
+    Returns
+    -------
+    best_hits: ~pandas.DataFrame
+        Best BLAST hit for each query gene, in order of first appearance
+    """
+
+    lengths = gene_lengths.drop_duplicates("gene").set_index("gene").gene_length
+
+    reader = pd.read_csv(
+        bbh_file,
+        sep="\t",
+        names=BLAST_COLS,
+        dtype={"gene": "category", "subject": "category"},
+        chunksize=chunksize,
+    )
+
+    chunk_hits = []
+    chunk_first = []
+    for chunk in reader:
+        # Look up gene lengths once per unique gene rather than once per hit
+        codes = chunk.gene.cat.codes.values
+        cat_lengths = lengths.reindex(chunk.gene.cat.categories).values
+        chunk["gene_length"] = cat_lengths[codes]
+
+        # Filter out unknown genes and genes that have coverage < mincov
+        chunk["COV"] = chunk["alnLength"] / chunk["gene_length"]
+        chunk = chunk[chunk.COV >= mincov]
+        if chunk.empty:
             continue
-        # find BLAST hit with higest PID in the reciprocal BLAST
-        best_gene2 = res2.loc[res2.PID.idxmax(), "subject"]
 
-        # if doing forward then reciprocal BLAST nets the same gene -> BBH
-        if g == best_gene2:
-            best_hit["BBH"] = "<=>"
-        else:  # only best hit in one direction
-            best_hit["BBH"] = "->"
+        # Strip "lcl|" from protein files taken from NCBI
+        for col in ["gene", "subject"]:
+            chunk[col] = _strip_lcl(chunk[col].cat.remove_unused_categories())
 
-        list2struct.append(best_hit)
+        first_hits = chunk.drop_duplicates("gene")
+        chunk_first.append(pd.Series(first_hits.index, index=first_hits.gene))
+        chunk_hits.append(_best_hits(chunk))
 
-    out = pd.DataFrame(list2struct)
+    if len(chunk_hits) == 0:
+        return pd.DataFrame(columns=BLAST_COLS + ["gene_length", "COV"])
 
-    out = out[out["BBH"] == "<=>"]
+    best_hits = _best_hits(pd.concat([_uncategorize(df) for df in chunk_hits]))
 
-    if savefiles:
-        print("Saving results to: " + out_file)
-        out.to_csv(out_file)
+    # Order genes by their first hit in the BLAST output
+    first_seen = pd.concat([_uncategorize(s) for s in chunk_first])
+    first_seen = first_seen[~first_seen.index.duplicated()]
+    order = first_seen.reindex(best_hits.gene).values.argsort(kind="stable")
+    return best_hits.iloc[order]
+
+
+def _strip_lcl(ids):
+    """Removes the "lcl|" prefix from the categories of a categorical Series"""
+    new_cats = ids.cat.categories.str.replace(r"^lcl\|", "", regex=True)
+    if new_cats.is_unique:
+        return ids.cat.rename_categories(new_cats)
     else:
-        os.remove(bbh_file1)
-        os.remove(bbh_file2)
-    return out
+        return ids.astype(str).str.replace(r"^lcl\|", "", regex=True)
+
+
+def _best_hits(hits):
+    """Keeps the first hit with the highest percent identity for each gene"""
+    best = hits.sort_values("PID", ascending=False, kind="stable")
+    return best.drop_duplicates("gene").sort_index()
+
+
+def _uncategorize(df):
+    """Converts categorical IDs to strings so that chunks can be concatenated"""
+    if isinstance(df, pd.Series):
+        df.index = df.index.astype(str)
+        return df
+    return df.astype({"gene": str, "subject": str})
 
 
 def _get_gene_lens(file_in):
@@ -536,7 +943,7 @@ def _get_gene_lens(file_in):
     return out
 
 
-def _run_blastp(db1, db2, out, evalue, threads, force):
+def _run_blastp(db1, db2, out, evalue, threads, force, blastp="blastp"):
     """
     Runs BLASTP between two organisms
 
@@ -554,6 +961,8 @@ def _run_blastp(db1, db2, out, evalue, threads, force):
         Number of threads to use for BLAST
     force : bool
         If True, overwrite existing files
+    blastp : str
+        Path to the blastp executable (default: "blastp")
 
     Returns
     -------
@@ -567,7 +976,7 @@ def _run_blastp(db1, db2, out, evalue, threads, force):
 
     print("blasting {} vs {}".format(db1, db2))
     cmd_line = [
-        "blastp",
+        blastp,
         "-db",
         db1,
         "-query",
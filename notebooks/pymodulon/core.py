@@ -3,10 +3,13 @@ Core functions for the IcaData object
 """
 
 import copy
+import hashlib
 import re
 from typing import Dict, List, Optional
 
 from matplotlib import pyplot as plt
+from scipy.cluster import hierarchy
+from scipy.spatial.distance import squareform
 from sklearn.cluster import KMeans
 from tqdm import tqdm_notebook as tqdm
 
@@ -17,6 +20,8 @@ from pymodulon.util import (
     _check_dict,
     _check_table,
     compute_threshold,
+    mutual_info_distance_matrix,
+    single_gene_components,
 )
 
 
@@ -122,6 +127,7 @@ class IcaData(object):
         # Store M and A
         self._m = M
         self._a = A
+        self._activity_cache = {}
 
         #################
         # Load X matrix #
@@ -350,6 +356,7 @@ class IcaData(object):
         self._m.index = names
         if self._x is not None:
             self._x.index = names
+        self._regulator_matrix = None
 
     @property
     def sample_table(self):
@@ -414,6 +421,29 @@ class IcaData(object):
 
         # mark that our cutoffs are no longer optimized since the TRN
         self._cutoff_optimized = False
+        self._regulator_matrix = None
+
+    @property
+    def regulator_matrix(self) -> pd.DataFrame:
+        """
+        Boolean gene x regulator matrix of the TRN. Computed once from the TRN
+        and cached until the TRN or gene table is replaced.
+        """
+        if self._regulator_matrix is None:
+            trn = self._trn
+            if trn.empty:
+                regulators = pd.Index([], name="regulator")
+                matrix = pd.DataFrame(
+                    False, index=self._gene_table.index, columns=regulators
+                )
+            else:
+                matrix = (
+                    pd.crosstab(trn.gene_id, trn.regulator)
+                    .gt(0)
+                    .reindex(self._gene_table.index, fill_value=False)
+                )
+            self._regulator_matrix = matrix
+        return self._regulator_matrix
 
     def _update_imodulon_names(self, new_names):
 
@@ -447,6 +477,7 @@ class IcaData(object):
         self._a.index = final_names
         self._m.columns = final_names
         self._imodulon_table.index = final_names
+        self._activity_cache = {}
 
     def rename_imodulons(
         self, name_dict: Dict[ImodName, ImodName] = None, column=None
@@ -527,15 +558,95 @@ class IcaData(object):
             List of single-gene iModulons
         """
 
-        single_genes_imodulons = []
-        for imodulon in self.imodulon_names:
-            sorted_weights = abs(self.M[imodulon]).sort_values(ascending=False)
-            if sorted_weights.iloc[0] > 2 * sorted_weights.iloc[1]:
-                single_genes_imodulons.append(imodulon)
-                if save:
-                    self.imodulon_table.loc[imodulon, "single_gene"] = True
+        is_single_gene = single_gene_components(self.M)
+        single_genes_imodulons = is_single_gene.index[is_single_gene].tolist()
+        if save and len(single_genes_imodulons) > 0:
+            self.imodulon_table.loc[single_genes_imodulons, "single_gene"] = True
         return single_genes_imodulons
 
+    #######################
+    # Activity Clustering #
+    #######################
+
+    def _get_cached_activity(self, key, compute):
+        """
+        Returns a cached result computed from the A matrix, recomputing it if
+        the A matrix or iModulon names changed since it was cached
+        """
+        a_hash = hashlib.sha1(
+            pd.util.hash_pandas_object(self.A).values.tobytes()
+        ).hexdigest()
+        cached = self._activity_cache.get(key)
+        if cached is None or cached[0] != a_hash:
+            self._activity_cache[key] = (a_hash, compute())
+        return self._activity_cache[key][1]
+
+    def activity_correlation(
+        self,
+        method="pearson",
+        processes: Optional[int] = None,
+        mi_cache_dir: Optional[str] = None,
+    ) -> pd.DataFrame:
+        """
+        Correlation matrix of iModulon activities. Results are cached until the
+        A matrix changes or iModulons are renamed.
+
+        Parameters
+        ----------
+        method : str or callable
+            'pearson', 'spearman', 'kendall', 'mutual_info' or callable (see
+            :meth:`pandas.DataFrame.corr`). 'mutual_info' gives the normalized
+            mutual information between iModulons, with zeros on the diagonal.
+        processes : int
+            Number of worker processes for 'mutual_info' (default: number of
+            CPUs)
+        mi_cache_dir : str
+            Directory to cache mutual information matrices on disk (default:
+            no caching)
+
+        Returns
+        -------
+        pd.DataFrame
+            iModulon x iModulon correlation matrix
+        """
+
+        def compute():
+            if method == "mutual_info":
+                return 1 - mutual_info_distance_matrix(
+                    self.A.T, processes=processes, cache_dir=mi_cache_dir
+                )
+            return self.A.T.corr(method=method)
+
+        return self._get_cached_activity(("correlation", method), compute)
+
+    def activity_linkage(self, method="pearson", **kwargs) -> np.ndarray:
+        """
+        Complete-linkage tree of iModulon activities, using 1 - abs(correlation)
+        as the distance. Results are cached until the A matrix changes or
+        iModulons are renamed.
+
+        Parameters
+        ----------
+        method : str or callable
+            Correlation method (see :meth:`activity_correlation`)
+        **kwargs : dict, optional
+            Additional keyword arguments passed to :meth:`activity_correlation`
+
+        Returns
+        -------
+        np.ndarray
+            Linkage matrix (see :func:`scipy.cluster.hierarchy.linkage`)
+        """
+
+        def compute():
+            distances = 1 - self.activity_correlation(method, **kwargs).abs().values
+            np.fill_diagonal(distances, 0)
+            return hierarchy.linkage(
+                squareform(distances, checks=False), method="complete"
+            )
+
+        return self._get_cached_activity(("linkage", method), compute)
+
     ###############
     # Enrichments #
     ###############
@@ -765,7 +876,6 @@ class IcaData(object):
             Table of statistically significant enrichments
         """
 
-        # TODO: write test function
         # TODO: Figure out save function
 
         enrichments = []
@@ -777,15 +887,19 @@ class IcaData(object):
         else:
             imodulon_list = imodulons
 
-        for imodulon in imodulon_list:
-            gene_list = self.view_imodulon(imodulon).index
-            df_enriched = compute_annotation_enrichment(
-                set(gene_list),
-                set(self.gene_names),
-                column=column,
-                annotation=annotation,
-                fdr=fdr,
-            )
+        # Test all iModulons against the annotation matrix at once
+        gene_sets = {
+            imodulon: set(self.view_imodulon(imodulon).index)
+            for imodulon in imodulon_list
+        }
+        results = compute_annotation_enrichments(
+            gene_sets,
+            set(self.gene_names),
+            column=column,
+            annotation=annotation,
+            fdr=fdr,
+        )
+        for imodulon, df_enriched in results.items():
             df_enriched["imodulon"] = imodulon
             enrichments.append(df_enriched)
 
@@ -0,0 +1,316 @@
+"""
+Functions for selecting the ICA dimensionality from a set of ICA runs
+"""
+
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from pymodulon.util import single_gene_components
+
+
+def load_ica_runs(
+    ica_dir: os.PathLike, matrix: str = "S", cache: bool = False
+) -> Dict[int, pd.DataFrame]:
+    """
+    Loads the S (or A) matrices of all ICA runs in an ica_runs directory
+
+    Parameters
+    ----------
+    ica_dir : os.PathLike
+        Directory containing one sub-directory per dimensionality
+        (e.g. interim/ica_runs/<dim>/S.csv)
+    matrix : str
+        Matrix to load, either "S" or "A" (default: "S")
+    cache : bool
+        Store parsed matrices next to the CSV files as .npz files and re-use
+        them until the CSV file is modified (default: False)
+
+    Returns
+    -------
+    Dict[int, pd.DataFrame]
+        Matrices keyed by dimensionality, in increasing order
+    """
+
+    if matrix not in ["S", "A"]:
+        raise ValueError('matrix must be either "S" or "A"')
+
+    dims = sorted(int(x) for x in os.listdir(ica_dir) if x.isdigit())
+
+    runs = {}
+    missing = []
+    for dim in dims:
+        csv_file = os.path.join(ica_dir, str(dim), matrix + ".csv")
+        if not os.path.isfile(csv_file):
+            missing.append(dim)
+        elif cache:
+            runs[dim] = _load_cached_matrix(csv_file)
+        else:
+            runs[dim] = pd.read_csv(csv_file, index_col=0)
+
+    if len(missing) > 0:
+        warnings.warn(
+            "The following dimensionalities have no {}.csv and were "
+            "skipped: {}".format(matrix, missing)
+        )
+    if len(runs) == 0:
+        raise ValueError("No {}.csv files found in {}".format(matrix, ica_dir))
+
+    return runs
+
+
+def _load_cached_matrix(csv_file: os.PathLike) -> pd.DataFrame:
+    """
+    Loads a matrix from its .npz cache if it was written for the current
+    modification time of the CSV file, otherwise parses the CSV and refreshes
+    the cache
+    """
+    cache_file = os.path.splitext(csv_file)[0] + ".npz"
+    mtime = os.path.getmtime(csv_file)
+
+    if os.path.isfile(cache_file):
+        with np.load(cache_file) as cached:
+            if cached["mtime"] == mtime:
+                index_name = str(cached["index_name"][0]) or None
+                return pd.DataFrame(
+                    cached["values"],
+                    index=pd.Index(cached["index"].tolist(), name=index_name),
+                    columns=cached["columns"].tolist(),
+                )
+
+    df = pd.read_csv(csv_file, index_col=0)
+    index_name = "" if df.index.name is None else df.index.name
+
+    # Write to a temporary file first so interrupted runs leave no partial cache
+    tmp_file = cache_file + ".tmp"
+    with open(tmp_file, "wb") as f:
+        np.savez(
+            f,
+            values=df.values,
+            index=_to_array(df.index),
+            index_name=np.array([index_name]),
+            columns=_to_array(df.columns),
+            mtime=mtime,
+        )
+    os.replace(tmp_file, cache_file)
+    return df
+
+
+def _to_array(index: pd.Index) -> np.ndarray:
+    """
+    Converts an index to an array that can be saved without pickling
+    """
+    values = np.asarray(index)
+    if values.dtype == object:
+        values = values.astype(str)
+    return values
+
+
+def _standardize(X: np.ndarray) -> np.ndarray:
+    """
+    Centers and scales the columns of X so that X.T @ Y / n is the Pearson
+    correlation between the columns of X and Y. Constant columns become NaN.
+    """
+    X = X - X.mean(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return X / np.sqrt((X ** 2).sum(axis=0))
+
+
+def compare_dimensionalities(
+    S_runs: Dict[int, pd.DataFrame],
+    final_dim: Optional[int] = None,
+    cutoff: float = 0.7,
+) -> Tuple[pd.DataFrame, Optional[int]]:
+    """
+    Compares ICA runs at different dimensionalities to the final run
+
+    Parameters
+    ----------
+    S_runs : Dict[int, pd.DataFrame]
+        S matrices keyed by dimensionality (see :func:`load_ica_runs`)
+    final_dim : int
+        Dimensionality of the final run (default: largest dimensionality)
+    cutoff : float
+        Minimum absolute Pearson R to count a component as a final component
+        (default: 0.7)
+
+    Returns
+    -------
+    DF_stats : pd.DataFrame
+        Number of robust, final, multi-gene and single-gene components for
+        each dimensionality
+    dimensionality : int
+        Lowest dimensionality where the number of final components reaches
+        the number of multi-gene components
+    """
+
+    dims = sorted(S_runs.keys())
+    if final_dim is None:
+        final_dim = dims[-1]
+    genes = S_runs[final_dim].index
+
+    # Stack all runs and compare them to the final run in one matrix product
+    stacked = np.hstack([S_runs[dim].reindex(genes).values for dim in dims])
+    stacked = stacked.astype(float)
+    final = _standardize(S_runs[final_dim].values.astype(float))
+    with np.errstate(invalid="ignore"):
+        corrs = np.abs(final.T @ _standardize(stacked)) > cutoff
+    single_gene = single_gene_components(stacked)
+
+    bounds = np.cumsum([0] + [S_runs[dim].shape[1] for dim in dims])
+    n_components = np.diff(bounds)
+    n_final_mods = [int(corrs[:, a:b].sum()) for a, b in zip(bounds, bounds[1:])]
+    n_single_genes = [int(single_gene[a:b].sum()) for a, b in zip(bounds, bounds[1:])]
+
+    DF_stats = pd.DataFrame(
+        {
+            "Robust Components": n_components,
+            "Final Components": n_final_mods,
+            "Multi-gene Components": n_components - np.array(n_single_genes),
+            "Single Gene Components": n_single_genes,
+        },
+        index=dims,
+    )
+
+    passed = DF_stats[
+        DF_stats["Final Components"] >= DF_stats["Multi-gene Components"]
+    ]
+    if len(passed) == 0:
+        warnings.warn("No dimensionality reached the number of final components")
+        dimensionality = None
+    else:
+        dimensionality = int(passed.index[0])
+
+    return DF_stats, dimensionality
+
+
+def find_dimensionality(
+    ica_dir: os.PathLike, cutoff: float = 0.7, cache: bool = False
+) -> Tuple[pd.DataFrame, Optional[int]]:
+    """
+    Loads all ICA runs in a directory and selects the dimensionality
+
+    Parameters
+    ----------
+    ica_dir : os.PathLike
+        Directory containing one sub-directory per dimensionality
+    cutoff : float
+        Minimum absolute Pearson R to count a component as a final component
+        (default: 0.7)
+    cache : bool
+        Cache parsed S matrices as .npz files (default: False)
+
+    Returns
+    -------
+    DF_stats : pd.DataFrame
+        Number of robust, final, multi-gene and single-gene components for
+        each dimensionality
+    dimensionality : int
+        Optimal dimensionality
+    """
+    S_runs = load_ica_runs(ica_dir, cache=cache)
+    return compare_dimensionalities(S_runs, cutoff=cutoff)
+
+
+def find_strain_run_dirs(data_dir: os.PathLike) -> Dict[str, str]:
+    """
+    Finds the interim/ica_runs directory of every strain in a data directory
+
+    Parameters
+    ----------
+    data_dir : os.PathLike
+        Directory containing one sub-directory per strain
+
+    Returns
+    -------
+    Dict[str, str]
+        ica_runs directories keyed by strain
+    """
+    run_dirs = {}
+    for strain in sorted(os.listdir(data_dir)):
+        ica_dir = os.path.join(data_dir, strain, "interim", "ica_runs")
+        if os.path.isdir(ica_dir):
+            run_dirs[strain] = ica_dir
+    return run_dirs
+
+
+def _sweep_strain(args):
+    """
+    Runs find_dimensionality for a single strain in a worker process
+    """
+    ica_dir, cutoff, cache = args
+    try:
+        return find_dimensionality(ica_dir, cutoff=cutoff, cache=cache)
+    except ValueError as err:
+        return err
+
+
+def sweep_dimensionality(
+    data_dir: os.PathLike,
+    strains: Optional[List[str]] = None,
+    cutoff: float = 0.7,
+    processes: Optional[int] = None,
+    cache: bool = True,
+) -> Tuple[pd.DataFrame, pd.Series]:
+    """
+    Selects the dimensionality of every strain in a data directory, processing
+    strains in parallel
+
+    Parameters
+    ----------
+    data_dir : os.PathLike
+        Directory containing one sub-directory per strain, each with its own
+        interim/ica_runs directory
+    strains : List[str]
+        Strains to process (default: all strains with an ica_runs directory)
+    cutoff : float
+        Minimum absolute Pearson R to count a component as a final component
+        (default: 0.7)
+    processes : int
+        Number of worker processes (default: number of CPUs). Strains are
+        processed serially if processes is 1.
+    cache : bool
+        Cache parsed S matrices as .npz files, so that re-runs only parse new
+        or modified runs (default: True)
+
+    Returns
+    -------
+    DF_summary : pd.DataFrame
+        Component statistics indexed by strain and dimensionality
+    dimensionalities : pd.Series
+        Optimal dimensionality of each strain
+    """
+
+    run_dirs = find_strain_run_dirs(data_dir)
+    if strains is None:
+        strains = list(run_dirs.keys())
+    else:
+        missing = set(strains) - set(run_dirs.keys())
+        if len(missing) > 0:
+            raise ValueError("No ica_runs directory for strains: {}".format(missing))
+
+    jobs = [(run_dirs[strain], cutoff, cache) for strain in strains]
+    if processes == 1:
+        results = [_sweep_strain(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(_sweep_strain, jobs))
+
+    stats_list = {}
+    dimensionalities = {}
+    for strain, result in zip(strains, results):
+        if isinstance(result, ValueError):
+            warnings.warn("Skipping {}: {}".format(strain, result))
+            continue
+        stats_list[strain], dimensionalities[strain] = result
+
+    if len(stats_list) == 0:
+        raise ValueError("No ICA runs found in {}".format(data_dir))
+
+    DF_summary = pd.concat(stats_list, names=["strain", "dimensionality"])
+    dimensionalities = pd.Series(dimensionalities, name="dimensionality")
+    return DF_summary, dimensionalities
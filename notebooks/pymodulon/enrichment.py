@@ -2,13 +2,14 @@
 Contains functions for gene set enrichment analysis
 """
 
+import hashlib
 import itertools
 import warnings
-from typing import Set, Union
+from typing import Dict, Set, Union
 
 import numpy as np
 import pandas as pd
-from scipy import special, stats
+from scipy import sparse, special, stats
 from statsmodels.stats.multitest import fdrcorrection
 
 ImodName = Union[str, int]
@@ -304,6 +305,163 @@ def compute_trn_enrichment(
     return FDR(df_enrich, fdr=fdr, total=total)
 
 
+# Term x gene matrices of recently used annotation tables, keyed by content hash
+_ANNOTATION_MATRIX_CACHE = {}
+_ANNOTATION_MATRIX_CACHE_SIZE = 8
+
+
+def _annotation_matrix(annotation: pd.DataFrame, column: str):
+    """
+    Builds a sparse term x gene matrix for an annotation table. Results are
+    cached by the content of the gene_id and annotation columns, so repeated
+    enrichments against the same table only build the matrix once.
+
+    Parameters
+    ----------
+    annotation : pd.DataFrame
+        Table containing gene annotations
+    column : str
+        Name of column in the annotation DataFrame
+
+    Returns
+    -------
+    terms : pd.Index
+        Sorted annotation terms (rows of the matrix)
+    genes : pd.Index
+        Annotated genes (columns of the matrix)
+    matrix : sparse.csr_matrix
+        Binary matrix marking the genes of each term
+    target_sizes : np.ndarray
+        Number of annotation rows for each term
+    """
+    table = annotation[["gene_id", column]].dropna(subset=[column])
+    key = (
+        column,
+        hashlib.sha1(
+            pd.util.hash_pandas_object(table, index=False).values.tobytes()
+        ).hexdigest(),
+    )
+    if key in _ANNOTATION_MATRIX_CACHE:
+        return _ANNOTATION_MATRIX_CACHE[key]
+
+    term_codes, terms = pd.factorize(table[column], sort=True)
+    gene_codes, genes = pd.factorize(table["gene_id"])
+    matrix = sparse.csr_matrix(
+        (np.ones(len(table)), (term_codes, gene_codes)),
+        shape=(len(terms), len(genes)),
+    )
+    matrix.data[:] = 1
+    target_sizes = np.bincount(term_codes, minlength=len(terms))
+
+    if len(_ANNOTATION_MATRIX_CACHE) >= _ANNOTATION_MATRIX_CACHE_SIZE:
+        _ANNOTATION_MATRIX_CACHE.pop(next(iter(_ANNOTATION_MATRIX_CACHE)))
+    _ANNOTATION_MATRIX_CACHE[key] = (
+        pd.Index(terms),
+        pd.Index(genes),
+        matrix,
+        target_sizes,
+    )
+    return _ANNOTATION_MATRIX_CACHE[key]
+
+
+def compute_annotation_enrichments(
+    gene_sets: Dict[ImodName, Set],
+    all_genes: Set,
+    annotation: pd.DataFrame,
+    column: str,
+    fdr: float = 0.01,
+) -> Dict[ImodName, pd.DataFrame]:
+    """
+    Compare many gene sets against a dataframe of gene annotations. The overlaps
+    between all gene sets and all annotation terms are computed with one sparse
+    matrix product, followed by vectorized Fisher's exact tests. FDR correction
+    is applied separately to each gene set.
+
+    Parameters
+    ----------
+    gene_sets : Dict[ImodName, Set]
+        Gene sets for enrichment (e.g. genes in each iModulon)
+    all_genes : Set
+        List of all genes
+    annotation : pd.DataFrame
+        Table containing gene annotations
+    column : str
+        Name of column in the annotation DataFrame
+    fdr : float
+        False detection rate (default: 0.01)
+
+    Returns
+    -------
+    Dict[ImodName, pd.DataFrame]
+        Table of statistically significant enrichments for each gene set
+    """
+
+    all_genes = set(all_genes)
+    terms, genes, matrix, target_sizes = _annotation_matrix(annotation, column)
+    if len(set(genes) - all_genes) > 0:
+        raise ValueError("Annotation contains genes not in all_genes")
+
+    names = list(gene_sets.keys())
+    if len(names) == 0:
+        return {}
+    set_sizes = np.zeros(len(names))
+    rows, cols = [], []
+    for i, name in enumerate(names):
+        gene_set = set(gene_sets[name])
+        if len(gene_set - all_genes) > 0:
+            raise ValueError("Gene sets contain genes not in all_genes")
+        set_sizes[i] = len(gene_set)
+        idx = genes.get_indexer(list(gene_set))
+        idx = idx[idx >= 0]
+        rows.append(np.full(len(idx), i))
+        cols.append(idx)
+
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    membership = sparse.csr_matrix(
+        (np.ones(len(rows)), (rows, cols)), shape=(len(names), len(genes))
+    )
+
+    # Contingency tables for every gene set and term
+    tp = (membership @ matrix.T).toarray()
+    term_sizes = np.asarray(matrix.sum(axis=1)).ravel()
+    fp = term_sizes[None, :] - tp
+    fn = set_sizes[:, None] - tp
+    tn = len(all_genes) - tp - fp - fn
+
+    # One-sided Fisher's exact test, as in scipy.stats.fisher_exact
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pvalue = stats.hypergeom.cdf(fp, len(all_genes), tp + fp, fp + tn)
+        pvalue = np.minimum(pvalue, 1)
+        recall = np.true_divide(tp, tp + fn)
+        precision = np.true_divide(tp, tp + fp)
+        f1score = (2 * precision * recall) / (precision + recall)
+
+    # Handle edge cases
+    no_overlap = tp == 0
+    exact = ~no_overlap & (fp == 0) & (fn == 0)
+    pvalue[no_overlap], pvalue[exact] = 1, 0
+    for values in [precision, recall, f1score]:
+        values[no_overlap], values[exact] = 0, 1
+
+    results = {}
+    for i, name in enumerate(names):
+        df_enrich = pd.DataFrame(
+            {
+                "pvalue": pvalue[i],
+                "precision": precision[i],
+                "recall": recall[i],
+                "f1score": f1score[i],
+                "TP": tp[i],
+                "target_set_size": target_sizes,
+                "gene_set_size": set_sizes[i],
+            },
+            index=terms,
+            dtype=float,
+        )
+        results[name] = FDR(df_enrich, fdr=fdr)
+    return results
+
+
 def compute_annotation_enrichment(
     gene_set: Set,
     all_genes: Set,
@@ -333,12 +491,7 @@ def compute_annotation_enrichment(
        Table containing statistically significant enrichments
     """
 
-    # TODO: Create test functions
-    enrich_list = []
-    for name, group in annotation.groupby(column):
-        target_genes = group["gene_id"]
-        enrich_list.append(
-            compute_enrichment(gene_set, target_genes, all_genes, label=name)
-        )
-    df_enrich = pd.concat(enrich_list, axis=1).T
-    return FDR(df_enrich, fdr=fdr)
+    results = compute_annotation_enrichments(
+        {0: gene_set}, all_genes, annotation, column, fdr=fdr
+    )
+    return results[0]
@@ -3,9 +3,13 @@ Utility functions for gene annotation
 """
 
 import re
-import urllib
-from io import StringIO
-from typing import Optional
+import sqlite3
+import time
+import urllib.parse
+import urllib.request
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
 
 import pandas as pd
 
@@ -85,9 +89,47 @@ def _get_attr(attributes: str, attr_id: str, ignore: bool = False) -> Optional[s
             raise ValueError("{} not in attributes: {}".format(attr_id, attributes))
 
 
+def _parse_attributes(attributes: str) -> Dict[str, str]:
+    """
+    Helper function for parsing GFF annotations. Splits an attribute string
+    into a dictionary, keeping the first value of repeated attributes.
+
+    Parameters
+    ----------
+    attributes : str
+        Attribute string
+
+    Returns
+    -------
+    Dict[str, str]
+        Raw value of each attribute
+    """
+    attrs = {}
+    for field in attributes.split(";"):
+        key, sep, value = field.partition("=")
+        if sep and key not in attrs:
+            attrs[key] = value
+    return attrs
+
+
+GFF_COLUMNS = [
+    "refseq",
+    "source",
+    "feature",
+    "start",
+    "end",
+    "score",
+    "strand",
+    "phase",
+    "attributes",
+]
+
+
 def gff2pandas(gff_file: str):
     """
-    Converts a GFF file to a DataFrame
+    Converts a GFF file to a DataFrame of CDSs. The file is read in a single
+    pass, and the attributes of each feature are only split once.
+
     Parameters
     ----------
     gff_file : str
@@ -99,62 +141,167 @@ def gff2pandas(gff_file: str):
         GFF formatted as a DataFrame
     """
 
-    with open(gff_file, "r") as f:
-        lines = f.readlines()
-
-    # Get lines to skip
-    skiprow = sum([line.startswith("#") for line in lines])
-
-    # Read GFF
-    names = [
-        "refseq",
-        "source",
-        "feature",
-        "start",
-        "end",
-        "score",
-        "strand",
-        "phase",
-        "attributes",
-    ]
-    DF_gff = pd.read_csv(gff_file, sep="\t", skiprows=skiprow, names=names, header=None)
+    cds_rows = []
+    cds_attrs = []
+    old_locus_tags = {}
 
-    # Filter for CDSs
-    DF_cds = DF_gff[DF_gff.feature == "CDS"]
+    with open(gff_file, "r") as f:
+        for line in f:
+            # Skip comments and directives, and stop at an embedded FASTA
+            if line.startswith("#"):
+                if line.startswith("##FASTA"):
+                    break
+                continue
+            fields = line.rstrip("\r\n").split("\t")
+            if len(fields) < 9:
+                continue
+
+            feature = fields[2]
+            if feature == "CDS":
+                attrs = _parse_attributes(fields[8])
+                if "locus_tag" not in attrs:
+                    raise ValueError(
+                        "locus_tag not in attributes: {}".format(fields[8])
+                    )
+                cds_rows.append(fields[:9])
+                cds_attrs.append(attrs)
+
+            # Also use genes to get old_locus_tag
+            elif feature == "gene":
+                attrs = _parse_attributes(fields[8])
+                if "locus_tag" in attrs:
+                    old_locus_tags.setdefault(attrs["locus_tag"], []).append(
+                        attrs.get("old_locus_tag")
+                    )
+
+    DF_cds = pd.DataFrame(cds_rows, columns=GFF_COLUMNS)
+    DF_cds["start"] = DF_cds.start.astype(int)
+    DF_cds["end"] = DF_cds.end.astype(int)
 
-    # Also filter for genes to get old_locus_tag
-    DF_gene = DF_gff[DF_gff.feature == "gene"].reset_index()
-    DF_gene["locus_tag"] = DF_gene.attributes.apply(
-        _get_attr, attr_id="locus_tag", ignore=True
-    )
-    DF_gene["old_locus_tag"] = DF_gene.attributes.apply(
-        _get_attr, attr_id="old_locus_tag", ignore=True
-    )
-    DF_gene = DF_gene[["locus_tag", "old_locus_tag"]]
-    DF_gene = DF_gene[DF_gene.locus_tag.notnull()]
+    # Extract attribute information
+    DF_cds["locus_tag"] = [attrs["locus_tag"] for attrs in cds_attrs]
+    DF_cds["gene_name"] = [attrs.get("gene") for attrs in cds_attrs]
+    DF_cds["gene_product"] = [attrs.get("product") for attrs in cds_attrs]
+    DF_cds["ncbi_protein"] = [attrs.get("protein_id") for attrs in cds_attrs]
 
     # Sort by start position
     DF_cds = DF_cds.sort_values("start")
 
-    # Extract attribute information
-    DF_cds["locus_tag"] = DF_cds.attributes.apply(_get_attr, attr_id="locus_tag")
-
-    DF_cds["gene_name"] = DF_cds.attributes.apply(
-        _get_attr, attr_id="gene", ignore=True
+    # Merge in old_locus_tag
+    DF_gene = pd.DataFrame(
+        [(tag, old) for tag, olds in old_locus_tags.items() for old in olds],
+        columns=["locus_tag", "old_locus_tag"],
     )
+    DF_cds = pd.merge(DF_cds, DF_gene, how="left", on="locus_tag", sort=False)
 
-    DF_cds["gene_product"] = DF_cds.attributes.apply(
-        _get_attr, attr_id="product", ignore=True
-    )
+    return DF_cds
 
-    DF_cds["ncbi_protein"] = DF_cds.attributes.apply(
-        _get_attr, attr_id="protein_id", ignore=True
-    )
 
-    # Merge in old_locus_tag
-    DF_cds = pd.merge(DF_cds, DF_gene, how="left", on="locus_tag", sort=False)
+#######################
+# Sequence Extraction #
+#######################
 
-    return DF_cds
+# Complement of each IUPAC nucleotide code, used to reverse complement in bulk
+_COMPLEMENT = bytes.maketrans(
+    b"ACGTUMRWSYKVHDBNacgtumrwsykvhdbn", b"TGCAAKYWSRMBDHVNtgcaakywsrmbdhvn"
+)
+
+
+def _read_fasta_bytes(fasta_file: str) -> Dict[str, bytes]:
+    """
+    Helper function that loads every record of a FASTA file as a byte buffer
+
+    Parameters
+    ----------
+    fasta_file : str
+        Path to FASTA file
+
+    Returns
+    -------
+    Dict[str, bytes]
+        Sequence of each record, keyed by record ID
+    """
+    contigs = {}
+    with open(fasta_file, "rb") as f:
+        # Records start with ">" at the beginning of a line. Anything before
+        # the first record is skipped, and ">" within headers is kept.
+        records = (b"\n" + f.read()).split(b"\n>")[1:]
+    for record in records:
+        header, _, seq = record.partition(b"\n")
+        seq_id = header.split(None, 1)[0].decode() if header.strip() else ""
+        contigs[seq_id] = b"".join(seq.split())
+    return contigs
+
+
+def extract_cds(
+    DF_annot: pd.DataFrame,
+    fasta_files: List[str],
+    out_file: str,
+    line_width: int = 60,
+) -> int:
+    """
+    Writes the nucleotide sequence of every gene to a FASTA file (e.g. CDS.fna
+    for EggNOG mapper). Minus-strand genes are reverse complemented.
+
+    Parameters
+    ----------
+    DF_annot : pd.DataFrame
+        Gene annotation indexed by locus tag, with the refseq, start, end,
+        strand and gene_name columns from :func:`gff2pandas`
+    fasta_files : List[str]
+        FASTA files of the genome and plasmids
+    out_file : str
+        Path to output FASTA file
+    line_width : int
+        Number of bases per line (default: 60)
+
+    Returns
+    -------
+    int
+        Number of sequences written
+    """
+
+    chunks = []
+    for fasta_file in fasta_files:
+        for seq_id, contig in _read_fasta_bytes(fasta_file).items():
+            df_genes = DF_annot[DF_annot.refseq == seq_id]
+            if len(df_genes) == 0:
+                continue
+
+            starts = df_genes.start.values.astype(int) - 1
+            ends = df_genes.end.values.astype(int)
+            minus = (df_genes.strand == "-").values
+            seqs = [contig[start:end] for start, end in zip(starts, ends)]
+
+            # Reverse complement all minus-strand genes at once. Reversing the
+            # joined buffer also reverses the gene order, which is undone below.
+            if minus.any():
+                joined = b"\n".join(seq for seq, rev in zip(seqs, minus) if rev)
+                rev_seqs = joined.translate(_COMPLEMENT)[::-1].split(b"\n")
+                rev_seqs = iter(rev_seqs[::-1])
+                seqs = [next(rev_seqs) if rev else seq for seq, rev in zip(seqs, minus)]
+
+            names = df_genes.index.astype(str)
+            descriptions = df_genes.gene_name.where(df_genes.gene_name.notnull(), names)
+            for name, desc, seq in zip(names, descriptions, seqs):
+                # Only repeat the ID if the description does not start with it
+                desc = str(desc)
+                if not desc.strip():
+                    title = name
+                elif desc.split(None, 1)[0] == name:
+                    title = desc
+                else:
+                    title = "{} {}".format(name, desc)
+                lines = [
+                    seq[i : i + line_width] for i in range(0, len(seq), line_width)
+                ]
+                chunks.append(b">" + title.encode() + b"\n")
+                chunks.append(b"".join(line + b"\n" for line in lines))
+
+    with open(out_file, "wb") as f:
+        f.write(b"".join(chunks))
+
+    return len(chunks) // 2
 
 
 ##############
@@ -162,12 +309,114 @@ def gff2pandas(gff_file: str):
 ##############
 
 
+UNIPROT_URL = "https://www.uniprot.org/uploadlists/"
+
+
+def _query_uniprot(
+    prot_list: List[str],
+    input_id: str,
+    output_id: str,
+    url: str = UNIPROT_URL,
+    timeout: float = 300,
+) -> List[Tuple[str, str]]:
+    """
+    Sends one request to the uniprot ID mapping tool. This is the default
+    backend for uniprot_id_mapping.
+
+    Parameters
+    ----------
+    prot_list : List[str]
+        List of proteins to be mapped
+    input_id : str
+        ID type for the mapping input
+    output_id : str
+        ID type for the mapping output
+    url : str
+        URL of the ID mapping service (default: UNIPROT_URL)
+    timeout : float
+        Seconds to wait for a response (default: 300)
+
+    Returns
+    -------
+    List[Tuple[str, str]]
+        Pairs of input and output IDs
+    """
+
+    params = {
+        "from": input_id,
+        "to": output_id,
+        "format": "tab",
+        "query": " ".join(prot_list),
+    }
+
+    # Send mapping request to uniprot
+    data = urllib.parse.urlencode(params)
+    data = data.encode("utf-8")
+    req = urllib.request.Request(url, data)
+    with urllib.request.urlopen(req, timeout=timeout) as f:
+        response = f.read()
+
+    # Skip the header line
+    lines = response.decode("utf-8").splitlines()[1:]
+    return [tuple(line.split("\t")[:2]) for line in lines if "\t" in line]
+
+
+def _query_with_retries(
+    backend: Callable,
+    prot_list: List[str],
+    input_id: str,
+    output_id: str,
+    retries: int,
+    backoff: float,
+) -> List[Tuple[str, str]]:
+    """
+    Helper function that calls the backend, retrying failed requests with an
+    exponential backoff
+    """
+    for attempt in range(retries + 1):
+        try:
+            return backend(prot_list, input_id, output_id)
+        except OSError as err:
+            if attempt == retries:
+                raise
+            warnings.warn(
+                "UniProt request failed ({}), retrying in {:.1f}s".format(
+                    err, backoff * 2 ** attempt
+                )
+            )
+            time.sleep(backoff * 2 ** attempt)
+
+
+def _open_mapping_cache(cache_file: str) -> sqlite3.Connection:
+    """
+    Opens the SQLite ID mapping cache, creating its tables if necessary. IDs
+    without any mapping are stored with a NULL output so they are not fetched
+    again.
+    """
+    conn = sqlite3.connect(cache_file)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS id_mapping ("
+        "input_type TEXT, output_type TEXT, input_id TEXT, output_id TEXT)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS id_mapping_input "
+        "ON id_mapping (input_type, output_type, input_id)"
+    )
+    return conn
+
+
 def uniprot_id_mapping(
     prot_list,
     input_id="ACC+ID",
     output_id="P_REFSEQ_AC",
     input_name="input_id",
     output_name="output_id",
+    batch_size: int = 5000,
+    threads: int = 4,
+    retries: int = 3,
+    backoff: float = 1,
+    cache_file: Optional[str] = None,
+    backend: Optional[Callable] = None,
 ):
     """
     Python wrapper for the uniprot ID mapping tool (See
@@ -185,6 +434,21 @@ def uniprot_id_mapping(
         Column name for input IDs
     output_name : str
         Column name for output IDs
+    batch_size : int
+        Maximum number of proteins per request (default: 5000)
+    threads : int
+        Number of requests to run at the same time (default: 4)
+    retries : int
+        Number of times to retry a failed request (default: 3)
+    backoff : float
+        Seconds to wait before the first retry. The wait doubles after every
+        failed attempt. (default: 1)
+    cache_file : str
+        Path to a SQLite file that stores previous mappings. Proteins found in
+        the cache are not requested again. (default: None)
+    backend : Callable
+        Function called as backend(prot_list, input_id, output_id) that returns
+        a list of (input, output) ID pairs (default: the uniprot web service)
 
     Returns
     -------
@@ -194,25 +458,72 @@ def uniprot_id_mapping(
 
     """
 
-    url = "https://www.uniprot.org/uploadlists/"
-
-    params = {
-        "from": input_id,
-        "to": output_id,
-        "format": "tab",
-        "query": " ".join(prot_list),
-    }
-
-    # Send mapping request to uniprot
-    data = urllib.parse.urlencode(params)
-    data = data.encode("utf-8")
-    req = urllib.request.Request(url, data)
-    with urllib.request.urlopen(req) as f:
-        response = f.read()
+    if backend is None:
+        backend = _query_uniprot
+
+    # Remove empty and duplicate IDs
+    prot_list = list(dict.fromkeys(p for p in prot_list if isinstance(p, str) and p))
+
+    pairs = []
+    conn = None
+    if cache_file is not None:
+        conn = _open_mapping_cache(cache_file)
+        cached = set()
+        query = (
+            "SELECT input_id, output_id FROM id_mapping "
+            "WHERE input_type = ? AND output_type = ? AND input_id IN ({})"
+        )
+        for i in range(0, len(prot_list), 500):
+            batch = prot_list[i : i + 500]
+            rows = conn.execute(
+                query.format(",".join("?" * len(batch))),
+                [input_id, output_id] + batch,
+            )
+            for in_id, out_id in rows:
+                cached.add(in_id)
+                if out_id is not None:
+                    pairs.append((in_id, out_id))
+        prot_list = [p for p in prot_list if p not in cached]
+
+    # Send mapping requests to uniprot in concurrent batches
+    batches = [
+        prot_list[i : i + batch_size] for i in range(0, len(prot_list), batch_size)
+    ]
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+            futures = [
+                executor.submit(
+                    _query_with_retries,
+                    backend,
+                    batch,
+                    input_id,
+                    output_id,
+                    retries,
+                    backoff,
+                )
+                for batch in batches
+            ]
+            for batch, future in zip(batches, futures):
+                new_pairs = [tuple(pair) for pair in future.result()]
+                pairs.extend(new_pairs)
+
+                # Cache each batch as soon as it is done
+                if conn is not None:
+                    mapped = {in_id for in_id, _ in new_pairs}
+                    rows = [(in_id, out_id) for in_id, out_id in new_pairs] + [
+                        (in_id, None) for in_id in batch if in_id not in mapped
+                    ]
+                    conn.executemany(
+                        "INSERT INTO id_mapping VALUES (?, ?, ?, ?)",
+                        [(input_id, output_id) + row for row in rows],
+                    )
+                    conn.commit()
+    finally:
+        if conn is not None:
+            conn.close()
 
     # Load result to pandas dataframe
-    text = StringIO(response.decode("utf-8"))
-    mapping = pd.read_csv(text, sep="\t", header=0, names=[input_name, output_name])
+    mapping = pd.DataFrame(pairs, columns=[input_name, output_name])
 
     # Only keep one uniprot ID per gene
     mapping = mapping.sort_values(output_name).drop_duplicates(input_name)
@@ -6,7 +6,7 @@ import os
 import re
 import sys
 from itertools import chain
-from typing import List, Optional, Set, Union
+from typing import Dict, List, Optional, Set, Union
 from zipfile import ZipFile
 
 import numpy as np
@@ -15,7 +15,7 @@ from matplotlib.colors import to_hex
 from tqdm.notebook import tqdm
 
 from pymodulon.core import IcaData
-from pymodulon.plotting import _broken_line, _get_fit, _solid_line
+from pymodulon.plotting import _broken_line, _get_fits, _solid_line
 
 ##################
 # User Functions #
@@ -512,8 +512,9 @@ def imdb_generate_im_files(
     None
     """
 
+    reg_scatters = imdb_regulon_scatter_dfs(model)
     for k in tqdm(model.imodulon_table.index):
-        make_im_directory(model, k, path_prefix, gene_scatter_x)
+        make_im_directory(model, k, path_prefix, gene_scatter_x, reg_scatters)
 
 
 def imdb_generate_gene_files(model: IcaData, path_prefix: Optional[str] = "."):
@@ -660,8 +661,9 @@ def _component_DF(model: IcaData, k: Union[int, str], tfs=None):
         df["regulator"] = model.gene_table.regulator.fillna("")
 
     if tfs is not None:
+        tf_bools = model.regulator_matrix.reindex(columns=tfs, fill_value=False)
         for tf in tfs:
-            df[tf] = [tf in regs.split(",") for regs in df["regulator"]]
+            df[tf] = tf_bools[tf]
 
     return df.sort_values("gene_weight")
 
@@ -690,6 +692,46 @@ def _tf_combo_string(row: pd.Series):
         return ", ".join(row.index[row][:-1]) + ", and " + row.index[row][-1]
 
 
+def _tf_combo_labels(model: IcaData, tfs: List[str], genes: pd.Index):
+    """
+    Creates the _tf_combo_string label of each gene for a set of TFs. The TF
+    columns of the cached regulator matrix are bit-packed into one integer per
+    gene, so each label is only built once per unique combination. Helper
+    function for imdb_gene_hist_df.
+
+    Parameters
+    ----------
+    model : IcaData
+        IcaData object
+    tfs : List[str]
+        List of TFs
+    genes : pd.Index
+        Genes to label
+
+    Returns
+    -------
+    np.ndarray
+        Array of combination strings for each gene
+    """
+
+    if len(tfs) == 0:
+        return np.full(len(genes), "unreg", dtype=object)
+
+    tf_bools = model.regulator_matrix.reindex(
+        index=genes, columns=tfs, fill_value=False
+    ).values
+    codes = np.zeros(len(genes), dtype=object if len(tfs) > 62 else np.int64)
+    for i in range(len(tfs)):
+        codes[tf_bools[:, i]] += 1 << i
+
+    unique_codes, inverse = np.unique(codes, return_inverse=True)
+    labels = np.empty(len(unique_codes), dtype=object)
+    for j, code in enumerate(unique_codes):
+        bits = pd.Series([(code >> i) & 1 == 1 for i in range(len(tfs))], index=tfs)
+        labels[j] = _tf_combo_string(bits)
+    return labels[inverse.ravel()]
+
+
 def _sort_tf_strings(tfs: List[str], unique_elts: List[str]):
     """
     Sorts TF strings for the legend of the histogram. Helper function for
@@ -768,26 +810,17 @@ def imdb_gene_hist_df(
     DF_gene = _component_DF(model, k, tfs)
 
     # add a tf_combo column
-    if len(tfs) == 0:
-        DF_gene["tf_combos"] = ["unreg"] * DF_gene.shape[0]
-    else:
-        tf_bools = DF_gene[tfs]
-        DF_gene["tf_combos"] = [
-            _tf_combo_string(tf_bools.loc[g]) for g in tf_bools.index
-        ]
+    DF_gene["tf_combos"] = _tf_combo_labels(model, tfs, DF_gene.index)
 
     # get the list of tf combos in the correct order
     tf_combo_order = _sort_tf_strings(tfs, list(DF_gene.tf_combos.unique()))
 
     # compute bins
-    xmin = min(min(DF_gene.gene_weight), -model.thresholds[k])
-    xmax = max(max(DF_gene.gene_weight), model.thresholds[k])
-    width = (
-        2
-        * model.thresholds[k]
-        / (np.floor(2 * model.thresholds[k] * bins / (xmax - xmin) - 1))
-    )
-    xmin = -model.thresholds[k] - width * np.ceil((-model.thresholds[k] - xmin) / width)
+    thresh = model.thresholds[k]
+    xmin = min(min(DF_gene.gene_weight), -thresh)
+    xmax = max(max(DF_gene.gene_weight), thresh)
+    width = 2 * thresh / (np.floor(2 * thresh * bins / (xmax - xmin) - 1))
+    xmin = -thresh - width * np.ceil((-thresh - xmin) / width)
     xmax = xmin + width * bins
 
     # column headers: bin middles
@@ -796,47 +829,42 @@ def imdb_gene_hist_df(
     res = pd.DataFrame(index=index, columns=columns)
 
     # row 0: threshold indices and number of unique tf combos
-    thresh1 = -model.thresholds[k]
-    thresh2 = model.thresholds[k]
     num_combos = len(tf_combo_order)
-    res.loc["thresh"] = [thresh1, thresh2, num_combos] + [np.nan] * (len(columns) - 3)
+    res.loc["thresh"] = [-thresh, thresh, num_combos] + [np.nan] * (len(columns) - 3)
 
-    # next set of rows: heights of bars
-    for r in tf_combo_order:
-        res.loc[r] = np.histogram(
-            DF_gene.gene_weight[DF_gene.tf_combos == r], bins, (xmin, xmax)
-        )[0]
-
-    # last set of rows: gene names
-    for b_mid in columns:
-
-        # get the bin bounds
-        b_lower = b_mid - width / 2
-        b_upper = b_lower + width
-        for r in tf_combo_order:
-            # get the genes for this regulator and bin
-            genes = DF_gene.index[
-                (DF_gene.tf_combos == r)
-                & (DF_gene.gene_weight < b_upper)
-                & (DF_gene.gene_weight > b_lower)
-            ]
-            # use the gene names, and get them with num2name (more robust)
-            genes = [model.num2name(g) for g in genes]
+    # assign every gene to a bin; bin bounds are exclusive
+    b_lower = columns - width / 2
+    b_upper = b_lower + width
+    weights = DF_gene.gene_weight.values
+    gene_bins = np.digitize(weights, b_lower, right=True) - 1
+    in_bin = gene_bins >= 0
+    in_bin[in_bin] = weights[in_bin] < b_upper[gene_bins[in_bin]]
 
-            res.loc[r, b_mid] = len(genes)
+    combos = pd.Categorical(DF_gene.tf_combos, categories=tf_combo_order).codes
+    combos, gene_bins = combos[in_bin], gene_bins[in_bin]
 
-            gene_list = np.array2string(np.array(genes), separator=" ")
+    # next set of rows: heights of bars
+    counts = np.zeros((num_combos, len(columns)), dtype=int)
+    np.add.at(counts, (combos, gene_bins), 1)
+    res.iloc[1 : num_combos + 1] = counts
 
-            # don't list unregulated genes unless they are in the i-modulon
-            if r == "unreg":
-                if (b_lower + tol >= model.thresholds[k]) or (
-                    b_upper - tol <= -model.thresholds[k]
-                ):
-                    res.loc[r + "_genes", b_mid] = gene_list
-                else:
-                    res.loc[r + "_genes", b_mid] = "[]"
-            else:
-                res.loc[r + "_genes", b_mid] = gene_list
+    # last set of rows: gene names
+    # don't list unregulated genes unless they are in the i-modulon
+    names = model.gene_table.loc[DF_gene.index[in_bin], "gene_name"].values
+    listed = np.ones(len(names), dtype=bool)
+    if "unreg" in tf_combo_order:
+        in_imod = (b_lower + tol >= thresh) | (b_upper - tol <= -thresh)
+        listed = (combos != tf_combo_order.index("unreg")) | in_imod[gene_bins]
+
+    gene_lists = np.full((num_combos, len(columns)), "[]", dtype=object)
+    grouped = pd.Series(names[listed]).groupby(
+        [combos[listed], gene_bins[listed]], sort=False
+    )
+    for (combo, b), genes in grouped:
+        gene_lists[combo, b] = np.array2string(
+            np.array(genes.tolist()), separator=" "
+        )
+    res.iloc[num_combos + 1 :] = gene_lists
     return res
 
 
@@ -1209,7 +1237,33 @@ def imdb_regulon_venn_df(model: IcaData, k: Union[str, int]):
 # Regulon Scatter Plot
 
 
-def _get_tfs_to_scatter(model: IcaData, tf_string: Union[str, float]):
+def _tf_loci(model: IcaData) -> Dict[str, str]:
+    """
+    Maps case-folded gene names to locus tags. As in IcaData.name2num, the
+    first locus is used for gene names that appear more than once.
+
+    Parameters
+    ----------
+    model : IcaData
+        IcaData object
+
+    Returns
+    -------
+    Dict[str, str]
+        Locus tags keyed by case-folded gene name
+    """
+    if "gene_name" not in model.gene_table.columns:
+        return {}
+    names = model.gene_table.gene_name.dropna().astype(str)
+    loci = pd.Series(names.index, index=names.str.casefold().values)
+    return loci[~loci.index.duplicated()].to_dict()
+
+
+def _get_tfs_to_scatter(
+    model: IcaData,
+    tf_string: Union[str, float],
+    tf_loci: Optional[Dict[str, str]] = None,
+):
     """
 
     Parameters
@@ -1218,6 +1272,8 @@ def _get_tfs_to_scatter(model: IcaData, tf_string: Union[str, float]):
         IcaData object
     tf_string : Union[str,np.nan]
         String of TFs, or np.nan
+    tf_loci : Dict[str, str]
+        Output of _tf_loci(model), to avoid recomputing it for every iModulon
     Returns
     -------
     List
@@ -1235,6 +1291,9 @@ def _get_tfs_to_scatter(model: IcaData, tf_string: Union[str, float]):
         "ntrC": "glnG",
         "gutR": "srlR",
     }
+    if tf_loci is None:
+        tf_loci = _tf_loci(model)
+
     res = []
     if type(tf_string) == str:
 
@@ -1247,19 +1306,18 @@ def _get_tfs_to_scatter(model: IcaData, tf_string: Union[str, float]):
             if tf in rename_tfs.keys():
                 tf = rename_tfs[tf]
 
-            try:
-                b_num = model.name2num(tf)
-                if b_num in model.X.index:
-                    res += [tf]
-            except ValueError:
+            b_num = tf_loci.get(tf.casefold())
+            if b_num is None:
                 print("TF has no associated expression profile:", tf)
                 print("If %s is not a gene, this behavior is expected." % tf)
                 print(
                     "If it is a gene, use consistent naming"
                     " between the TRN and gene_table."
                 )
+            elif b_num in model.X.index:
+                res += [tf]
 
-    res = list(set(res))  # remove duplicates
+    res = list(dict.fromkeys(res))  # remove duplicates
     return res
 
 
@@ -1278,45 +1336,87 @@ def imdb_regulon_scatter_df(model: IcaData, k: Union[str, int]):
     pd.DataFrame
         A dataframe for producing the regulon scatter plots in iModulonDB
     """
+    return imdb_regulon_scatter_dfs(model, [k])[k]
 
-    row = model.imodulon_table.loc[k]
-    tfs = _get_tfs_to_scatter(model, row.TF)
 
-    if len(tfs) == 0:
-        return None
+def imdb_regulon_scatter_dfs(
+    model: IcaData, imodulons: Optional[List] = None
+) -> Dict[Union[str, int], Optional[pd.DataFrame]]:
+    """
+    Generates the regulon scatter plot tables of many iModulons at once. The
+    regulator-vs-activity fits of all iModulons and TFs are computed together.
 
-    # coordinates for points
-    coord = pd.DataFrame(columns=["A"] + tfs, index=model.A.columns)
-    coord["A"] = model.A.loc[k]
+    Parameters
+    ----------
+    model : IcaData
+        IcaData object
+    imodulons : List
+        iModulon names (default: all iModulons)
 
-    # params for fit line
-    param_df = pd.DataFrame(
-        columns=["A"] + tfs, index=["R2", "xmin", "xmid", "xmax", "ystart", "yend"]
-    )
+    Returns
+    -------
+    Dict[Union[str, int], Optional[pd.DataFrame]]
+        Output of imdb_regulon_scatter_df for each iModulon (None if the
+        iModulon has no TFs to scatter)
+    """
 
-    # fill in dfs
-    for tf in tfs:
+    if imodulons is None:
+        imodulons = model.imodulon_table.index
 
-        # coordinates
-        coord[tf] = model.X.loc[model.name2num(tf)]
-        xlim = np.array([coord[tf].min(), coord[tf].max()])
-        # fit line
-        params, r2 = _get_fit(coord[tf], coord["A"])
+    tf_loci = _tf_loci(model)
+    tfs = {
+        k: _get_tfs_to_scatter(model, model.imodulon_table.loc[k, "TF"], tf_loci)
+        for k in imodulons
+    }
+    pairs = [(k, tf) for k in imodulons for tf in tfs[k]]
+    if len(pairs) == 0:
+        return {k: None for k in imodulons}
+
+    # stack the expression and activity profiles of all iModulon-TF pairs
+    x_rows = model.X.index.get_indexer([tf_loci[tf.casefold()] for _, tf in pairs])
+    a_rows = model.A.index.get_indexer([k for k, _ in pairs])
+    X = model.X.values[x_rows].astype(float)
+    A = model.A.values[a_rows].astype(float)
+
+    # params for fit lines
+    all_params, all_r2 = _get_fits(X, A)
+    stats = np.empty((len(pairs), 6))
+    for i, (params, r2) in enumerate(zip(all_params, all_r2)):
+        xlim = np.array([X[i].min(), X[i].max()])
         if len(params) == 2:  # unbroken
             y = _solid_line(xlim, *params)
-            out = [xlim[0], np.nan, xlim[1], y[0], y[1]]
+            stats[i] = [r2, xlim[0], np.nan, xlim[1], y[0], y[1]]
         else:  # broken
             xvals = np.array([xlim[0], params[2], xlim[1]])
             y = _broken_line(xvals, *params)
-            out = [xlim[0], params[2], xlim[1], y[0], y[2]]
+            stats[i] = [r2, xlim[0], params[2], xlim[1], y[0], y[2]]
 
-        param_df[tf] = [r2] + out
-
-    res = pd.concat([param_df, coord], axis=0)
-    res = res.sort_values("R2", axis=1, ascending=False)
-    res = res[pd.Index(["A"]).append(res.columns.drop("A"))]
+    index = pd.Index(["R2", "xmin", "xmid", "xmax", "ystart", "yend"]).append(
+        model.A.columns
+    )
+    results = {}
+    start = 0
+    for k in imodulons:
+        n_tfs = len(tfs[k])
+        if n_tfs == 0:
+            results[k] = None
+            continue
+
+        # A column has no fit parameters, followed by one column per TF
+        block = slice(start, start + n_tfs)
+        start += n_tfs
+        values = np.column_stack(
+            [
+                np.concatenate([np.full(6, np.nan), A[block.start]]),
+                np.vstack([stats[block].T, X[block].T]),
+            ]
+        )
+        res = pd.DataFrame(values, index=index, columns=["A"] + tfs[k])
+        res = res.sort_values("R2", axis=1, ascending=False)
+        res = res[pd.Index(["A"]).append(res.columns.drop("A"))]
+        results[k] = res
 
-    return res
+    return results
 
 
 # iModulon Metadata
@@ -1436,6 +1536,7 @@ def make_im_directory(
     k: Union[str, int],
     path_prefix: Optional[str] = ".",
     gene_scatter_x="start",
+    reg_scatters: Optional[Dict] = None,
 ):
     """
 
@@ -1451,6 +1552,9 @@ def make_im_directory(
     gene_scatter_x : str
         Passed to imdb_gene_scatter_df() to indicate
         the x axis type of that plot
+    reg_scatters : Dict
+        Pre-computed output of imdb_regulon_scatter_dfs(model). If None, the
+        regulon scatter table of iModulon k is computed here.
 
     Returns
     -------
@@ -1463,7 +1567,10 @@ def make_im_directory(
     gene_scatter = imdb_gene_scatter_df(model, k, gene_scatter_x)
     act_bar = imdb_activity_bar_df(model, k)
     reg_venn = imdb_regulon_venn_df(model, k)
-    reg_scatter = imdb_regulon_scatter_df(model, k)
+    if reg_scatters is None:
+        reg_scatter = imdb_regulon_scatter_df(model, k)
+    else:
+        reg_scatter = reg_scatters[k]
 
     # generate a basic data df
     res = imdb_imodulon_basics_df(model, k, reg_venn, reg_scatter)
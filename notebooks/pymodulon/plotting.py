@@ -2,8 +2,8 @@
 Plotting functions for iModulons
 """
 import logging
-import warnings
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -12,7 +12,8 @@ import seaborn as sns
 from adjustText import adjust_text
 from matplotlib.patches import Rectangle
 from scipy import sparse, stats
-from scipy.optimize import OptimizeWarning, curve_fit
+from scipy.cluster import hierarchy
+from scipy.spatial.distance import squareform
 from sklearn.base import clone
 from sklearn.cluster import AgglomerativeClustering
 from sklearn.decomposition import PCA
@@ -22,7 +23,12 @@ from sklearn.tree import DecisionTreeRegressor
 
 from pymodulon.compare import convert_gene_index
 from pymodulon.enrichment import parse_regulon_str
-from pymodulon.util import _parse_sample, dima, explained_variance, mutual_info_distance
+from pymodulon.util import (
+    _parse_sample,
+    cluster_activity_matrix,
+    dima,
+    explained_variance,
+)
 
 
 #############
@@ -1493,6 +1499,8 @@ def cluster_activities(
     n_best_clusters="auto",
     cluster_names=None,
     return_clustermap=False,
+    processes=None,
+    mi_cache_dir=None,
     # dimca options
     dimca_sample1=None,
     dimca_sample2=None,
@@ -1533,6 +1541,13 @@ def cluster_activities(
         has been performed previously.
     return_clustermap: bool
         Return the axis containing the clustermap
+    processes: int, optional
+        Number of worker processes used to compute mutual information if
+        correlation_method is 'mutual_info' (default: number of CPUs), and of
+        threads used to score distance thresholds (default: serial)
+    mi_cache_dir: str, optional
+        Directory to cache mutual information matrices, which are re-used as
+        long as the activity matrix is unchanged (default: no caching)
     dimca_sample1: list or str
         List of sample IDs or name of "project:condition" of reference samples for
         Differential iModulon Cluster Analysis (DiMCA)
@@ -1568,13 +1583,15 @@ def cluster_activities(
     # ensure that correlated iModulons are close in distance, can be clustered
 
     if correlation_method == "mutual_info":
-        correlation_df = 1 - ica_data.A.T.corr(method=mutual_info_distance)
+        correlation_df = ica_data.activity_correlation(
+            "mutual_info", processes=processes, mi_cache_dir=mi_cache_dir
+        )
         distance_matrix = 1 - correlation_df.abs() - np.eye(len(correlation_df))
         correlation_df = (correlation_df - correlation_df.min().min()) / (
             correlation_df.max().max()
         ) + np.eye(len(correlation_df))
     else:
-        correlation_df = ica_data.A.T.corr(method=correlation_method)
+        correlation_df = ica_data.activity_correlation(correlation_method)
         distance_matrix = 1 - correlation_df.abs()
 
     best_clusters = []
@@ -1594,29 +1611,14 @@ def cluster_activities(
     # perform automatic thresholding for default case
     if distance_threshold is None:
 
-        auto_threshold_df = pd.DataFrame(columns=["threshold", "score", "n_clusters"])
-        auto_threshold_df["threshold"] = np.arange(0, 1, 0.025)
-
-        for row in auto_threshold_df.itertuples(index=True):
-
-            # create a copy of the base clusterer with the threshold to try; fit
-            agg_cluster_auto_threshold = clone(agg_cluster_base).set_params(
-                distance_threshold=row.threshold
-            )
-            agg_cluster_auto_threshold.fit(distance_matrix)
-            n_clusters = agg_cluster_auto_threshold.n_clusters_
-            auto_threshold_df.loc[row.Index, "n_clusters"] = n_clusters
-
-            # score the clustering; handle the edge case where all clusters have
-            # size 1; this is invalid input for silhouette_score
-            if n_clusters == distance_matrix.shape[0] or n_clusters == 1:
-                auto_threshold_df.loc[row.Index, "score"] = 0
-            else:
-                auto_threshold_df.loc[row.Index, "score"] = silhouette_score(
-                    distance_matrix,
-                    agg_cluster_auto_threshold.labels_,
-                    metric="precomputed",
-                )
+        auto_threshold_df = _auto_threshold_scan(
+            distance_matrix,
+            np.arange(0, 1, 0.025),
+            threads=processes,
+            linkage_matrix=ica_data.activity_linkage(
+                correlation_method, processes=processes, mi_cache_dir=mi_cache_dir
+            ),
+        )
 
         best_threshold = auto_threshold_df.sort_values(
             by="score", ascending=False
@@ -1849,37 +1851,13 @@ def cluster_activities(
 
         # compute the new activity matrix with the best cluster activities
         # consolidated; define positive direction as direction with more + corrs
-        cluster_A_df = pd.DataFrame(columns=ica_data.A.columns)
-        all_clustered_ims = []
-        for best_cluster_label in best_clusters:
-
-            cluster_im_inds = np.where(labels == best_cluster_label)[0]
-            cluster_ims = np.array(ica_data.A.index)[cluster_im_inds]
-            all_clustered_ims += list(cluster_ims)
-            cluster_im_A_df = ica_data.A.loc[cluster_ims]
-            cluster_corr_df = correlation_df.loc[cluster_ims, cluster_ims]
-
-            # get the average non-self correlation for each iM in the cluster
-            # use this to invert the row in the cluster A df if negative
-            cluster_size = cluster_corr_df.shape[0]
-            for i in range(cluster_size):
-                non_self_inds = list(set(list(range(cluster_size))) - {i})
-                non_self_corrs = cluster_corr_df.iloc[i, non_self_inds]
-                im_corr_mean = np.mean(non_self_corrs)
-                if im_corr_mean < 0:
-                    cluster_im_A_df.iloc[i, :] = cluster_im_A_df.iloc[i, :] * -1
-
-            # compute the final averaged cluster activity, add to new dataframe
-            # use the provided name for this cluster if we have one
-            if cluster_names is not None and best_cluster_label in cluster_names:
-                cluster_name = f"{cluster_names[best_cluster_label]} [Clst]"
-            else:
-                cluster_name = f"Cluster {best_cluster_label}"
-            cluster_A_df.loc[cluster_name] = cluster_im_A_df.mean(axis=0)
-
-        # now we can add in the singleton iModulons to our new A matrix
-        singleton_ims = set(list(ica_data.A.index)) - set(all_clustered_ims)
-        cluster_A_df = cluster_A_df.append(ica_data.A.loc[list(singleton_ims)])
+        cluster_A_df = cluster_activity_matrix(
+            ica_data.A,
+            labels,
+            clusters=best_clusters,
+            correlation=correlation_df,
+            cluster_names=cluster_names,
+        )
 
         # add to kwargs
         dima_kwargs["alternate_A"] = cluster_A_df
@@ -1905,6 +1883,72 @@ def cluster_activities(
     return returns
 
 
+def _auto_threshold_scan(
+    distance_matrix, thresholds, threads=None, linkage_matrix=None
+):
+    """
+    Scores complete-linkage clusterings of a distance matrix at many distance
+    thresholds. The linkage tree is computed once and cut at each threshold,
+    which gives the same clusters as fitting AgglomerativeClustering with
+    that distance_threshold. Each distinct clustering is scored once.
+
+    Parameters
+    ----------
+    distance_matrix: ~pandas.DataFrame or ~numpy.ndarray
+        Square, symmetric distance matrix
+    thresholds: list
+        Distance thresholds to score
+    threads: int, optional
+        Number of threads used to compute silhouette scores (default: serial)
+    linkage_matrix: ~numpy.ndarray, optional
+        Pre-computed complete-linkage tree of the distance matrix
+
+    Returns
+    -------
+    auto_threshold_df: ~pandas.DataFrame
+        Silhouette score and number of clusters for each threshold
+    """
+    distances = np.asarray(distance_matrix, dtype=float)
+    n_samples = distances.shape[0]
+    if linkage_matrix is None:
+        linkage_matrix = hierarchy.linkage(
+            squareform(distances, checks=False), method="complete"
+        )
+
+    # AgglomerativeClustering only merges clusters below the threshold, while
+    # fcluster merges clusters at or below the threshold
+    labels = [
+        hierarchy.fcluster(
+            linkage_matrix, np.nextafter(threshold, -np.inf), criterion="distance"
+        )
+        for threshold in thresholds
+    ]
+    n_clusters = [label.max() for label in labels]
+
+    def _score(label):
+        # handle the edge case where all clusters have size 1; this is invalid
+        # input for silhouette_score
+        if label.max() == n_samples or label.max() == 1:
+            return 0
+        return silhouette_score(distances, label, metric="precomputed")
+
+    unique_labels = {label.tobytes(): label for label in labels}
+    if threads is None or threads == 1:
+        scores = [_score(label) for label in unique_labels.values()]
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            scores = list(executor.map(_score, unique_labels.values()))
+    scores = dict(zip(unique_labels.keys(), scores))
+
+    return pd.DataFrame(
+        {
+            "threshold": thresholds,
+            "score": [scores[label.tobytes()] for label in labels],
+            "n_clusters": n_clusters,
+        }
+    )
+
+
 ####################
 # Metadata Boxplot #
 ####################
@@ -2157,7 +2201,7 @@ def _fit_line(x, y, ax, metric):
         label = "$R^2_{{adj}}$ = {:.2f}".format(r2)
 
     elif metric == "pearson":
-        params = curve_fit(_solid_line, x, y)[0]
+        params = np.polyfit(x, y, 1)
         r, pval = stats.pearsonr(x, y)
         if pval < 1e-10:
             label = f"Pearson R = {r:.2f}\np-value < 1e-10"
@@ -2165,7 +2209,7 @@ def _fit_line(x, y, ax, metric):
             label = f"Pearson R = {r:.2f}\np-value = {pval:.2e}"
 
     elif metric == "spearman":
-        params = curve_fit(_solid_line, x, y)[0]
+        params = np.polyfit(x, y, 1)
         r, pval = stats.spearmanr(x, y)
         if pval < 1e-10:
             label = f"Spearman R = {r:.2f}\np-value < 1e-10"
@@ -2202,35 +2246,144 @@ def _fit_line(x, y, ax, metric):
 
 
 def _get_fit(x, y):
-    all_params = [curve_fit(_solid_line, x, y)[0]]
+    params, r2 = _get_fits(x, y)
+    return params[0], r2[0]
 
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore", category=OptimizeWarning)
-        for c in [min(x), np.mean(x), max(x)]:
-            try:
-                all_params.append(
-                    curve_fit(_broken_line, x, y, p0=[1, 1, c], maxfev=5000)[0]
-                )
-            except OptimizeWarning:
-                pass
 
-    best_r2 = -np.inf
-    best_params = all_params[0]
+def _get_fits(x, y):
+    """
+    Fits a solid line and a broken line to each row of x and y by exact least
+    squares, and keeps the fit with the highest adjusted R^2. A broken line
+    with breakpoint C is linear in max(x, C), so its optimum either has C at a
+    data point, or is a flat segment followed by a line that meet between two
+    consecutive data points. All candidates are evaluated at once from
+    cumulative sums over the sorted data.
 
-    for params in all_params:
-        if len(params) == 2:
-            r2 = _adj_r2(_solid_line, x, y, params)
-        else:
-            r2 = _adj_r2(_broken_line, x, y, params)
+    Parameters
+    ----------
+    x: ~numpy.ndarray
+        Array of shape (n_fits, n_points) or (n_points,)
+    y: ~numpy.ndarray
+        Array broadcastable to the shape of x
+
+    Returns
+    -------
+    params: list
+        Parameters of the best fit for each row (see :func:`_solid_line` and
+        :func:`_broken_line`)
+    r2: ~numpy.ndarray
+        Adjusted R^2 of the best fit for each row
+    """
+    x, y = np.broadcast_arrays(
+        np.atleast_2d(np.asarray(x, dtype=float)),
+        np.atleast_2d(np.asarray(y, dtype=float)),
+    )
+    n_fits, n = x.shape
+    rows = np.arange(n_fits)[:, None]
+
+    # Sort and center the data to limit round-off in the cumulative sums
+    order = np.argsort(x, axis=1, kind="stable")
+    x_mean = x.mean(axis=1, keepdims=True)
+    y_mean = y.mean(axis=1, keepdims=True)
+    xc = x[rows, order] - x_mean
+    yc = y[rows, order] - y_mean
+
+    # Sums over the first m points (m = 0..n) and over the remaining points
+    def _cumsum(values):
+        return np.hstack([np.zeros((n_fits, 1)), np.cumsum(values, axis=1)])
+
+    sums = {
+        "x": _cumsum(xc),
+        "y": _cumsum(yc),
+        "xx": _cumsum(xc ** 2),
+        "xy": _cumsum(xc * yc),
+        "yy": _cumsum(yc ** 2),
+    }
+    rest = {key: val[:, -1:] - val for key, val in sums.items()}
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Solid line
+        slope = sums["xy"][:, -1] / sums["xx"][:, -1]
+
+        # Broken lines with the breakpoint at each data point
+        m = np.arange(1, n + 1)
+        c = xc
+        su = m * c + rest["x"][:, 1:]
+        suu = m * c ** 2 + rest["xx"][:, 1:]
+        suy = c * sums["y"][:, 1:] + rest["xy"][:, 1:] - su * sums["y"][:, -1:] / n
+        svar = _sum_squares(su, suu, n)
+        hinge_slope = suy / svar
+        hinge_intercept = (sums["y"][:, -1:] - hinge_slope * su) / n
+        hinge_sse = _sum_squares(sums["y"][:, -1:], sums["yy"][:, -1:], n)
+        hinge_sse = np.where(
+            svar > 1e-10 * suu, hinge_sse - suy * hinge_slope, np.inf
+        )
+
+        # Flat segment on the first m points, followed by a line on the rest
+        m = np.arange(1, n - 1)
+        n_rest = n - m
+        rx, ry = rest["x"][:, m], rest["y"][:, m]
+        sxy = rest["xy"][:, m] - rx * ry / n_rest
+        svar = _sum_squares(rx, rest["xx"][:, m], n_rest)
+        seg_slope = sxy / svar
+        seg_intercept = (ry - seg_slope * rx) / n_rest
+        seg_c = (sums["y"][:, m] / m - seg_intercept) / seg_slope
+        seg_sse = (
+            _sum_squares(sums["y"][:, m], sums["yy"][:, m], m)
+            + _sum_squares(ry, rest["yy"][:, m], n_rest)
+            - sxy * seg_slope
+        )
+        feasible = (xc[:, m - 1] <= seg_c) & (seg_c <= xc[:, m])
+        feasible &= svar > 1e-10 * rest["xx"][:, m]
+        seg_sse = np.where(feasible, seg_sse, np.inf)
+
+    # Best broken line for each row
+    broken = np.hstack(
+        [
+            np.stack([hinge_slope, hinge_intercept, c], axis=2),
+            np.stack([seg_slope, seg_intercept, seg_c], axis=2),
+        ]
+    )
+    broken_sse = np.nan_to_num(np.hstack([hinge_sse, seg_sse]), nan=np.inf)
+    broken_params = broken[np.arange(n_fits), broken_sse.argmin(axis=1)]
+
+    # Convert parameters back to the original scale and score both fits
+    all_params = []
+    all_r2 = []
+    for i in range(n_fits):
+        x_row, y_row = x[i], y[i]
+        x0, y0 = x_mean[i, 0], y_mean[i, 0]
+        A, B, C = broken_params[i]
+        candidates = [
+            [slope[i], y0 - slope[i] * x0],
+            [A, y0 + B - A * x0, C + x0],
+        ]
+
+        best_r2 = -np.inf
+        best_params = candidates[0]
+        for params in candidates:
+            if not np.isfinite(params).all():
+                continue
+            if len(params) == 2:
+                r2 = _adj_r2(_solid_line, x_row, y_row, params)
+            else:
+                r2 = _adj_r2(_broken_line, x_row, y_row, params)
+            if r2 > best_r2:
+                best_r2 = r2
+                best_params = params
+
+        if best_r2 < 0:
+            best_params, best_r2 = [0, np.mean(y_row)], 0
+
+        all_params.append(best_params)
+        all_r2.append(best_r2)
 
-        if r2 > best_r2:
-            best_r2 = r2
-            best_params = params
+    return all_params, np.array(all_r2)
 
-    if best_r2 < 0:
-        return [0, np.mean(y)], 0
 
-    return best_params, best_r2
+def _sum_squares(total, total_squares, n):
+    # Centered sum of squares from the sum and sum of squares of n values
+    return total_squares - total ** 2 / n
 
 
 def _broken_line(x, A, B, C):
@@ -0,0 +1,643 @@
+"""
+Functions for quality control of expression data before running ICA
+"""
+
+import os
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import scipy.cluster.hierarchy as sch
+
+Corr = Union[pd.DataFrame, np.ndarray]
+
+FASTQC_COLS = [
+    "per_base_sequence_quality",
+    "per_tile_sequence_quality",
+    "per_sequence_quality_scores",
+    "per_base_sequence_content",
+    "per_sequence_gc_content",
+    "per_base_n_content",
+    "sequence_length_distribution",
+    "sequence_duplication_levels",
+    "overrepresented_sequences",
+    "adapter_content",
+]
+
+# Samples that do not pass any of these categories are discarded
+FASTQC_FAIL_COLS = [
+    "per_base_sequence_quality",
+    "per_sequence_quality_scores",
+    "per_base_n_content",
+    "adapter_content",
+]
+
+
+#######################
+# Sample Correlations #
+#######################
+
+
+def _standardize_samples(
+    log_tpm: Union[pd.DataFrame, np.ndarray], dtype=np.float64
+) -> np.ndarray:
+    """
+    Centers and scales each sample so that Z.T @ Z is the sample correlation
+    matrix. Constant samples become NaN.
+    """
+    X = np.array(log_tpm, dtype=dtype)
+    X = X - X.mean(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return X / np.sqrt((X ** 2).sum(axis=0))
+
+
+def sample_correlation(log_tpm: pd.DataFrame, dtype=np.float64) -> pd.DataFrame:
+    """
+    Computes the Pearson R correlation between all pairs of samples as a
+    single standardized matrix product. Equivalent to log_tpm.corr().
+
+    Parameters
+    ----------
+    log_tpm : pd.DataFrame
+        Expression matrix (genes x samples)
+    dtype : np.dtype
+        Floating point type of the result (default: np.float64)
+
+    Returns
+    -------
+    pd.DataFrame
+        Sample x sample correlation matrix
+    """
+    Z = _standardize_samples(log_tpm, dtype)
+    with np.errstate(invalid="ignore"):
+        corr = np.clip(Z.T @ Z, -1, 1)
+    np.fill_diagonal(corr, np.where(np.isnan(np.diag(corr)), np.nan, 1))
+    return pd.DataFrame(corr, index=log_tpm.columns, columns=log_tpm.columns)
+
+
+def _corr_positions(
+    corr: Corr, log_tpm: pd.DataFrame, samples: pd.Index
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the correlation values and the positions of `samples` in them.
+    Arrays (e.g. from :func:`blocked_sample_correlation`) must be ordered like
+    the columns of log_tpm. Values are not copied, so memory-mapped matrices
+    are only read where they are indexed.
+    """
+    if isinstance(corr, pd.DataFrame):
+        values, names = corr.values, corr.index
+    else:
+        values, names = corr, log_tpm.columns
+    positions = names.get_indexer(samples)
+    if (positions < 0).any():
+        raise ValueError("Correlation matrix is missing samples")
+    return values, positions
+
+
+def _replicate_mask(labels: pd.Series) -> np.ndarray:
+    """
+    Returns a sample x sample boolean matrix that is True for pairs of
+    different samples that share the same label
+    """
+    codes = pd.factorize(labels)[0]
+    same = codes[:, None] == codes[None, :]
+    np.fill_diagonal(same, False)
+    return same
+
+
+def replicate_correlations(
+    log_tpm: pd.DataFrame,
+    metadata: pd.DataFrame,
+    name_col: str = "full_name",
+    corr: Optional[Corr] = None,
+) -> Tuple[pd.Series, pd.Series]:
+    """
+    Splits the correlations between all pairs of samples into replicate and
+    non-replicate pairs
+
+    Parameters
+    ----------
+    log_tpm : pd.DataFrame
+        Expression matrix (genes x samples)
+    metadata : pd.DataFrame
+        Sample metadata, containing the samples to compare as the index
+    name_col : str
+        Metadata column with the condition name shared by replicates
+        (default: "full_name")
+    corr : Union[pd.DataFrame, np.ndarray]
+        Pre-computed sample correlation matrix (see :func:`sample_correlation`
+        and :func:`blocked_sample_correlation`)
+
+    Returns
+    -------
+    rep_corrs : pd.Series
+        Pearson R of each pair of replicates, indexed by sample pair
+    rand_corrs : pd.Series
+        Pearson R of each pair of samples from different conditions
+    """
+    samples = metadata.index
+    if corr is None:
+        corr = sample_correlation(log_tpm[samples])
+    values, positions = _corr_positions(corr, log_tpm, samples)
+
+    # Each unordered pair once, in the same order as itertools.combinations
+    idx1, idx2 = np.triu_indices(len(samples), k=1)
+    is_rep = _replicate_mask(metadata[name_col])[idx1, idx2]
+    pairs = pd.MultiIndex.from_arrays([samples[idx1], samples[idx2]])
+    pair_corrs = pd.Series(values[positions[idx1], positions[idx2]], index=pairs)
+
+    return pair_corrs[is_rep], pair_corrs[~is_rep]
+
+
+def find_dissimilar_replicates(
+    log_tpm: pd.DataFrame,
+    metadata: pd.DataFrame,
+    rcutoff: float = 0.95,
+    name_col: str = "full_name",
+    corr: Optional[Corr] = None,
+) -> List:
+    """
+    Finds samples whose best correlation to any of their replicates is below
+    the cutoff. Samples without replicates are always included.
+
+    Parameters
+    ----------
+    log_tpm : pd.DataFrame
+        Expression matrix (genes x samples)
+    metadata : pd.DataFrame
+        Sample metadata, containing the samples to compare as the index
+    rcutoff : float
+        Minimum Pearson R between a sample and its most similar replicate
+        (default: 0.95)
+    name_col : str
+        Metadata column with the condition name shared by replicates
+        (default: "full_name")
+    corr : Union[pd.DataFrame, np.ndarray]
+        Pre-computed sample correlation matrix (see :func:`sample_correlation`
+        and :func:`blocked_sample_correlation`)
+
+    Returns
+    -------
+    list
+        Samples that failed the replicate correlation cutoff, grouped by
+        condition
+    """
+    samples = metadata.index
+    if corr is None:
+        corr = sample_correlation(log_tpm[samples])
+    values, positions = _corr_positions(corr, log_tpm, samples)
+
+    # Only look up the correlations between replicates
+    codes = pd.factorize(metadata[name_col])[0]
+    order = np.argsort(codes, kind="stable")
+    groups = np.split(order, np.flatnonzero(np.diff(codes[order])) + 1)
+    idx1, idx2 = [], []
+    for group in groups:
+        if len(group) > 1:
+            pairs1, pairs2 = np.meshgrid(group, group, indexing="ij")
+            off_diag = pairs1 != pairs2
+            idx1.append(pairs1[off_diag])
+            idx2.append(pairs2[off_diag])
+
+    best_rep = np.zeros(len(samples))
+    if len(idx1) > 0:
+        idx1, idx2 = np.concatenate(idx1), np.concatenate(idx2)
+        rep_values = np.nan_to_num(values[positions[idx1], positions[idx2]], nan=0)
+        np.maximum.at(best_rep, idx1, rep_values)
+    failed = np.where(best_rep < rcutoff)[0]
+
+    # Group samples by condition name
+    order = np.argsort(metadata[name_col].values[failed], kind="stable")
+    return samples[failed[order]].tolist()
+
+
+###########################
+# Out-of-core Correlation #
+###########################
+
+
+def load_log_tpm_memmap(
+    csv_file: os.PathLike,
+    npy_file: os.PathLike,
+    chunksize: int = 1000,
+    dtype=np.float32,
+) -> pd.DataFrame:
+    """
+    Converts a log-TPM CSV file to a memory-mapped .npy file, reading the CSV
+    in chunks of genes. Missing values are set to 0. The .npy file is re-used
+    as long as it is newer than the CSV file.
+
+    Parameters
+    ----------
+    csv_file : os.PathLike
+        Path to the log-TPM CSV file (genes x samples)
+    npy_file : os.PathLike
+        Path to the .npy file to create
+    chunksize : int
+        Number of genes to read at a time (default: 1000)
+    dtype : np.dtype
+        Floating point type of the stored matrix (default: np.float32)
+
+    Returns
+    -------
+    pd.DataFrame
+        Expression matrix backed by the read-only memory map
+    """
+    samples = pd.read_csv(csv_file, index_col=0, nrows=0).columns
+    genes = pd.read_csv(csv_file, usecols=[0]).iloc[:, 0].values
+
+    if not (
+        os.path.isfile(npy_file)
+        and os.path.getmtime(npy_file) >= os.path.getmtime(csv_file)
+    ):
+        tmp_file = str(npy_file) + ".tmp"
+        X = np.lib.format.open_memmap(
+            tmp_file, mode="w+", dtype=dtype, shape=(len(genes), len(samples))
+        )
+        start = 0
+        for chunk in pd.read_csv(csv_file, index_col=0, chunksize=chunksize):
+            X[start : start + len(chunk)] = chunk.fillna(0).values
+            start += len(chunk)
+        X.flush()
+        del X
+        os.replace(tmp_file, npy_file)
+
+    X = np.load(npy_file, mmap_mode="r")
+    return pd.DataFrame(X, index=genes, columns=samples, copy=False)
+
+
+def blocked_sample_correlation(
+    log_tpm: Union[pd.DataFrame, np.ndarray],
+    out_file: os.PathLike,
+    block_size: int = 1000,
+    dtype=np.float32,
+) -> np.ndarray:
+    """
+    Computes the sample correlation matrix one block of samples at a time and
+    writes it to a memory-mapped .npy file. Only two blocks of samples are in
+    memory at once, so log_tpm can itself be memory-mapped
+    (see :func:`load_log_tpm_memmap`).
+
+    Parameters
+    ----------
+    log_tpm : Union[pd.DataFrame, np.ndarray]
+        Expression matrix (genes x samples)
+    out_file : os.PathLike
+        Path to the .npy file for the sample x sample correlation matrix
+    block_size : int
+        Number of samples per block (default: 1000)
+    dtype : np.dtype
+        Floating point type of the result (default: np.float32)
+
+    Returns
+    -------
+    np.ndarray
+        Read-only memory map of the correlation matrix, ordered like the
+        samples in log_tpm
+    """
+    X = log_tpm.values if isinstance(log_tpm, pd.DataFrame) else log_tpm
+    n_samples = X.shape[1]
+    bounds = list(range(0, n_samples, block_size)) + [n_samples]
+    blocks = list(zip(bounds, bounds[1:]))
+
+    def standardized_block(start, stop):
+        return _standardize_samples(X[:, start:stop], dtype)
+
+    tmp_file = str(out_file) + ".tmp"
+    corr = np.lib.format.open_memmap(
+        tmp_file, mode="w+", dtype=dtype, shape=(n_samples, n_samples)
+    )
+    for i, (start1, stop1) in enumerate(blocks):
+        Z1 = standardized_block(start1, stop1)
+        for start2, stop2 in blocks[i:]:
+            if start2 == start1:
+                Z2 = Z1
+            else:
+                Z2 = standardized_block(start2, stop2)
+            with np.errstate(invalid="ignore"):
+                block_corr = np.clip(Z1.T @ Z2, -1, 1)
+            corr[start1:stop1, start2:stop2] = block_corr
+            corr[start2:stop2, start1:stop1] = block_corr.T
+
+    diag = np.diagonal(corr)
+    corr[np.arange(n_samples), np.arange(n_samples)] = np.where(
+        np.isnan(diag), np.nan, 1
+    )
+    corr.flush()
+    del corr
+    os.replace(tmp_file, out_file)
+
+    return np.load(out_file, mmap_mode="r")
+
+
+###############
+# QC Pipeline #
+###############
+
+
+def _row_distances(A: np.ndarray, B: np.ndarray) -> np.ndarray:
+    """
+    Euclidean distances between the rows of A and the rows of B, computed with
+    a matrix product instead of pairwise loops
+    """
+    A = A.astype(np.float64)
+    B = B.astype(np.float64)
+    sq_dist = (A ** 2).sum(axis=1)[:, None] + (B ** 2).sum(axis=1) - 2 * A @ B.T
+    return np.sqrt(np.maximum(sq_dist, 0))
+
+
+class SampleClustering(object):
+    """
+    Hierarchical clustering of samples by their global correlation. The
+    float32 correlation matrix and the linkage are computed once, so clusters
+    can be re-cut at different thresholds and the correlations re-used for
+    plotting.
+
+    Samples are clustered with complete linkage on the euclidean distances
+    between their correlation profiles. Compendia with more than `max_exact`
+    samples use an approximate path: a random set of landmark samples is
+    clustered on their correlations to the landmarks, and every other sample
+    joins the cluster of its nearest landmark. The full sample x sample
+    correlation matrix is never built on this path, and a pre-computed
+    on-disk matrix is only read at the landmark columns.
+    """
+
+    def __init__(
+        self,
+        log_tpm: pd.DataFrame,
+        max_exact: int = 3000,
+        n_landmarks: int = 1000,
+        random_state: int = 0,
+        corr: Optional[Corr] = None,
+    ):
+        """
+        Parameters
+        ----------
+        log_tpm : pd.DataFrame
+            Expression matrix (genes x samples)
+        max_exact : int
+            Largest number of samples to cluster exactly (default: 3000)
+        n_landmarks : int
+            Number of landmark samples for the approximate path (default: 1000)
+        random_state : int
+            Seed used to choose the landmark samples (default: 0)
+        corr : Union[pd.DataFrame, np.ndarray]
+            Pre-computed sample correlation matrix, e.g. from
+            :func:`blocked_sample_correlation`. Arrays must be ordered like the
+            columns of log_tpm, and DataFrames are aligned by sample name.
+        """
+        self.samples = log_tpm.columns
+        self._log_tpm = log_tpm
+        self._z = None
+        self._corr_values = None
+        if corr is not None:
+            # Values are indexed through the positions when they are needed
+            self._corr_values, self._corr_positions = _corr_positions(
+                corr, log_tpm, self.samples
+            )
+        self._corr = None
+        self._link = None
+        self._dist_max = None
+        self._features = None
+
+        n_samples = len(self.samples)
+        self.approximate = n_samples > max_exact
+        if self.approximate:
+            rng = np.random.RandomState(random_state)
+            landmarks = rng.choice(n_samples, min(n_landmarks, n_samples), False)
+            self._landmarks = np.sort(landmarks)
+        else:
+            self._landmarks = np.arange(n_samples)
+
+    @property
+    def corr(self) -> pd.DataFrame:
+        """ Sample x sample correlation matrix (float32) """
+        if self._corr is None:
+            if self._corr_values is not None:
+                positions = self._corr_positions
+                corr = np.asarray(
+                    self._corr_values[np.ix_(positions, positions)], dtype=np.float32
+                )
+            else:
+                Z = self._get_z()
+                with np.errstate(invalid="ignore"):
+                    corr = np.clip(Z.T @ Z, -1, 1)
+                np.fill_diagonal(corr, np.where(np.isnan(np.diag(corr)), np.nan, 1))
+            self._corr = pd.DataFrame(corr, index=self.samples, columns=self.samples)
+        return self._corr
+
+    def _get_z(self) -> np.ndarray:
+        """ Standardized float32 expression matrix """
+        if self._z is None:
+            self._z = _standardize_samples(self._log_tpm, np.float32)
+        return self._z
+
+    @property
+    def landmarks(self) -> pd.Index:
+        """ Samples clustered by the linkage (all samples on the exact path) """
+        return self.samples[self._landmarks]
+
+    def _get_features(self) -> np.ndarray:
+        """
+        Correlation of every sample to the landmark samples, with undefined
+        correlations set to 0
+        """
+        if self._features is None:
+            if self.approximate and self._corr_values is not None:
+                positions = self._corr_positions
+                features = self._corr_values[
+                    np.ix_(positions, positions[self._landmarks])
+                ]
+            elif self.approximate:
+                Z = self._get_z()
+                with np.errstate(invalid="ignore"):
+                    features = Z.T @ Z[:, self._landmarks]
+            else:
+                features = self.corr.values
+            self._features = np.nan_to_num(features, nan=0)
+        return self._features
+
+    @property
+    def linkage(self) -> np.ndarray:
+        """ Complete linkage of the landmark samples """
+        if self._link is None:
+            landmark_features = self._get_features()[self._landmarks]
+            dist = _row_distances(landmark_features, landmark_features)
+            dist = sch.distance.squareform(dist, checks=False)
+            self._link = sch.linkage(dist, method="complete")
+            self._dist_max = dist.max()
+        return self._link
+
+    def clusters(self, thresh: float = 0.3) -> pd.DataFrame:
+        """
+        Cuts the dendrogram to assign every sample to a cluster
+
+        Parameters
+        ----------
+        thresh : float
+            Fraction of the largest distance used to cut the dendrogram.
+            Decrease to get more clusters. (default: 0.3)
+
+        Returns
+        -------
+        pd.DataFrame
+            Table with a "cluster" column for each sample
+        """
+        labels = sch.fcluster(self.linkage, thresh * self._dist_max, "distance")
+
+        if self.approximate:
+            features = self._get_features()
+            landmark_features = features[self._landmarks]
+
+            # Assign samples to their nearest landmark in blocks to limit memory
+            nearest = np.empty(len(self.samples), dtype=int)
+            for start in range(0, len(self.samples), 1000):
+                block = features[start : start + 1000]
+                dist = _row_distances(block, landmark_features)
+                nearest[start : start + 1000] = dist.argmin(axis=1)
+            labels = labels[nearest]
+
+        clst = pd.DataFrame(index=self.samples)
+        clst["cluster"] = labels
+        return clst
+
+
+def cluster_samples(
+    log_tpm: pd.DataFrame,
+    thresh: float = 0.3,
+    max_exact: int = 3000,
+    corr: Optional[Corr] = None,
+) -> pd.DataFrame:
+    """
+    Clusters samples by their global correlation using complete linkage. Use
+    :class:`SampleClustering` directly to re-cut the clusters or re-use the
+    correlation matrix.
+
+    Parameters
+    ----------
+    log_tpm : pd.DataFrame
+        Expression matrix (genes x samples)
+    thresh : float
+        Fraction of the largest distance used to cut the dendrogram. Decrease
+        to get more clusters. (default: 0.3)
+    max_exact : int
+        Largest number of samples to cluster exactly (default: 3000)
+    corr : Union[pd.DataFrame, np.ndarray]
+        Pre-computed sample correlation matrix ordered like the columns of
+        log_tpm
+
+    Returns
+    -------
+    pd.DataFrame
+        Table with a "cluster" column for each sample
+    """
+    clustering = SampleClustering(log_tpm, max_exact=max_exact, corr=corr)
+    return clustering.clusters(thresh)
+
+
+def basic_qc(
+    log_tpm: pd.DataFrame,
+    qc_stats: pd.DataFrame,
+    metadata: pd.DataFrame,
+    min_mrna_reads: float = 5e5,
+    fastqc_fail_cols: Optional[List[str]] = None,
+    thresh: float = 0.3,
+    remove_clusters: Optional[List[int]] = None,
+    corr: Optional[Corr] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Flags samples that fail FastQC, have too few reads mapped to coding
+    sequences, or belong to outlier global-correlation clusters
+
+    Parameters
+    ----------
+    log_tpm : pd.DataFrame
+        Expression matrix (genes x samples)
+    qc_stats : pd.DataFrame
+        MultiQC statistics for each sample (e.g. multiqc_stats.tsv)
+    metadata : pd.DataFrame
+        Sample metadata
+    min_mrna_reads : float
+        Minimum number of reads mapped to mRNA (default: 5e5)
+    fastqc_fail_cols : List[str]
+        FastQC categories that every sample must pass
+        (default: FASTQC_FAIL_COLS)
+    thresh : float
+        Dendrogram cut for the global-correlation clusters (default: 0.3)
+    remove_clusters : List[int]
+        Global-correlation clusters to remove. Inspect the clusters returned by
+        a first run to choose these. (default: None)
+    corr : Union[pd.DataFrame, np.ndarray]
+        Pre-computed sample correlation matrix ordered like the columns of
+        log_tpm
+
+    Returns
+    -------
+    metadata : pd.DataFrame
+        Copy of the metadata for the samples in log_tpm, with the columns
+        passed_fastqc, passed_reads_mapped_to_CDS and passed_global_correlation
+    clusters : pd.DataFrame
+        Global-correlation cluster of each sample
+    """
+    samples = log_tpm.columns
+
+    # Ensure that metadata and qc_stats contain all log_tpm samples
+    for table, name in [(metadata, "metadata"), (qc_stats, "QC stats")]:
+        missing = set(samples) - set(table.index)
+        if len(missing) > 0:
+            raise ValueError("Samples missing from {}: {}".format(name, missing))
+
+    metadata = metadata.loc[samples].copy()
+    qc_stats = qc_stats.loc[samples].fillna(0)
+
+    if fastqc_fail_cols is None:
+        fastqc_fail_cols = FASTQC_FAIL_COLS
+    metadata["passed_fastqc"] = (qc_stats[fastqc_fail_cols] == "pass").all(axis=1)
+    metadata["passed_reads_mapped_to_CDS"] = ~(qc_stats["Assigned"] < min_mrna_reads)
+
+    clusters = cluster_samples(log_tpm, thresh=thresh, corr=corr)
+    if remove_clusters is None:
+        remove_clusters = []
+    metadata["passed_global_correlation"] = ~clusters.cluster.isin(remove_clusters)
+
+    return metadata, clusters
+
+
+def replicate_qc(
+    log_tpm: pd.DataFrame,
+    metadata: pd.DataFrame,
+    rcutoff: float = 0.95,
+) -> pd.DataFrame:
+    """
+    Flags samples whose replicates are not similar enough, and samples without
+    replicates. Requires curated project_name and condition_name columns.
+
+    Parameters
+    ----------
+    log_tpm : pd.DataFrame
+        Expression matrix (genes x samples)
+    metadata : pd.DataFrame
+        Metadata for the samples that passed :func:`basic_qc`
+    rcutoff : float
+        Minimum Pearson R between a sample and its most similar replicate
+        (default: 0.95)
+
+    Returns
+    -------
+    pd.DataFrame
+        Copy of the metadata with the columns full_name,
+        passed_similar_replicates and passed_number_replicates
+    """
+    metadata = metadata.copy()
+    metadata["full_name"] = metadata["project_name"].str.cat(
+        metadata["condition_name"], sep=":"
+    )
+
+    dissimilar = find_dissimilar_replicates(log_tpm, metadata, rcutoff=rcutoff)
+    metadata["passed_similar_replicates"] = ~metadata.index.isin(dissimilar)
+
+    cond_counts = metadata.full_name.value_counts()
+    drop_conds = cond_counts[cond_counts < 2].index
+    metadata["passed_number_replicates"] = ~metadata.full_name.isin(drop_conds)
+
+    return metadata
@@ -0,0 +1,563 @@
+"""
+HTTP service for projecting new expression profiles onto iModulon models
+
+Models are loaded once and kept in memory. Requests are queued, combined into
+micro-batches and scored by a bounded pool of worker threads. Start a server
+from the command line with::
+
+    python -m pymodulon.server --model LT2=lt2.json --model core=core.pkl
+
+and POST log-TPM profiles to ``/models/<name>/activities``::
+
+    {"genes": ["b0001", "b0002", ...],
+     "samples": {"sample_1": [10.2, 8.4, ...], ...},
+     "centered": false}
+
+The response contains the inferred activities and DiMA-style flags, i.e.
+iModulons whose activity differs significantly from the reference condition
+given the variation between replicates of the model.
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import pickle
+import queue
+import threading
+import time
+import warnings
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+from statsmodels.stats.multitest import fdrcorrection
+
+from pymodulon.core import IcaData
+from pymodulon.io import load_json_model
+from pymodulon.util import ActivityProjector, _dima_distributions, _parse_sample
+
+logger = logging.getLogger(__name__)
+
+
+def load_model(filename: os.PathLike) -> IcaData:
+    """
+    Loads an IcaData object from a JSON file (see
+    :func:`pymodulon.io.load_json_model`) or from a pickle file, which is
+    considerably faster to load for large models. Only load pickle files from
+    trusted sources.
+
+    Parameters
+    ----------
+    filename : os.PathLike
+        Path to a .json, .json.gz, .pkl or .pickle file
+
+    Returns
+    -------
+    IcaData
+        The loaded model
+    """
+    filename = str(filename)
+    if filename.endswith((".json", ".json.gz")):
+        return load_json_model(filename)
+    elif filename.endswith((".pkl", ".pickle")):
+        with open(filename, "rb") as f:
+            model = pickle.load(f)
+        if not isinstance(model, IcaData):
+            raise ValueError("{} does not contain an IcaData object".format(filename))
+        return model
+    raise ValueError("Model files must be .json, .json.gz, .pkl or .pickle files")
+
+
+class ModelService(object):
+    """
+    Scores expression profiles against one or more iModulon models. Requests
+    submitted within max_wait seconds of each other are combined into batches
+    of up to max_batch_size samples, and requests for the same model and genes
+    are projected with a single matrix product.
+    """
+
+    def __init__(
+        self,
+        models: Dict[str, IcaData],
+        reference: Optional[Dict[str, Union[List, str]]] = None,
+        threshold: float = 5,
+        fdr: float = 0.1,
+        workers: int = 2,
+        max_batch_size: int = 64,
+        max_wait: float = 0.01,
+    ):
+        """
+        Parameters
+        ----------
+        models : Dict[str, IcaData]
+            Models keyed by name
+        reference : Dict[str, Union[List, str]]
+            Reference samples of each model, as a list of sample IDs or
+            "project:condition". Incoming log-TPM profiles are centered to the
+            reference, so that activities are relative to it (default: all
+            samples)
+        threshold : float
+            Minimum activity difference to flag an iModulon (default: 5)
+        fdr : float
+            False detection rate for flagged iModulons (default: 0.1)
+        workers : int
+            Maximum number of batches scored at the same time (default: 2)
+        max_batch_size : int
+            Maximum number of samples per batch (default: 64)
+        max_wait : float
+            Seconds to wait for more requests before scoring a batch
+            (default: 0.01)
+        """
+        if reference is None:
+            reference = {}
+
+        self.threshold = threshold
+        self.fdr = fdr
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._models = {}
+        for name, model in models.items():
+            self._models[name] = self._prepare_model(
+                name, model, reference.get(name)
+            )
+
+        self._n_batches = 0
+        self._queue = queue.Queue()
+        self._slots = threading.BoundedSemaphore(workers)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+
+    @staticmethod
+    def _prepare_model(name: str, model: IcaData, reference) -> Dict:
+        """
+        Pre-computes everything needed to score samples against a model
+        """
+        ref_samples = model.A.columns if reference is None else reference
+        ref_samples = _parse_sample(model, ref_samples)
+
+        if model.log_tpm is None:
+            center = None
+        else:
+            center = model.log_tpm[ref_samples].mean(axis=1)
+
+        try:
+            dists = _dima_distributions(model, model.A)
+        except (KeyError, ValueError):
+            warnings.warn(
+                "DiMA flags are disabled for model {}, since its sample table "
+                "has no replicates with project and condition".format(name)
+            )
+            dists = None
+
+        return {
+            "projector": ActivityProjector(model),
+            "center": center,
+            "dists": dists,
+        }
+
+    @property
+    def models(self) -> List[str]:
+        """ Get the names of all models """
+        return list(self._models.keys())
+
+    def model_info(self, name: str) -> Dict:
+        """ Get the genes and iModulons of a model """
+        projector = self._models[name]["projector"]
+        return {
+            "genes": projector._m.index.tolist(),
+            "imodulons": projector.imodulon_names,
+            "flags": self._models[name]["dists"] is not None,
+        }
+
+    def submit(self, name: str, data: pd.DataFrame, centered: bool = False) -> Future:
+        """
+        Queues expression profiles for scoring
+
+        Parameters
+        ----------
+        name : str
+            Name of the model
+        data : pd.DataFrame
+            Expression profiles (genes x samples)
+        centered : bool
+            If true, the profiles are already centered to the reference.
+            Otherwise, log-TPM profiles are centered to the reference samples
+            of the model (default: False)
+
+        Returns
+        -------
+        Future
+            Resolves to the activities (iModulons x samples) and a table of
+            flagged iModulons (see :meth:`score`)
+        """
+        if name not in self._models:
+            raise ValueError("Unknown model: {}".format(name))
+        if not centered and self._models[name]["center"] is None:
+            raise ValueError(
+                "Model {} has no log-TPM matrix, so samples must be "
+                "centered".format(name)
+            )
+        if data.shape[1] == 0:
+            raise ValueError("No samples to score")
+
+        # Invalid values are rejected here, so they cannot fail a whole batch
+        data = data.astype(float)
+        future = Future()
+        self._queue.put((name, data, centered, future))
+        return future
+
+    def score(
+        self, name: str, data: pd.DataFrame, centered: bool = False
+    ) -> Tuple[pd.DataFrame, Optional[pd.DataFrame]]:
+        """
+        Scores expression profiles and waits for the result
+
+        Parameters
+        ----------
+        name : str
+            Name of the model
+        data : pd.DataFrame
+            Expression profiles (genes x samples)
+        centered : bool
+            If true, the profiles are already centered to the reference
+            (default: False)
+
+        Returns
+        -------
+        activities : pd.DataFrame
+            Inferred activities (iModulons x samples)
+        flags : pd.DataFrame
+            Difference to the reference, p-value and q-value of every
+            flagged sample and iModulon (None if the model has no replicates)
+        """
+        return self.submit(name, data, centered).result()
+
+    def close(self):
+        """ Stops the service after scoring all queued requests """
+        self._queue.put(None)
+        self._dispatcher.join()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _dispatch(self):
+        """
+        Collects queued requests into batches and hands them to the workers
+        """
+        stop = False
+        while not stop:
+            request = self._queue.get()
+            if request is None:
+                break
+            batch = [request]
+            n_samples = request[1].shape[1]
+            deadline = time.monotonic() + self.max_wait
+            while n_samples < self.max_batch_size:
+                try:
+                    request = self._queue.get(
+                        timeout=max(0, deadline - time.monotonic())
+                    )
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop = True
+                    break
+                batch.append(request)
+                n_samples += request[1].shape[1]
+
+            # Requests for the same model and genes are scored together
+            groups = {}
+            for request in batch:
+                name, data, centered, _ = request
+                key = (name, centered, tuple(data.index))
+                groups.setdefault(key, []).append(request)
+
+            self._n_batches += 1
+            for requests in groups.values():
+                self._slots.acquire()
+                self._executor.submit(self._score_requests, requests)
+
+    def _score_requests(self, requests):
+        """
+        Scores a group of requests for the same model and genes in a worker.
+        If the group fails, its requests are retried one at a time, so that an
+        error only fails the request that caused it.
+        """
+        try:
+            self._score_group(requests)
+        except Exception as err:
+            if len(requests) == 1:
+                requests[0][3].set_exception(err)
+            else:
+                for request in requests:
+                    if request[3].done():
+                        continue
+                    try:
+                        self._score_group([request])
+                    except Exception as request_err:
+                        request[3].set_exception(request_err)
+        finally:
+            self._slots.release()
+
+    def _score_group(self, requests):
+        """
+        Projects a group of requests with one matrix product and resolves
+        their futures
+        """
+        name, data, centered, _ = requests[0]
+        model = self._models[name]
+        values = np.hstack([request[1].values for request in requests])
+        data = pd.DataFrame(values, index=data.index)
+        if not centered:
+            data = data.sub(model["center"].reindex(data.index), axis=0)
+
+        activities = model["projector"].project(data)
+        flags = self._flag(model, activities)
+
+        # Split the batch back into the original requests
+        start = 0
+        for _, request_data, _, future in requests:
+            cols = request_data.columns
+            stop = start + len(cols)
+            result = activities.iloc[:, start:stop]
+            result.columns = cols
+            if flags is None:
+                result_flags = None
+            else:
+                result_flags = flags[
+                    (flags["sample"] >= start) & (flags["sample"] < stop)
+                ]
+                result_flags = result_flags.assign(
+                    sample=cols[result_flags["sample"].values - start]
+                ).reset_index(drop=True)
+            future.set_result((result, result_flags))
+            start = stop
+
+    def _flag(self, model: Dict, activities: pd.DataFrame) -> Optional[pd.DataFrame]:
+        """
+        Finds iModulons whose activities differ from the reference more than
+        expected from the differences between replicates (as in DiMA)
+        """
+        dists = model["dists"]
+        if dists is None:
+            return None
+
+        # Profiles are centered to the reference, so activities are differences
+        diff = activities.values
+        pvalues = 1 - stats.lognorm.cdf(
+            np.abs(diff),
+            dists.s.values[:, None],
+            dists["loc"].values[:, None],
+            dists.scale.values[:, None],
+        )
+
+        # Multiple testing correction is applied separately to each sample
+        qvalues = np.empty_like(pvalues)
+        for j in range(diff.shape[1]):
+            qvalues[:, j] = fdrcorrection(pvalues[:, j])[1]
+        rows, cols = np.where((qvalues < self.fdr) & (np.abs(diff) > self.threshold))
+        order = np.lexsort((rows, cols))
+        rows, cols = rows[order], cols[order]
+        return pd.DataFrame(
+            {
+                "sample": cols,
+                "imodulon": activities.index[rows],
+                "difference": diff[rows, cols],
+                "pvalue": pvalues[rows, cols],
+                "qvalue": qvalues[rows, cols],
+            }
+        )
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles GET /models and POST /models/<name>/activities
+    """
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path.rstrip("/") == "/models":
+            info = {name: service.model_info(name) for name in service.models}
+            for model in info.values():
+                model["genes"] = len(model["genes"])
+            self._send_json(200, info)
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) != 3 or parts[0] != "models" or parts[2] != "activities":
+            self._send_json(404, {"error": "Not found"})
+            return
+        if parts[1] not in self.server.service.models:
+            self._send_json(404, {"error": "Unknown model: {}".format(parts[1])})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            self._send_json(400, {"error": "Invalid Content-Length"})
+            return
+        if length > self.server.max_body_size:
+            # The body is not read, so the connection cannot be re-used
+            self.close_connection = True
+            error = "Request body exceeds {} bytes".format(self.server.max_body_size)
+            self._send_json(413, {"error": error})
+            return
+
+        try:
+            payload = json.loads(self.rfile.read(length))
+            data = pd.DataFrame(payload["samples"], index=payload["genes"])
+            centered = payload.get("centered", False)
+            if not isinstance(centered, bool):
+                raise TypeError('"centered" must be true or false')
+            future = self.server.service.submit(parts[1], data, centered)
+        except (KeyError, TypeError, ValueError) as err:
+            self._send_json(400, {"error": str(err)})
+            return
+
+        try:
+            activities, flags = future.result()
+        except Exception as err:
+            self._send_json(500, {"error": str(err)})
+            return
+
+        self._send_json(
+            200,
+            {
+                "model": parts[1],
+                "activities": json.loads(activities.to_json()),
+                "flags": None if flags is None else json.loads(
+                    flags.to_json(orient="records")
+                ),
+            },
+        )
+
+    def _send_json(self, status: int, content):
+        body = json.dumps(content).encode()
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            encoding = "gzip"
+        else:
+            encoding = None
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.info("%s - %s", self.address_string(), format % args)
+
+
+def make_server(
+    service: ModelService,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    max_body_size: int = 64 * 2 ** 20,
+) -> ThreadingHTTPServer:
+    """
+    Creates an HTTP server for a model service. Call serve_forever() on the
+    result to start serving requests.
+
+    Parameters
+    ----------
+    service : ModelService
+        Service used to score requests
+    host : str
+        Address to listen on (default: 127.0.0.1)
+    port : int
+        Port to listen on, or 0 to pick a free port (default: 8000)
+    max_body_size : int
+        Largest request body in bytes. Larger requests are rejected with
+        status 413 (default: 64 MiB)
+
+    Returns
+    -------
+    ThreadingHTTPServer
+        The HTTP server
+    """
+    server = ThreadingHTTPServer((host, port), _RequestHandler)
+    server.service = service
+    server.max_body_size = max_body_size
+    return server
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Serve iModulon activity inference over HTTP"
+    )
+    parser.add_argument(
+        "--model",
+        action="append",
+        required=True,
+        metavar="NAME=FILE",
+        help="Model to serve (.json, .json.gz, .pkl or .pickle). Can be repeated.",
+    )
+    parser.add_argument(
+        "--reference",
+        action="append",
+        default=[],
+        metavar="NAME=PROJECT:CONDITION",
+        help="Reference condition of a model (default: all samples)",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait", type=float, default=0.01)
+    parser.add_argument("--threshold", type=float, default=5)
+    parser.add_argument("--fdr", type=float, default=0.1)
+    parser.add_argument("--max-body-size", type=int, default=64 * 2 ** 20)
+    args = parser.parse_args(argv)
+
+    models = dict(_parse_pair(arg, load_model) for arg in args.model)
+    reference = dict(_parse_pair(arg) for arg in args.reference)
+    service = ModelService(
+        models,
+        reference=reference,
+        threshold=args.threshold,
+        fdr=args.fdr,
+        workers=args.workers,
+        max_batch_size=args.max_batch_size,
+        max_wait=args.max_wait,
+    )
+
+    server = make_server(service, args.host, args.port, args.max_body_size)
+    print(
+        "Serving {} on port {}".format(", ".join(models), server.server_port),
+        flush=True,
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+def _parse_pair(arg: str, convert=None):
+    # Parses NAME=VALUE command line arguments
+    name, sep, value = arg.partition("=")
+    if not sep:
+        raise ValueError("Expected NAME=VALUE, got {}".format(arg))
+    return name, value if convert is None else convert(value)
+
+
+if __name__ == "__main__":
+    main()
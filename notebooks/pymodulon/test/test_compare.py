@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""Tests for the BBH functions in :mod:`pymodulon.compare`. BLAST is replaced by
+small local stand-in executables, so these tests do not require BLAST."""
+
+import os
+import stat
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pymodulon.compare import (
+    OrthologMap,
+    _parse_bbh,
+    convert_gene_index,
+    run_bbh_matrix,
+)
+
+FAKE_MAKEBLASTDB = """#!{python}
+import sys
+
+fasta = sys.argv[sys.argv.index("-in") + 1]
+for ext in [".phr", ".pin", ".psq"]:
+    open(fasta + ext, "w").close()
+"""
+
+FAKE_BLASTP = """#!{python}
+import sys
+
+
+def read_fasta(path):
+    seqs = {{}}
+    name = None
+    for line in open(path):
+        line = line.strip()
+        if line.startswith(">"):
+            name = line[1:].split()[0]
+            seqs[name] = ""
+        elif line:
+            seqs[name] += line
+    return seqs
+
+
+args = sys.argv
+db = read_fasta(args[args.index("-db") + 1])
+query = read_fasta(args[args.index("-query") + 1])
+with open(args[args.index("-out") + 1], "w") as f:
+    for q, q_seq in query.items():
+        for s, s_seq in db.items():
+            n = min(len(q_seq), len(s_seq))
+            pid = 100 * sum(a == b for a, b in zip(q_seq, s_seq)) / n
+            if pid >= 50:
+                fields = [q, s, pid, n, 0, 0, 1, n, 1, n, 1e-10, 2 * pid]
+                f.write("\\t".join(str(x) for x in fields) + "\\n")
+"""
+
+PROTEOMES = {
+    "orgA": {"a1": "MKTAYIAKQR", "a2": "MSEQNLLAVV", "a3": "MGGGHHHCCC"},
+    "orgB": {"b1": "MKTAYIAKQR", "b2": "MSEQNLLAVI", "b3": "MWWWPPPYYY"},
+    "orgC": {"x1": "MKTAYIAKQA", "x2": "MSEQNLLAVV"},
+}
+
+
+def _write_executable(path, content):
+    with open(path, "w") as f:
+        f.write(content.format(python=sys.executable))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+@pytest.fixture
+def bbh_inputs(tmp_path):
+    fasta_files = []
+    for org, prots in PROTEOMES.items():
+        fasta = tmp_path / (org + ".faa")
+        with open(fasta, "w") as f:
+            for name, seq in prots.items():
+                f.write(">{}\n{}\n".format(name, seq))
+        fasta_files.append(str(fasta))
+
+    blastp = _write_executable(tmp_path / "blastp", FAKE_BLASTP)
+    makeblastdb = _write_executable(tmp_path / "makeblastdb", FAKE_MAKEBLASTDB)
+    return fasta_files, blastp, makeblastdb, tmp_path / "bbh"
+
+
+def test_run_bbh_matrix(bbh_inputs, capsys):
+    fasta_files, blastp, makeblastdb, outdir = bbh_inputs
+
+    results = run_bbh_matrix(
+        fasta_files,
+        outdir=str(outdir),
+        processes=2,
+        blastp=blastp,
+        makeblastdb=makeblastdb,
+    )
+    assert "running 6 of 6 BLASTP jobs" in capsys.readouterr().out
+
+    # One parsed table for every ordered pair of organisms
+    assert len(results) == 6
+    for org1, org2 in results.keys():
+        assert os.path.isfile(outdir / "{}_vs_{}_parsed.csv".format(org1, org2))
+
+    ab = results[("orgA", "orgB")].set_index("gene").subject.to_dict()
+    assert ab == {"a1": "b1", "a2": "b2"}
+    ba = results[("orgB", "orgA")].set_index("gene").subject.to_dict()
+    assert ba == {"b1": "a1", "b2": "a2"}
+
+    # Re-running skips all up-to-date jobs and re-uses the parsed tables
+    rerun = run_bbh_matrix(
+        fasta_files,
+        outdir=str(outdir),
+        blastp=blastp,
+        makeblastdb=makeblastdb,
+    )
+    out = capsys.readouterr().out
+    assert "running 0 of 6 BLASTP jobs" in out
+    assert "parsing BBHs" not in out
+    assert rerun[("orgA", "orgC")].subject.tolist() == (
+        results[("orgA", "orgC")].subject.tolist()
+    )
+
+
+def test_parse_bbh_streaming(tmp_path):
+    # IDs starting with "c" or "l" must survive removal of the "lcl|" prefix
+    hits1 = [
+        ["lcl|cysA", "lcl|lysC", 100.0, 30],
+        ["lcl|cysA", "lcl|cutB", 90.0, 30],
+        ["lcl|cutC", "lcl|lysC", 99.0, 30],
+        ["lcl|cutC", "lcl|cysB", 80.0, 10],  # fails coverage filter
+    ]
+    hits2 = [
+        ["lcl|lysC", "lcl|cysA", 100.0, 40],
+        ["lcl|cysB", "lcl|cutC", 100.0, 40],
+    ]
+    for name, hits in [("1", hits1), ("2", hits2)]:
+        rows = [h + [0, 0, 1, h[3], 1, h[3], 1e-10, 50] for h in hits]
+        pd.DataFrame(rows).to_csv(
+            tmp_path / (name + ".txt"), sep="\t", header=False, index=False
+        )
+
+    lens1 = pd.DataFrame({"gene": ["lcl|cysA", "lcl|cutC"], "gene_length": [30, 30]})
+    lens2 = pd.DataFrame({"gene": ["lcl|lysC", "lcl|cysB"], "gene_length": [40, 40]})
+
+    for chunksize in [1, 3, 100]:
+        out = _parse_bbh(
+            str(tmp_path / "1.txt"),
+            str(tmp_path / "2.txt"),
+            lens1,
+            lens2,
+            mincov=0.8,
+            chunksize=chunksize,
+        )
+        assert out.gene.tolist() == ["cysA"]
+        assert out.subject.tolist() == ["lysC"]
+        assert out.BBH.tolist() == ["<=>"]
+
+
+def test_ortholog_map(tmp_path):
+    bbh = pd.DataFrame(
+        {"gene": ["g1", "g2", "g3", "g5"], "subject": ["s1", "s2", "s4", "s3"]}
+    )
+    bbh_file = str(tmp_path / "bbh.csv")
+    bbh.to_csv(bbh_file)
+
+    M1 = pd.DataFrame(np.arange(8).reshape(4, 2), index=["g1", "g2", "g3", "g4"])
+    M2 = pd.DataFrame(np.arange(6).reshape(3, 2), index=["s3", "s2", "s1"])
+    gene_table2 = pd.DataFrame({"gene_name": ["c", "b", "a"]}, index=M2.index)
+
+    new_M1, new_M2 = convert_gene_index(M1, M2, bbh_file)
+    assert new_M1.index.tolist() == ["g1", "g2"]
+    assert new_M2.index.tolist() == ["g1", "g2"]
+    assert new_M2.values.tolist() == [[4, 5], [2, 3]]
+
+    _, new_table2 = convert_gene_index(M1, gene_table2, bbh_file, keep_locus=True)
+    assert new_table2.locus_tag.tolist() == ["s1", "s2"]
+    assert new_table2.gene_name.tolist() == ["a", "b"]
+
+    # The map is cached until the BBH file changes
+    ortho_map = OrthologMap.from_file(bbh_file)
+    assert OrthologMap.from_file(bbh_file) is ortho_map
+    bbh.iloc[:1].to_csv(bbh_file)
+    mtime = os.path.getmtime(bbh_file)
+    os.utime(bbh_file, (mtime + 10, mtime + 10))
+    assert OrthologMap.from_file(bbh_file) is not ortho_map
+    assert len(convert_gene_index(M1, M2, bbh_file)[0]) == 1
+
+    # Every copy of a duplicated gene is kept, like label-based indexing
+    dup_index = M1.index.append(pd.Index(["g2"]))
+    M1_dup = pd.DataFrame(np.arange(10).reshape(5, 2), index=dup_index)
+    dup1, dup2 = convert_gene_index(M1_dup, M2, bbh)
+    assert dup1.index.tolist() == ["g1", "g2", "g2"]
+    assert dup1.values.tolist() == [[0, 1], [2, 3], [8, 9]]
+    assert dup2.index.tolist() == ["g1", "g2", "g2"]
+    assert dup2.values.tolist() == [[4, 5], [2, 3], [2, 3]]
+
+    # Only the most recently used BBH files are kept
+    for i in range(OrthologMap._cache_size + 2):
+        bbh.to_csv(tmp_path / "bbh{}.csv".format(i))
+        OrthologMap.from_file(str(tmp_path / "bbh{}.csv".format(i)))
+    assert len(OrthologMap._cache) == OrthologMap._cache_size
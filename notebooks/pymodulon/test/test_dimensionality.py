@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Tests for :mod:`pymodulon.dimensionality`."""
+
+import os
+import shutil
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+from pymodulon.dimensionality import find_dimensionality, sweep_dimensionality
+
+
+@pytest.fixture
+def ica_dir(tmp_path):
+    rng = np.random.default_rng(0)
+    genes = ["g{}".format(i) for i in range(300)]
+    sources = rng.laplace(size=(300, 12))
+
+    for dim in [4, 8, 12]:
+        run_dir = tmp_path / str(dim)
+        os.makedirs(run_dir)
+        S = sources[:, :dim] + 0.1 * rng.normal(size=(300, dim))
+        if dim == 12:
+            S[:, 10] = 0.01 * rng.normal(size=300)
+            S[5, 10] = 1  # single gene component
+        pd.DataFrame(S, index=genes).to_csv(run_dir / "S.csv")
+
+    # Runs without an S matrix are skipped
+    os.makedirs(tmp_path / "16")
+    return tmp_path
+
+
+def test_find_dimensionality(ica_dir):
+    with pytest.warns(UserWarning, match="16"):
+        DF_stats, dimensionality = find_dimensionality(str(ica_dir))
+
+    assert DF_stats.index.tolist() == [4, 8, 12]
+    assert DF_stats["Robust Components"].tolist() == [4, 8, 12]
+    assert DF_stats["Single Gene Components"].tolist() == [0, 0, 1]
+    assert DF_stats["Multi-gene Components"].tolist() == [4, 8, 11]
+
+    # Final components match pairwise Pearson correlations
+    final = pd.read_csv(ica_dir / "12" / "S.csv", index_col=0)
+    for dim in [4, 8, 12]:
+        S = pd.read_csv(ica_dir / str(dim) / "S.csv", index_col=0)
+        n_final = sum(
+            abs(stats.pearsonr(final[c1], S[c2])[0]) > 0.7
+            for c1 in final.columns
+            for c2 in S.columns
+        )
+        assert DF_stats.loc[dim, "Final Components"] == n_final
+
+    assert dimensionality == 4
+
+
+def test_sweep_dimensionality(ica_dir, tmp_path_factory, monkeypatch):
+    data_dir = tmp_path_factory.mktemp("data")
+    for strain in ["strainA", "strainB"]:
+        shutil.copytree(ica_dir, data_dir / strain / "interim" / "ica_runs")
+    os.makedirs(data_dir / "no_runs")
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        DF_summary, dims = sweep_dimensionality(str(data_dir), processes=2)
+        DF_stats = find_dimensionality(str(ica_dir))[0]
+    assert dims.to_dict() == {"strainA": 4, "strainB": 4}
+    assert DF_summary.index.names == ["strain", "dimensionality"]
+    assert DF_summary.loc["strainB"].equals(DF_stats)
+
+    # Adding a run only parses the new S matrix
+    run_dir = data_dir / "strainA" / "interim" / "ica_runs"
+    shutil.copy(run_dir / "12" / "S.csv", run_dir / "16" / "S.csv")
+    parsed = []
+    read_csv = pd.read_csv
+
+    def counting_read_csv(path, *args, **kwargs):
+        parsed.append(str(path))
+        return read_csv(path, *args, **kwargs)
+
+    monkeypatch.setattr(pd, "read_csv", counting_read_csv)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        DF_summary, dims = sweep_dimensionality(str(data_dir), processes=1)
+    assert parsed == [str(run_dir / "16" / "S.csv")]
+    assert DF_summary.loc["strainA"].index.tolist() == [4, 8, 12, 16]
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""Tests for :mod:`pymodulon.enrichment`."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pymodulon.core import IcaData
+from pymodulon.enrichment import (
+    FDR,
+    compute_annotation_enrichment,
+    compute_annotation_enrichments,
+    compute_enrichment,
+)
+
+
+@pytest.fixture
+def annotation():
+    rng = np.random.default_rng(0)
+    genes = ["g{}".format(i) for i in range(200)]
+    annotation = pd.DataFrame(
+        {
+            "gene_id": rng.choice(genes, 400),
+            "term": rng.choice(["t{}".format(i) for i in range(15)], 400),
+        }
+    )
+    # One term matching a gene set exactly, and one unannotated gene
+    exact = pd.DataFrame({"gene_id": genes[:10], "term": "exact"})
+    missing = pd.DataFrame({"gene_id": ["g0"], "term": [np.nan]})
+    return genes, pd.concat([annotation, exact, missing], ignore_index=True)
+
+
+def _loop_enrichment(gene_set, all_genes, annotation, column, fdr):
+    enrich_list = [
+        compute_enrichment(gene_set, group["gene_id"], all_genes, label=name)
+        for name, group in annotation.groupby(column)
+    ]
+    return FDR(pd.concat(enrich_list, axis=1).T.astype(float), fdr=fdr)
+
+
+def test_compute_annotation_enrichment(annotation):
+    genes, annotation = annotation
+    rng = np.random.default_rng(1)
+    gene_sets = {"exact": set(genes[:10]), "empty": set()}
+    for i in range(10):
+        gene_sets[i] = set(rng.choice(genes, 5 * (i + 1), replace=False))
+
+    results = compute_annotation_enrichments(
+        gene_sets, genes, annotation, "term", fdr=1
+    )
+    assert list(results.keys()) == list(gene_sets.keys())
+    for name, gene_set in gene_sets.items():
+        expected = _loop_enrichment(gene_set, genes, annotation, "term", fdr=1)
+        pd.testing.assert_frame_equal(
+            results[name], expected, check_names=False, check_index_type=False
+        )
+
+    exact = compute_annotation_enrichment(
+        gene_sets["exact"], genes, annotation, "term", fdr=0.01
+    )
+    assert exact.index.tolist() == ["exact"]
+    assert exact.loc["exact", ["pvalue", "f1score"]].tolist() == [0, 1]
+
+    with pytest.raises(ValueError):
+        compute_annotation_enrichment({"x"}, genes, annotation, "term")
+    with pytest.raises(ValueError):
+        compute_annotation_enrichment(set(genes[:5]), genes[1:], annotation, "term")
+
+
+def test_imodulon_annotation_enrichment(annotation):
+    genes, annotation = annotation
+    M = pd.DataFrame(0.0, index=genes, columns=[0, 1])
+    M.iloc[:10, 0] = 1
+    M.iloc[50:70, 1] = -1
+    A = pd.DataFrame(np.ones((2, 3)), index=M.columns)
+    ica_data = IcaData(M, A, thresholds=[0.5, 0.5])
+
+    DF_enriched = ica_data.compute_annotation_enrichment(annotation, "term", fdr=1)
+    assert DF_enriched.columns[:2].tolist() == ["imodulon", "term"]
+    assert set(DF_enriched.imodulon) == {0, 1}
+    top = DF_enriched.sort_values("pvalue").iloc[0]
+    assert (top.imodulon, top.term, top.imodulon_size) == (0, "exact", 10)
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""Tests for :mod:`pymodulon.gene_util`."""
+
+import threading
+import urllib.parse
+from functools import partial
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import numpy as np
+import pandas as pd
+import pytest
+from Bio import SeqIO
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from pymodulon.gene_util import (
+    _query_uniprot,
+    extract_cds,
+    gff2pandas,
+    uniprot_id_mapping,
+)
+
+GFF = """##gff-version 3
+#!processor NCBI annotwriter
+##sequence-region NC_1 1 1000
+NC_1\tRefSeq\tregion\t1\t1000\t.\t+\t.\tID=NC_1:1..1000;Name=ANONYMOUS
+NC_1\tRefSeq\tgene\t300\t400\t.\t-\t.\tID=gene-B;Name=geneB;gene_biotype=protein_coding;locus_tag=B0002;old_locus_tag=b2
+NC_1\tRefSeq\tCDS\t300\t400\t.\t-\t0\tID=cds-B;Parent=gene-B;pseudogene=unknown;gene=geneB;product=protein B;protein_id=WP_2.1;locus_tag=B0002
+###
+NC_1\tRefSeq\tgene\t10\t100\t.\t+\t.\tID=gene-A;old_locus_tag=a1;locus_tag=A0001
+NC_1\tRefSeq\tCDS\t10\t100\t.\t+\t0\tID=cds-A;Parent=gene-A;locus_tag=A0001;product=2%2C3-dioxygenase
+##FASTA
+>NC_1
+ACGT
+"""
+
+
+def test_gff2pandas(tmp_path):
+    gff_file = tmp_path / "genome.gff3"
+    gff_file.write_text(GFF)
+
+    DF_cds = gff2pandas(str(gff_file))
+    assert DF_cds.locus_tag.tolist() == ["A0001", "B0002"]
+    assert DF_cds.start.tolist() == [10, 300]
+    assert DF_cds.end.tolist() == [100, 400]
+    assert DF_cds.strand.tolist() == ["+", "-"]
+    assert DF_cds.gene_name.isnull().tolist() == [True, False]
+    assert DF_cds.gene_name[1] == "geneB"
+    assert DF_cds.gene_product.tolist() == ["2%2C3-dioxygenase", "protein B"]
+    assert DF_cds.ncbi_protein.isnull().tolist() == [True, False]
+    assert DF_cds.ncbi_protein[1] == "WP_2.1"
+    assert DF_cds.old_locus_tag.tolist() == ["a1", "b2"]
+    assert DF_cds.columns.tolist()[:9] == [
+        "refseq",
+        "source",
+        "feature",
+        "start",
+        "end",
+        "score",
+        "strand",
+        "phase",
+        "attributes",
+    ]
+
+
+def test_gff2pandas_missing_locus_tag(tmp_path):
+    gff_file = tmp_path / "genome.gff3"
+    gff_file.write_text("NC_1\tRefSeq\tCDS\t1\t9\t.\t+\t0\tID=cds-A\n")
+    with pytest.raises(ValueError):
+        gff2pandas(str(gff_file))
+
+
+def test_extract_cds(tmp_path):
+    rng = np.random.default_rng(0)
+    contigs = {
+        "NC_1": "".join(rng.choice(list("ACGTNRYKMacgt"), 500)),
+        "NC_2": "".join(rng.choice(list("ACGT"), 200)),
+    }
+    # Header descriptions may contain ">"
+    descriptions = {"NC_1": "", "NC_2": "NC_2 plasmid 5'->3' >partial"}
+    fasta_files = []
+    for name, seq in contigs.items():
+        fasta = tmp_path / (name + ".fasta")
+        record = SeqRecord(Seq(seq), id=name, description=descriptions[name])
+        SeqIO.write(record, fasta, "fasta")
+        fasta_files.append(str(fasta))
+
+    DF_annot = pd.DataFrame(
+        {
+            "refseq": ["NC_1", "NC_1", "NC_2", "NC_1", "NC_3"],
+            "start": [1, 50, 10, 300, 1],
+            "end": [130, 120, 90, 499, 10],
+            "strand": ["+", "-", "-", "-", "+"],
+            "gene_name": ["geneA", None, "geneC geneC2", "D0004", "geneE"],
+        },
+        index=["A0001", "B0002", "C0003", "D0004", "E0005"],
+    )
+
+    # Same output as slicing Biopython records gene by gene
+    records = []
+    for fasta in fasta_files:
+        seq = SeqIO.read(fasta, "fasta")
+        for name, row in DF_annot[DF_annot.refseq == seq.id].iterrows():
+            cds = seq[row.start - 1 : row.end]
+            if row.strand == "-":
+                cds = cds.reverse_complement()
+            cds.id = name
+            cds.description = row.gene_name if pd.notnull(row.gene_name) else name
+            records.append(cds)
+    SeqIO.write(records, tmp_path / "expected.fna", "fasta")
+
+    n = extract_cds(DF_annot, fasta_files, str(tmp_path / "CDS.fna"))
+    assert n == 4
+    expected = (tmp_path / "expected.fna").read_bytes()
+    assert (tmp_path / "CDS.fna").read_bytes() == expected
+
+
+class _MappingHandler(BaseHTTPRequestHandler):
+    """Stand-in for the uniprot ID mapping service"""
+
+    mapping = {"P1": ["U1b", "U1a"], "P2": ["U2"], "P4": ["U4"]}
+    requests = []
+    fail_next = 0
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        params = urllib.parse.parse_qs(self.rfile.read(length).decode())
+        query = params["query"][0].split()
+        self.requests.append(query)
+
+        if _MappingHandler.fail_next > 0:
+            _MappingHandler.fail_next -= 1
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        lines = ["From\tTo"] + [
+            "{}\t{}".format(p, u) for p in query for u in self.mapping.get(p, [])
+        ]
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write("\n".join(lines).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def uniprot_url():
+    server = HTTPServer(("127.0.0.1", 0), _MappingHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    _MappingHandler.requests = []
+    yield "http://127.0.0.1:{}/".format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+def test_uniprot_id_mapping(uniprot_url, tmp_path):
+    backend = partial(_query_uniprot, url=uniprot_url)
+    prots = ["P1", "P2", "", "P3", "P4", "P2"]
+    cache_file = str(tmp_path / "uniprot.db")
+
+    # The first request fails and is retried
+    _MappingHandler.fail_next = 1
+    with pytest.warns(UserWarning, match="retrying"):
+        mapping = uniprot_id_mapping(
+            prots,
+            input_name="ncbi_protein",
+            output_name="uniprot",
+            batch_size=2,
+            backoff=0,
+            cache_file=cache_file,
+            backend=backend,
+        )
+    requests = _MappingHandler.requests
+    assert len(requests) == 3
+    assert sorted(set(map(tuple, requests))) == [("P1", "P2"), ("P3", "P4")]
+    result = mapping.set_index("ncbi_protein").uniprot.to_dict()
+    assert result == {"P1": "U1a", "P2": "U2", "P4": "U4"}
+
+    # Cached proteins, including unmapped ones, are not requested again
+    _MappingHandler.requests = []
+    mapping = uniprot_id_mapping(
+        ["P4", "P3", "P1", "P5"],
+        input_name="ncbi_protein",
+        output_name="uniprot",
+        cache_file=cache_file,
+        backend=backend,
+    )
+    assert _MappingHandler.requests == [["P5"]]
+    assert mapping.set_index("ncbi_protein").uniprot.to_dict() == {
+        "P1": "U1a",
+        "P4": "U4",
+    }
+
+
+def test_uniprot_id_mapping_backend():
+    calls = []
+
+    def backend(prot_list, input_id, output_id):
+        calls.append((prot_list, input_id, output_id))
+        return [(p, p.lower()) for p in prot_list]
+
+    mapping = uniprot_id_mapping(
+        ["A", "B", "C"], input_id="EMBL", output_id="ACC", batch_size=2, backend=backend
+    )
+    assert mapping.output_id.tolist() == ["a", "b", "c"]
+    assert sorted(calls) == [(["A", "B"], "EMBL", "ACC"), (["C"], "EMBL", "ACC")]
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Tests for the iModulonDB table builders in :mod:`pymodulon.imodulondb`."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pymodulon.core import IcaData
+from pymodulon.imodulondb import (
+    imdb_gene_hist_df,
+    imdb_regulon_scatter_df,
+    imdb_regulon_scatter_dfs,
+)
+from pymodulon.plotting import _get_fit
+
+
+@pytest.fixture
+def ica_data():
+    genes = ["b{:04d}".format(i) for i in range(200)]
+    rng = np.random.default_rng(0)
+    M = pd.DataFrame(rng.normal(scale=0.02, size=(200, 2)), index=genes)
+    M.iloc[:10, 0] = np.linspace(0.1, 0.2, 10)
+    A = pd.DataFrame(rng.normal(size=(2, 4)), index=M.columns)
+    gene_table = pd.DataFrame(
+        {"gene_name": ["g{}".format(i) for i in range(200)]}, index=genes
+    )
+    trn = pd.DataFrame(
+        {
+            "regulator": ["tfA"] * 8 + ["tfB"] * 3,
+            "gene_id": genes[:8] + genes[5:7] + genes[100:101],
+        }
+    )
+    imodulon_table = pd.DataFrame({"TF": ["tfA+tfB", np.nan]}, index=M.columns)
+    return IcaData(
+        M,
+        A,
+        gene_table=gene_table,
+        trn=trn,
+        imodulon_table=imodulon_table,
+        thresholds=[0.08, 0.08],
+    )
+
+
+def test_imdb_gene_hist_df(ica_data):
+    res = imdb_gene_hist_df(ica_data, 0)
+
+    # TF order follows the parsed TF string, which is not fixed
+    pair = next(i for i in res.index if " and " in i and not i.endswith("_genes"))
+    combos = ["unreg", "tfA", "tfB", pair]
+    assert sorted(pair.split(" and ")) == ["tfA", "tfB"]
+    assert res.index[0] == "thresh"
+    assert sorted(res.index[1:5]) == sorted(combos)
+    assert sorted(res.index[5:]) == sorted(c + "_genes" for c in combos)
+    assert res.loc["thresh"].tolist()[:3] == [-0.08, 0.08, 4]
+    counts = res.loc[["tfA", "tfB", pair]].values.sum(axis=1)
+    assert counts.tolist() == [6, 1, 2]
+
+    # Regulated gene lists are always shown
+    both = [s for s in res.loc[pair + "_genes"] if s != "[]"]
+    assert both == ["['g5']", "['g6']"]
+
+    # Unregulated genes are only listed outside of the threshold
+    columns = res.columns.values
+    for col in columns[np.abs(columns) + 0.01 < 0.08]:
+        assert res.loc["unreg_genes", col] == "[]"
+    listed = " ".join(res.loc["unreg_genes"])
+    assert "'g8'" in listed and "'g9'" in listed
+
+
+def test_imdb_gene_hist_df_unregulated(ica_data):
+    res = imdb_gene_hist_df(ica_data, 1)
+    assert res.index.tolist() == ["thresh", "unreg", "unreg_genes"]
+    assert res.loc["unreg"].sum() <= 200
+
+
+def test_regulator_matrix(ica_data):
+    matrix = ica_data.regulator_matrix
+    assert matrix is ica_data.regulator_matrix
+    assert matrix.shape == (200, 2)
+    assert matrix.tfA.sum() == 8 and matrix.tfB.sum() == 3
+
+    # Replacing the TRN resets the cached matrix
+    ica_data.trn = ica_data.trn[ica_data.trn.regulator == "tfA"]
+    assert ica_data.regulator_matrix.columns.tolist() == ["tfA"]
+    res = imdb_gene_hist_df(ica_data, 0)
+    assert "tfB" not in res.index
+
+
+def test_imdb_regulon_scatter_df():
+    rng = np.random.default_rng(0)
+    genes = ["b{:04d}".format(i) for i in range(20)]
+    M = pd.DataFrame(rng.normal(size=(20, 2)), index=genes)
+    A = pd.DataFrame(rng.normal(size=(2, 30)), index=M.columns)
+    X = pd.DataFrame(rng.normal(size=(20, 30)), index=genes, columns=A.columns)
+    X.iloc[1] = np.maximum(A.iloc[0], 0) + rng.normal(scale=0.1, size=30)
+    gene_table = pd.DataFrame(
+        {"gene_name": ["tfA", "tfB"] + ["g{}".format(i) for i in range(18)]},
+        index=genes,
+    )
+    imodulon_table = pd.DataFrame({"TF": ["tfA/TFB", np.nan]}, index=M.columns)
+    model = IcaData(
+        M,
+        A,
+        X=X,
+        gene_table=gene_table,
+        imodulon_table=imodulon_table,
+        thresholds=[1, 1],
+    )
+
+    res = imdb_regulon_scatter_df(model, 0)
+    assert res.columns.tolist() == ["A", "TFB", "tfA"]
+    assert res.loc[A.columns, "A"].tolist() == A.loc[0].tolist()
+    for tf, gene in [("tfA", "b0000"), ("TFB", "b0001")]:
+        params, r2 = _get_fit(X.loc[gene], A.loc[0])
+        assert np.isclose(res.loc["R2", tf], r2)
+        assert res.loc["xmin", tf] == X.loc[gene].min()
+        assert np.isnan(res.loc["xmid", tf]) == (len(params) == 2)
+    assert imdb_regulon_scatter_df(model, 1) is None
+
+    # All iModulons at once
+    all_res = imdb_regulon_scatter_dfs(model)
+    assert list(all_res.keys()) == [0, 1]
+    assert all_res[0].equals(res) and all_res[1] is None
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""Tests for helper functions in :mod:`pymodulon.plotting`."""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import OptimizeWarning, curve_fit
+from sklearn.cluster import AgglomerativeClustering
+from sklearn.metrics import silhouette_score
+
+from pymodulon.core import IcaData
+from pymodulon.plotting import (
+    _adj_r2,
+    _auto_threshold_scan,
+    _broken_line,
+    _get_fit,
+    _get_fits,
+    _solid_line,
+)
+
+
+def test_auto_threshold_scan():
+    rng = np.random.default_rng(0)
+    A = pd.DataFrame(rng.normal(size=(40, 20)))
+    for i in range(0, 20, 4):
+        A[i + 1] = A[i] + rng.normal(scale=0.5, size=40)
+    distance_matrix = 1 - A.corr().abs()
+    thresholds = np.arange(0, 1, 0.025)
+
+    result = _auto_threshold_scan(distance_matrix, thresholds)
+    assert result.threshold.tolist() == thresholds.tolist()
+    assert result.n_clusters.iloc[0] == 20
+
+    # Same clusters and scores as fitting AgglomerativeClustering at each threshold
+    for row in result.itertuples():
+        clusters = AgglomerativeClustering(
+            n_clusters=None,
+            metric="precomputed",
+            linkage="complete",
+            distance_threshold=row.threshold,
+        ).fit(distance_matrix)
+        assert row.n_clusters == clusters.n_clusters_
+        if 1 < row.n_clusters < 20:
+            expected = silhouette_score(
+                distance_matrix, clusters.labels_, metric="precomputed"
+            )
+            assert np.isclose(row.score, expected)
+        else:
+            assert row.score == 0
+
+    assert result.equals(_auto_threshold_scan(distance_matrix, thresholds, threads=2))
+
+
+def test_activity_cache():
+    rng = np.random.default_rng(0)
+    M = pd.DataFrame(rng.normal(size=(50, 6)))
+    A = pd.DataFrame(rng.normal(size=(6, 30)), index=M.columns)
+    ica_data = IcaData(M, A, thresholds=[1] * 6)
+
+    corr = ica_data.activity_correlation()
+    assert corr.equals(A.T.corr())
+    assert ica_data.activity_correlation() is corr
+    assert ica_data.activity_correlation("spearman") is not corr
+    linkage_matrix = ica_data.activity_linkage()
+    assert ica_data.activity_linkage() is linkage_matrix
+
+    # Linkage gives the same scan as the distance matrix
+    thresholds = np.arange(0, 1, 0.025)
+    distance_matrix = 1 - corr.abs()
+    assert _auto_threshold_scan(distance_matrix, thresholds).equals(
+        _auto_threshold_scan(
+            distance_matrix, thresholds, linkage_matrix=linkage_matrix
+        )
+    )
+
+    # Changes to A or iModulon names invalidate the cache
+    ica_data.A.iloc[0] = -ica_data.A.iloc[1]
+    new_corr = ica_data.activity_correlation()
+    assert new_corr is not corr and np.isclose(new_corr.loc[0, 1], -1)
+    assert ica_data.activity_linkage() is not linkage_matrix
+    ica_data.rename_imodulons({0: "a"})
+    assert ica_data.activity_correlation().index[0] == "a"
+
+
+def test_get_fit():
+    rng = np.random.default_rng(0)
+    x = rng.uniform(-3, 3, size=(4, 80))
+    y = 2 * np.maximum(x[0], 0.5) + 1 + rng.normal(scale=0.2, size=80)
+
+    params, r2 = _get_fit(x[0], y)
+    assert len(params) == 3 and abs(params[2] - 0.5) < 0.2
+    assert np.isclose(r2, _adj_r2(_broken_line, x[0], y, params))
+
+    params, r2 = _get_fit(x[1], 1 - x[1] + rng.normal(scale=0.2, size=80))
+    assert len(params) == 2 and np.isclose(params[0], -1, atol=0.1)
+
+    # At least as good as the broken lines found by curve_fit
+    for row in x:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=OptimizeWarning)
+            for c in [row.min(), row.mean(), row.max()]:
+                try:
+                    p0 = curve_fit(_broken_line, row, y, p0=[1, 1, c], maxfev=5000)
+                except (OptimizeWarning, RuntimeError):
+                    continue
+                expected = _adj_r2(_broken_line, row, y, p0[0])
+                assert _get_fit(row, y)[1] >= expected - 1e-9
+        expected = _adj_r2(_solid_line, row, y, curve_fit(_solid_line, row, y)[0])
+        assert _get_fit(row, y)[1] >= expected - 1e-9
+
+    # Batched fits give the same results as single fits
+    all_params, all_r2 = _get_fits(x, y)
+    for row, params, r2 in zip(x, all_params, all_r2):
+        assert np.allclose(_get_fit(row, y)[0], params)
+        assert _get_fit(row, y)[1] == r2
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""Tests for :mod:`pymodulon.qc`."""
+
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.cluster.hierarchy as sch
+from scipy import stats
+
+from pymodulon.qc import (
+    SampleClustering,
+    basic_qc,
+    blocked_sample_correlation,
+    find_dissimilar_replicates,
+    load_log_tpm_memmap,
+    replicate_correlations,
+    replicate_qc,
+    sample_correlation,
+)
+
+
+@pytest.fixture
+def expression():
+    rng = np.random.default_rng(0)
+    base = rng.normal(size=(500, 4))
+    conditions = ["c0", "c0", "c1", "c1", "c1", "c2", "c3", "c3"]
+    noise = [0.1, 0.1, 0.1, 0.1, 2, 0.1, 0.1, 0.1]
+    samples = ["s{}".format(i) for i in range(8)]
+
+    columns = {}
+    for sample, cond, scale in zip(samples, conditions, noise):
+        signal = base[:, min(int(cond[1]), 3)]
+        columns[sample] = signal + scale * rng.normal(size=500)
+    log_tpm = pd.DataFrame(columns)
+
+    metadata = pd.DataFrame(
+        {"project_name": "proj", "condition_name": conditions}, index=samples
+    )
+    metadata["full_name"] = "proj:" + metadata.condition_name
+    return log_tpm, metadata
+
+
+def test_sample_correlation(expression):
+    log_tpm, _ = expression
+    corr = sample_correlation(log_tpm)
+    assert np.allclose(corr.values, log_tpm.corr().values)
+    assert (np.diag(corr) == 1).all()
+
+
+def test_replicate_correlations(expression):
+    log_tpm, metadata = expression
+    rep_corrs, rand_corrs = replicate_correlations(log_tpm, metadata)
+
+    expected_rep = {}
+    expected_rand = {}
+    for exp1, exp2 in itertools.combinations(metadata.index, 2):
+        r = stats.pearsonr(log_tpm[exp1], log_tpm[exp2])[0]
+        if metadata.loc[exp1, "full_name"] == metadata.loc[exp2, "full_name"]:
+            expected_rep[(exp1, exp2)] = r
+        else:
+            expected_rand[(exp1, exp2)] = r
+
+    assert rep_corrs.index.tolist() == list(expected_rep.keys())
+    assert np.allclose(rep_corrs.values, list(expected_rep.values()))
+    assert rand_corrs.index.tolist() == list(expected_rand.keys())
+    assert np.allclose(rand_corrs.values, list(expected_rand.values()))
+
+
+def test_find_dissimilar_replicates(expression):
+    log_tpm, metadata = expression
+    # s4 is noisy and s5 has no replicates
+    assert find_dissimilar_replicates(log_tpm, metadata) == ["s4", "s5"]
+    assert find_dissimilar_replicates(log_tpm, metadata, rcutoff=0.3) == ["s5"]
+
+
+def test_qc_pipeline(expression):
+    log_tpm, metadata = expression
+    qc_stats = pd.DataFrame(
+        {"Assigned": [1e6] * 7 + [1e5], "adapter_content": "pass"},
+        index=log_tpm.columns,
+    )
+    qc_stats.loc["s1", "adapter_content"] = "warn"
+
+    result, clusters = basic_qc(
+        log_tpm, qc_stats, metadata, fastqc_fail_cols=["adapter_content"]
+    )
+    assert result.index.tolist() == log_tpm.columns.tolist()
+    assert result.passed_fastqc.tolist() == [True, False] + [True] * 6
+    assert result.passed_reads_mapped_to_CDS.tolist() == [True] * 7 + [False]
+    assert result.passed_global_correlation.all()
+
+    cluster_s5 = clusters.cluster["s5"]
+    result, _ = basic_qc(
+        log_tpm,
+        qc_stats,
+        metadata,
+        fastqc_fail_cols=["adapter_content"],
+        remove_clusters=[cluster_s5],
+    )
+    failed = result.index[~result.passed_global_correlation]
+    assert "s5" in failed and "s0" not in failed
+
+    with pytest.raises(ValueError):
+        basic_qc(log_tpm, qc_stats.iloc[1:], metadata)
+
+    result = replicate_qc(log_tpm, metadata.drop(columns="full_name"))
+    assert result.index[~result.passed_similar_replicates].tolist() == ["s4", "s5"]
+    assert result.index[~result.passed_number_replicates].tolist() == ["s5"]
+
+
+def test_sample_clustering():
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(300, 4))
+    labels = np.repeat(np.arange(4), 30)
+    noise = rng.normal(scale=0.5, size=(300, 120))
+    log_tpm = pd.DataFrame(centers[:, labels] + noise)
+
+    # Same clusters as clustering the full correlation matrix with pdist
+    corr = log_tpm.corr().fillna(0)
+    dist = sch.distance.pdist(corr)
+    link = sch.linkage(dist, method="complete")
+
+    clustering = SampleClustering(log_tpm)
+    assert clustering.corr is clustering.corr
+    assert clustering.corr.values.dtype == np.float32
+    for thresh in [0.2, 0.3, 0.6]:
+        expected = sch.fcluster(link, thresh * dist.max(), "distance")
+        clusters = clustering.clusters(thresh)
+        assert clusters.index.equals(log_tpm.columns)
+        assert (clusters.cluster.values == expected).all()
+
+    # Correlation data frames are aligned by sample name
+    order = rng.permutation(120)
+    shuffled = log_tpm.corr().iloc[order, order]
+    shuffled.loc["extra"] = 0
+    shuffled["extra"] = 0
+    from_df = SampleClustering(log_tpm, corr=shuffled)
+    assert np.allclose(from_df.corr, clustering.corr, atol=1e-6)
+    assert from_df.clusters(0.3).equals(clustering.clusters(0.3))
+    approx = SampleClustering(log_tpm, max_exact=50, n_landmarks=40, corr=shuffled)
+    assert (approx.clusters(0.3).cluster.groupby(labels).nunique() == 1).all()
+
+    # Approximate clustering through landmark samples
+    approx = SampleClustering(log_tpm, max_exact=50, n_landmarks=40)
+    assert approx.approximate and len(approx.landmarks) == 40
+    assert approx._corr is None
+    clusters = approx.clusters(0.3).cluster
+    assert len(clusters) == 120
+    assert (clusters.groupby(labels).nunique() == 1).all()
+    assert clusters.nunique() == 4
+
+
+def test_blocked_sample_correlation(expression, tmp_path):
+    log_tpm, metadata = expression
+    log_tpm.iloc[3, 2] = np.nan
+    log_tpm.to_csv(tmp_path / "log_tpm.csv")
+
+    mm_tpm = load_log_tpm_memmap(
+        tmp_path / "log_tpm.csv", tmp_path / "log_tpm.npy", chunksize=64
+    )
+    # The data frame wraps the memory map without copying it
+    base = mm_tpm.values
+    while base is not None and not isinstance(base, np.memmap):
+        base = base.base
+    assert isinstance(base, np.memmap)
+    filled = log_tpm.fillna(0)
+    assert np.allclose(mm_tpm.values, filled.values)
+    assert mm_tpm.columns.equals(log_tpm.columns)
+
+    corr = blocked_sample_correlation(mm_tpm, tmp_path / "corr.npy", block_size=3)
+    assert isinstance(corr, np.memmap)
+    assert np.allclose(corr, filled.corr().values, atol=1e-6)
+
+    # Downstream QC reads the on-disk matrix
+    assert find_dissimilar_replicates(mm_tpm, metadata, corr=corr) == ["s4", "s5"]
+    rep_corrs, _ = replicate_correlations(mm_tpm, metadata, corr=corr)
+    assert np.allclose(rep_corrs, replicate_correlations(filled, metadata)[0])
+
+    expected = SampleClustering(filled).clusters().cluster
+    clustering = SampleClustering(mm_tpm, corr=corr)
+    assert clustering.clusters().cluster.equals(expected)
+    approx = SampleClustering(mm_tpm, max_exact=4, n_landmarks=6, corr=corr)
+    assert len(approx.clusters()) == 8
+    assert approx._z is None
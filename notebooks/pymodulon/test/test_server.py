@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""Tests for :mod:`pymodulon.server`."""
+
+import json
+import pickle
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pymodulon.core import IcaData
+from pymodulon.server import ModelService, load_model, make_server
+from pymodulon.util import infer_activities
+
+
+@pytest.fixture
+def ica_data():
+    rng = np.random.default_rng(0)
+    genes = ["g{}".format(i) for i in range(60)]
+    samples = ["s{}".format(i) for i in range(40)]
+    conditions = ["c{}".format(i // 2) for i in range(40)]
+    M = pd.DataFrame(rng.normal(size=(60, 4)), index=genes)
+    # Duplicates of 20 conditions, with log-normal differences between them
+    A = np.repeat(rng.normal(scale=5, size=(4, 20)), 2, axis=1)
+    A[:, 1::2] += rng.lognormal(sigma=0.5, size=(4, 20))
+    A = pd.DataFrame(A, index=M.columns, columns=samples)
+    log_tpm = pd.DataFrame(
+        M.values @ A.values + 5, index=genes, columns=samples
+    )
+    sample_table = pd.DataFrame(
+        {
+            "project": "proj",
+            "condition": conditions,
+        },
+        index=samples,
+    )
+    return IcaData(
+        M, A, log_tpm=log_tpm, sample_table=sample_table, thresholds=[1] * 4
+    )
+
+
+@pytest.fixture
+def server(ica_data):
+    service = ModelService(
+        {"test": ica_data}, reference={"test": "proj:c0"}, threshold=3
+    )
+    server = make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    service.close()
+
+
+def _post(server, path, payload):
+    request = urllib.request.Request(
+        "http://127.0.0.1:{}{}".format(server.server_port, path),
+        data=json.dumps(payload).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def test_activities_endpoint(ica_data, server):
+    ref = ica_data.log_tpm[["s0", "s1"]].mean(axis=1)
+    data = ica_data.log_tpm[["s1", "s7"]].copy()
+    data["shifted"] = ref + 20 * ica_data.M[2]
+    payload = {
+        "genes": data.index.tolist(),
+        "samples": {col: data[col].tolist() for col in data.columns},
+    }
+    result = _post(server, "/models/test/activities", payload)
+
+    activities = pd.DataFrame(result["activities"])
+    activities.index = activities.index.astype(int)
+    expected = infer_activities(ica_data, data.sub(ref, axis=0))
+    assert np.allclose(activities.loc[expected.index, expected.columns], expected)
+
+    flagged = {(flag["sample"], flag["imodulon"]) for flag in result["flags"]}
+    assert ("shifted", 2) in flagged
+    assert not any(sample == "s1" for sample, _ in flagged)
+
+    # Pre-centered profiles skip centering
+    payload["centered"] = True
+    result = _post(server, "/models/test/activities", payload)
+    activities = pd.DataFrame(result["activities"])
+    assert np.allclose(activities["s7"], infer_activities(ica_data, data)["s7"])
+
+
+def test_errors(server):
+    with pytest.raises(urllib.error.HTTPError) as err:
+        _post(server, "/models/missing/activities", {"genes": [], "samples": {}})
+    assert err.value.code == 404
+    with pytest.raises(urllib.error.HTTPError) as err:
+        _post(server, "/models/test/activities", {"genes": ["g0", "g1"]})
+    assert err.value.code == 400
+    with pytest.raises(urllib.error.HTTPError) as err:
+        payload = {"genes": ["g0"], "samples": {"a": [1, 2]}}
+        _post(server, "/models/test/activities", payload)
+    assert err.value.code == 400
+    with pytest.raises(urllib.error.HTTPError) as err:
+        _post(server, "/models/test/activities", {"genes": ["g0"], "samples": {}})
+    assert err.value.code == 400
+    with pytest.raises(urllib.error.HTTPError) as err:
+        payload = {"genes": ["g0"], "samples": {"a": ["oops"]}}
+        _post(server, "/models/test/activities", payload)
+    assert err.value.code == 400
+    with pytest.raises(urllib.error.HTTPError) as err:
+        payload = {"genes": ["g0"], "samples": {"a": [1]}, "centered": "false"}
+        _post(server, "/models/test/activities", payload)
+    assert err.value.code == 400
+    with pytest.raises(urllib.error.HTTPError) as err:
+        _post(server, "/unknown", {})
+    assert err.value.code == 404
+
+    server.max_body_size = 100
+    with pytest.raises(urllib.error.HTTPError) as err:
+        payload = {"genes": ["g0"] * 20, "samples": {"a": [1] * 20}}
+        _post(server, "/models/test/activities", payload)
+    assert err.value.code == 413
+    server.max_body_size = 2 ** 20
+
+    url = "http://127.0.0.1:{}/models".format(server.server_port)
+    with urllib.request.urlopen(url) as response:
+        info = json.loads(response.read())
+    assert info == {"test": {"genes": 60, "imodulons": [0, 1, 2, 3], "flags": True}}
+
+
+def test_batching(ica_data):
+    data = ica_data.log_tpm
+    with ModelService({"test": ica_data}, max_wait=0.5, workers=1) as service:
+        futures = [service.submit("test", data[[col]]) for col in data.columns]
+        results = [future.result()[0] for future in futures]
+        assert service._n_batches < len(futures)
+
+    activities = pd.concat(results, axis=1)
+    centered = data.sub(data.mean(axis=1), axis=0)
+    assert np.allclose(activities, infer_activities(ica_data, centered))
+
+
+def test_invalid_requests(ica_data):
+    data = ica_data.log_tpm[["s0"]]
+    with ModelService({"test": ica_data}, max_wait=0.5) as service:
+        valid = service.submit("test", data)
+        with pytest.raises(ValueError):
+            service.submit("test", pd.DataFrame({"s0": "oops"}, index=data.index))
+        with pytest.raises(ValueError):
+            service.submit("test", data.iloc[:, :0])
+        activities, _ = valid.result()
+    assert activities.columns.tolist() == ["s0"]
+
+
+def test_load_model(ica_data, tmp_path):
+    filename = tmp_path / "model.pkl"
+    with open(filename, "wb") as f:
+        pickle.dump(ica_data, f)
+    model = load_model(filename)
+    assert model.M.equals(ica_data.M)
+    with pytest.raises(ValueError):
+        load_model(tmp_path / "model.csv")
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""Tests for :mod:`pymodulon.util`."""
+
+import numpy as np
+import pandas as pd
+
+from pymodulon.core import IcaData
+from pymodulon.util import (
+    ActivityProjector,
+    build_tree,
+    cluster_activity_matrix,
+    entropy,
+    infer_activities,
+    lnc_correction,
+    mi,
+    mutual_info_distance,
+    mutual_info_distance_matrix,
+    single_gene_components,
+)
+
+
+def test_single_gene_components():
+    rng = np.random.default_rng(0)
+    stack = rng.normal(size=(3, 100, 6))
+    stack[:, 7, 2] = -20
+    stack[1, 3, 4] = 50
+
+    expected = np.array(
+        [
+            [
+                (lambda w: w.iloc[0] > 2 * w.iloc[1])(
+                    abs(pd.Series(M[:, k])).sort_values(ascending=False)
+                )
+                for k in range(M.shape[1])
+            ]
+            for M in stack
+        ]
+    )
+    assert np.array_equal(single_gene_components(stack), expected)
+    assert expected[:, 2].all() and expected[1, 4]
+
+    M = pd.DataFrame(stack[1])
+    result = single_gene_components(M)
+    assert result.index.tolist() == list(range(6))
+    assert result[result].index.tolist() == [2, 4]
+
+    ica_data = IcaData(M, pd.DataFrame(rng.normal(size=(6, 4)), index=M.columns))
+    assert ica_data.find_single_gene_imodulons(save=True) == [2, 4]
+    assert ica_data.imodulon_table.single_gene.sum() == 2
+
+
+def test_mutual_info_distance_matrix(tmp_path):
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame(rng.normal(size=(100, 5)), columns=list("abcde"))
+    data["b"] = 2 * data["a"] + rng.normal(scale=0.1, size=100)
+    data["e"] = data["e"].round()
+
+    expected = data.corr(method=mutual_info_distance)
+    result = mutual_info_distance_matrix(data, processes=1)
+    assert result.index.tolist() == list("abcde")
+    assert np.allclose(result, expected, rtol=0, atol=1e-12)
+    assert (np.diag(result) == 1).all()
+    assert result.loc["a", "b"] < 0.5
+
+    # Results do not depend on the number of processes
+    assert result.equals(mutual_info_distance_matrix(data, processes=2))
+
+    # Cached matrices are re-used until the data changes
+    cached = mutual_info_distance_matrix(data, processes=1, cache_dir=tmp_path)
+    assert cached.equals(result)
+    (cache_file,) = tmp_path.iterdir()
+    np.save(cache_file, np.zeros((5, 5)))
+    assert (mutual_info_distance_matrix(data, cache_dir=tmp_path) == 0).all().all()
+    data.iloc[0, 0] += 1
+    assert mutual_info_distance_matrix(data, processes=1, cache_dir=tmp_path).equals(
+        mutual_info_distance_matrix(data, processes=1)
+    )
+
+
+def test_mi_rng():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(50, 1)).round(1)
+    y = x + rng.normal(scale=0.5, size=(50, 1))
+    xy = np.hstack([x, y])
+
+    # Estimates are reproducible, with or without a seed
+    assert mi(x, y) == mi(x, y)
+    assert entropy(xy) == entropy(xy)
+    assert mi(x, y, rng=1) == mi(x, y, rng=1)
+    assert entropy(xy, rng=1) == entropy(xy, rng=1)
+    assert mutual_info_distance(x, y, rng=1) == mutual_info_distance(x, y, rng=1)
+
+
+def test_lnc_correction():
+    rng = np.random.default_rng(0)
+    points = rng.normal(size=(200, 2))
+    points[:, 1] += 3 * points[:, 0]
+    tree = build_tree(points)
+
+    for k, alpha in [(3, 0.25), (5, 0.5)]:
+        # Reference implementation with one query per point
+        expected = 0
+        for point in points:
+            knn = tree.query(point[None, :], k=k + 1, return_distance=False)[0]
+            knn_points = points[knn] - points[knn[0]]
+            _, v = np.linalg.eig(knn_points.T @ knn_points / k)
+            V_rect = np.log(np.abs(knn_points @ v).max(axis=0)).sum()
+            log_knn_dist = np.log(np.abs(knn_points).max(axis=0)).sum()
+            if V_rect < log_knn_dist + np.log(alpha):
+                expected += (log_knn_dist - V_rect) / len(points)
+
+        assert expected > 0
+        assert np.isclose(lnc_correction(tree, points, k, alpha), expected)
+
+
+def test_cluster_activity_matrix():
+    rng = np.random.default_rng(0)
+    A = pd.DataFrame(rng.normal(size=(8, 20)), index=list("abcdefgh"))
+    A.loc["b"] = -A.loc["a"] + rng.normal(scale=0.1, size=20)
+    A.loc["c"] = A.loc["a"] + rng.normal(scale=0.1, size=20)
+    A.loc["d"] = A.loc["a"] + rng.normal(scale=0.1, size=20)
+    labels = np.array([0, 0, 0, 0, 1, 1, 2, 3])
+    correlation = A.T.corr()
+
+    result = cluster_activity_matrix(
+        A, labels, clusters=[1, 0, 2], correlation=correlation, cluster_names={0: "x"}
+    )
+    assert result.index.tolist() == ["Cluster 1", "x [Clst]", "Cluster 2", "h"]
+    assert result.columns.equals(A.columns)
+
+    # Members with negative mean correlation to their cluster are inverted
+    expected = (A.loc["a"] - A.loc["b"] + A.loc["c"] + A.loc["d"]) / 4
+    assert np.allclose(result.loc["x [Clst]"], expected)
+    sign = np.sign(correlation.loc["e", "f"])
+    assert np.allclose(result.loc["Cluster 1"], sign * (A.loc["e"] + A.loc["f"]) / 2)
+    assert np.allclose(result.loc["Cluster 2"], A.loc["g"])
+    assert result.loc["h"].equals(A.loc["h"])
+
+    # All clusters are consolidated by default
+    assert cluster_activity_matrix(A, labels).index.tolist() == [
+        "Cluster {}".format(i) for i in range(4)
+    ]
+
+
+def test_activity_projector():
+    rng = np.random.default_rng(0)
+    genes = ["g{}".format(i) for i in range(50)]
+    M = pd.DataFrame(rng.normal(size=(50, 4)), index=genes)
+    A = pd.DataFrame(rng.normal(size=(4, 6)), index=M.columns)
+    ica_data = IcaData(M, A, thresholds=[1] * 4)
+
+    # Expression profiles with shuffled and missing genes
+    data = pd.DataFrame(M.values @ A.values, index=genes, columns=list("abcdef"))
+    data = data.iloc[rng.permutation(50)[:40]]
+    projector = ActivityProjector(ica_data)
+    activities = projector.project(data)
+    assert activities.index.tolist() == ica_data.imodulon_names
+    assert activities.columns.tolist() == list("abcdef")
+    assert np.allclose(activities.values, A.values)
+    assert activities.equals(infer_activities(ica_data, data))
+
+    # Batches on the same genes re-use the pseudo-inverse
+    batches = (data.iloc[:, i : i + 2] for i in range(0, 6, 2))
+    projected = pd.concat(projector.project_batches(batches), axis=1)
+    assert np.allclose(projected, activities)
+    assert len(projector._pinv_cache) == 1
+    projector.project(data.iloc[:30])
+    assert len(projector._pinv_cache) == 2
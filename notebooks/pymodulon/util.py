@@ -1,17 +1,28 @@
 """
 General utility functions for the pymodulon package
 """
+import hashlib
 import json
 import os
 import re
 import warnings
+from concurrent.futures import ProcessPoolExecutor
 from itertools import combinations
-from typing import List, Optional, Sequence, Set, TypeVar, Union
+from typing import (
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    TypeVar,
+    Union,
+)
 
 import numpy as np
 import pandas as pd
 from matplotlib.axes import Axes
-from scipy import stats
+from scipy import sparse, stats
 from scipy.special import digamma
 from sklearn.neighbors import BallTree, KDTree
 
@@ -126,6 +137,41 @@ def compute_threshold(ic: pd.Series, dagostino_cutoff: float):
         return np.mean([ordered_genes.iloc[i], ordered_genes.iloc[i - 1]])
 
 
+def single_gene_components(
+    M: Union[pd.DataFrame, np.ndarray], ratio: float = 2
+) -> Union[pd.Series, np.ndarray]:
+    """
+    Finds likely single-gene components, where the largest absolute gene weight
+    is more than `ratio` times the second largest. Works on a whole M matrix,
+    or on a stack of M matrices with shape (n_runs, n_genes, n_components).
+
+    Parameters
+    ----------
+    M : Union[pd.DataFrame, np.ndarray]
+        M matrix (genes x components) or stack of M matrices
+    ratio : float
+        Minimum ratio between the two largest gene weights (default: 2)
+
+    Returns
+    -------
+    Union[pd.Series, np.ndarray]
+        Boolean mask of single-gene components (a Series indexed by
+        component if M is a DataFrame)
+    """
+    weights = np.abs(np.asarray(M, dtype=float))
+    n_genes = weights.shape[-2]
+    if n_genes < 2:
+        raise ValueError("M must contain at least two genes")
+
+    # Only the two largest weights of each column are needed
+    top2 = np.partition(weights, [n_genes - 2, n_genes - 1], axis=-2)
+    single_gene = top2[..., -1, :] > ratio * top2[..., -2, :]
+
+    if isinstance(M, pd.DataFrame):
+        return pd.Series(single_gene, index=M.columns)
+    return single_gene
+
+
 def dima(
     ica_data,
     sample1: Union[List, str],
@@ -154,18 +200,14 @@ def dima(
     else:
         A_to_use = ica_data.A
 
-    _diff = pd.DataFrame()
-
     sample1_list = _parse_sample(ica_data, sample1)
     sample2_list = _parse_sample(ica_data, sample2)
 
-    for name, group in ica_data.sample_table.groupby(["project", "condition"]):
-        for i1, i2 in combinations(group.index, 2):
-            _diff[":".join(name)] = abs(A_to_use[i1] - A_to_use[i2])
+    params = _dima_distributions(ica_data, A_to_use)
     dist = {}
 
     for k in A_to_use.index:
-        dist[k] = stats.lognorm(*stats.lognorm.fit(_diff.loc[k].values)).cdf
+        dist[k] = stats.lognorm(*params.loc[k]).cdf
 
     res = pd.DataFrame(index=A_to_use.index)
     for k in res.index:
@@ -179,6 +221,111 @@ def dima(
     )
 
 
+def _dima_distributions(ica_data, A: pd.DataFrame) -> pd.DataFrame:
+    """
+    Fits a log-normal distribution to the activity differences between
+    replicates of the same condition, for each iModulon
+
+    Parameters
+    ----------
+    ica_data : ~pymodulon.core.IcaData
+        IcaData object with "project" and "condition" columns in its sample table
+    A : pd.DataFrame
+        Activity matrix
+
+    Returns
+    -------
+    pd.DataFrame
+        Shape, location and scale of each distribution (see
+        :func:`scipy.stats.lognorm`)
+    """
+    _diff = pd.DataFrame()
+    for name, group in ica_data.sample_table.groupby(["project", "condition"]):
+        for i1, i2 in combinations(group.index, 2):
+            _diff[":".join(name)] = abs(A[i1] - A[i2])
+
+    params = [stats.lognorm.fit(_diff.loc[k].values) for k in A.index]
+    return pd.DataFrame(params, index=A.index, columns=["s", "loc", "scale"])
+
+
+def cluster_activity_matrix(
+    A: pd.DataFrame,
+    labels: Sequence,
+    clusters: Optional[Sequence] = None,
+    correlation: Optional[pd.DataFrame] = None,
+    cluster_names: Optional[dict] = None,
+) -> pd.DataFrame:
+    """
+    Consolidates the activities of clustered iModulons (e.g. for DiMCA). Each
+    cluster activity is the mean of its iModulon activities, after inverting
+    iModulons whose mean correlation to the rest of the cluster is negative.
+
+    Parameters
+    ----------
+    A : pd.DataFrame
+        Activity matrix
+    labels : Sequence
+        Cluster label of each iModulon, in the order of A.index
+    clusters : Sequence
+        Labels of clusters to consolidate (default: all clusters)
+    correlation : pd.DataFrame
+        iModulon correlation matrix used to orient iModulons within clusters
+        (default: Pearson correlation of A)
+    cluster_names : dict
+        Names of clusters, keyed by label. Other clusters are named
+        "Cluster <label>".
+
+    Returns
+    -------
+    pd.DataFrame
+        Activity matrix with one row per consolidated cluster, followed by the
+        remaining iModulons in their original order
+    """
+
+    labels = np.asarray(labels)
+    if clusters is None:
+        clusters = pd.unique(labels)
+    if correlation is None:
+        correlation = A.T.corr()
+    if cluster_names is None:
+        cluster_names = {}
+
+    # Cluster of each iModulon, or -1 if it is not consolidated
+    cluster_idx = pd.Index(clusters).get_indexer(labels)
+    members = np.where(cluster_idx >= 0)[0]
+    membership = sparse.csr_matrix(
+        (np.ones(len(members)), (members, cluster_idx[members])),
+        shape=(len(labels), len(clusters)),
+    )
+    sizes = np.asarray(membership.sum(axis=0)).ravel()
+
+    # Mean correlation of each iModulon to the other members of its cluster
+    corr = correlation.loc[A.index, A.index].values
+    corr_sums = (membership.T @ corr.T).T[members, cluster_idx[members]]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_corrs = (corr_sums - corr[members, members]) / (
+            sizes[cluster_idx[members]] - 1
+        )
+    signs = np.where(mean_corrs < 0, -1, 1)
+
+    # Average the oriented activities with one sparse aggregation matrix
+    aggregation = sparse.csr_matrix(
+        (signs / sizes[cluster_idx[members]], (cluster_idx[members], members)),
+        shape=(len(clusters), len(labels)),
+    )
+    cluster_A = pd.DataFrame(
+        aggregation @ A.values,
+        index=[
+            "{} [Clst]".format(cluster_names[label])
+            if label in cluster_names
+            else "Cluster {}".format(label)
+            for label in clusters
+        ],
+        columns=A.columns,
+    )
+    return pd.concat([cluster_A, A[cluster_idx < 0]])
+
+
 def _parse_sample(ica_data, sample: Union[List, str]):
     """
     Parses sample inputs into a list of sample IDs
@@ -294,22 +441,221 @@ def infer_activities(ica_data, data: pd.DataFrame):
     Inferred activities for the expression profiles
     """
 
-    shared_genes = ica_data.M.index & data.index
-    x = data.loc[shared_genes].values
-    m = ica_data.M.loc[shared_genes].values
-    m_inv = np.linalg.pinv(m)
-    a = np.dot(m_inv, x)
-    return pd.DataFrame(a, index=ica_data.imodulon_names, columns=data.columns)
+    return ActivityProjector(ica_data).project(data)
 
 
-def mutual_info_distance(x, y):
+class ActivityProjector(object):
+    """
+    Infers iModulon activities for external expression profiles. The
+    pseudo-inverse of the M matrix is computed once for each set of shared
+    genes, so later batches measured on the same genes are projected with a
+    single matrix product.
+    """
+
+    def __init__(self, ica_data, cache_size: int = 8):
+        """
+        Parameters
+        ----------
+        ica_data : ~pymodulon.core.IcaData
+            IcaData object containing the M matrix to project onto
+        cache_size : int
+            Number of pseudo-inverses to keep, one per set of shared genes
+            (default: 8)
+        """
+        self._m = ica_data.M.copy()
+        self.imodulon_names = ica_data.imodulon_names
+        self.cache_size = cache_size
+        self._pinv_cache = {}
+
+    def _get_pinv(self, genes: pd.Index):
+        """
+        Returns the genes of M that are in `genes`, in the order of M, and the
+        pseudo-inverse of M restricted to those genes
+        """
+        shared = self._m.index.isin(genes)
+        key = np.packbits(shared).tobytes()
+        if key not in self._pinv_cache:
+            if len(self._pinv_cache) >= self.cache_size:
+                self._pinv_cache.pop(next(iter(self._pinv_cache)))
+            self._pinv_cache[key] = (
+                self._m.index[shared],
+                np.linalg.pinv(self._m.values[shared]),
+            )
+        return self._pinv_cache[key]
+
+    def project(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Infers iModulon activities for a batch of expression profiles
+
+        Parameters
+        ----------
+        data : pd.DataFrame
+            External expression profiles (genes x samples), centered to a
+            reference
+
+        Returns
+        -------
+        pd.DataFrame
+            Inferred activities (iModulons x samples)
+        """
+        shared_genes, m_inv = self._get_pinv(data.index)
+        a = np.dot(m_inv, data.loc[shared_genes].values)
+        return pd.DataFrame(a, index=self.imodulon_names, columns=data.columns)
+
+    def project_batches(
+        self, batches: Iterable[pd.DataFrame]
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Infers iModulon activities for a stream of expression batches, such as
+        blocks of samples loaded one at a time. Batches are projected as they
+        are consumed, so only one batch needs to be in memory.
+
+        Parameters
+        ----------
+        batches : Iterable[pd.DataFrame]
+            Expression profiles (genes x samples), centered to a reference
+
+        Yields
+        ------
+        pd.DataFrame
+            Inferred activities for each batch
+        """
+        for data in batches:
+            yield self.project(data)
+
+
+def mutual_info_distance(x, y, rng=None):
     x = np.asarray(x).reshape(x.shape[0], 1)
     y = np.asarray(y).reshape(x.shape[0], 1)
-    h = entropy(np.hstack([x, y]))
+    rng = _get_rng(rng)
+    h = entropy(np.hstack([x, y]), rng=rng)
     if h == 0:
         return 1
     else:
-        return 1 - mi(x, y) / h
+        return 1 - mi(x, y, rng=rng) / h
+
+
+def mutual_info_distance_matrix(
+    data: pd.DataFrame,
+    k: int = 3,
+    processes: Optional[int] = None,
+    rng: Union[None, int, np.random.Generator] = None,
+    cache_dir: Optional[os.PathLike] = None,
+) -> pd.DataFrame:
+    """
+    Computes :func:`mutual_info_distance` between all pairs of columns of a
+    DataFrame. Noise is added and the marginal neighbor counts are prepared once
+    per column, and the joint k-nearest neighbor queries for all pairs are
+    split across worker processes.
+
+    Since the estimate is deterministic for a given seed, results can be stored
+    in cache_dir, keyed by a hash of the data, and re-used across sessions.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        Table with one column per variable (e.g. ica_data.A.T)
+    k : int
+        Number of nearest neighbors (default: 3)
+    processes : int
+        Number of worker processes (default: number of CPUs). Pairs are
+        processed serially if processes is 1.
+    rng : Union[None, int, np.random.Generator]
+        Seed or generator for the noise used to break ties. If None, ties are
+        broken deterministically by sample order (default: None)
+    cache_dir : os.PathLike
+        Directory for cached distance matrices. Requires rng to be None or an
+        integer seed (default: no caching)
+
+    Returns
+    -------
+    pd.DataFrame
+        Symmetric distance matrix with ones on the diagonal, as returned by
+        data.corr(method=mutual_info_distance)
+    """
+
+    if cache_dir is not None:
+        if isinstance(rng, np.random.Generator):
+            raise ValueError("cache_dir requires rng to be None or an integer seed")
+        key = hashlib.sha1(
+            pd.util.hash_pandas_object(data).values.tobytes()
+            + repr((data.columns.tolist(), k, rng)).encode()
+        ).hexdigest()
+        cache_file = os.path.join(cache_dir, "mi_distance_{}.npy".format(key))
+        if os.path.isfile(cache_file):
+            dist = np.load(cache_file)
+            return pd.DataFrame(dist, index=data.columns, columns=data.columns)
+
+    values = np.asarray(data, dtype=float)
+    n_samples, n_vars = values.shape
+    assert k <= n_samples - 1, "Set k smaller than num. samples - 1"
+
+    values = add_noise(values, rng=rng)
+    sorted_values = np.sort(values, axis=0)
+
+    rows, cols = np.triu_indices(n_vars, 1)
+    n_chunks = max(1, min(len(rows), 4 * (processes or os.cpu_count() or 1)))
+    jobs = [
+        (values, sorted_values, rows[chunk], cols[chunk], k)
+        for chunk in np.array_split(np.arange(len(rows)), n_chunks)
+    ]
+    if processes == 1 or len(rows) == 0:
+        results = [_mi_distance_pairs(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(_mi_distance_pairs, jobs))
+
+    dist = np.ones((n_vars, n_vars))
+    dist[rows, cols] = dist[cols, rows] = np.concatenate(results)
+
+    if cache_dir is not None:
+        # Write to a temporary file first so interrupted runs leave no partial cache
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = cache_file + ".tmp"
+        with open(tmp_file, "wb") as f:
+            np.save(f, dist)
+        os.replace(tmp_file, cache_file)
+
+    return pd.DataFrame(dist, index=data.columns, columns=data.columns)
+
+
+def _mi_distance_pairs(args):
+    """
+    Computes mutual information distances for a chunk of column pairs in a
+    worker process
+    """
+    values, sorted_values, rows, cols, k = args
+    n_samples = values.shape[0]
+    h_const = digamma(n_samples) - digamma(k) + 2 * np.log(2)
+    mi_const = digamma(n_samples) + digamma(k)
+
+    dists = np.ones(len(rows))
+    for i, (x, y) in enumerate(zip(rows, cols)):
+        points = values[:, [x, y]]
+        dvec = query_neighbors(build_tree(points), points, k)
+
+        # Entropy of the joint distribution
+        h = max(0, h_const + 2 * np.log(dvec).mean())
+        if h == 0:
+            continue
+
+        # Mutual information, counting marginal neighbors in the sorted columns
+        a = _avgdigamma_sorted(values[:, x], sorted_values[:, x], dvec)
+        b = _avgdigamma_sorted(values[:, y], sorted_values[:, y], dvec)
+        dists[i] = 1 - max(0, -a - b + mi_const) / h
+    return dists
+
+
+def _avgdigamma_sorted(x, sorted_x, dvec):
+    """
+    Same as :func:`avgdigamma` for a single variable, counting the neighbors
+    in a pre-sorted copy of x instead of building a tree
+    """
+    dvec = dvec - 1e-15
+    num_points = np.searchsorted(sorted_x, x + dvec, side="right") - np.searchsorted(
+        sorted_x, x - dvec, side="left"
+    )
+    return np.mean(digamma(num_points))
 
 
 # the following code is taken from the NPEET package; it cannot be installed via pip,
@@ -318,17 +664,19 @@ def mutual_info_distance(x, y):
 # https://github.com/gregversteeg/NPEET
 
 
-def mi(x, y, z=None, k=3, base=2, alpha=0):
+def mi(x, y, z=None, k=3, base=2, alpha=0, rng=None):
     """Mutual information of x and y (conditioned on z if z is not None)
     x, y should be a list of vectors, e.g. x = [[1.3], [3.7], [5.1], [2.4]]
     if x is a one-dimensional scalar and we have four samples
+    rng is a seed or np.random.Generator for the noise (see add_noise)
     """
     assert len(x) == len(y), "Arrays should have same length"
     assert k <= len(x) - 1, "Set k smaller than num. samples - 1"
     x, y = np.asarray(x), np.asarray(y)
     x, y = x.reshape(x.shape[0], -1), y.reshape(y.shape[0], -1)
-    x = add_noise(x)
-    y = add_noise(y)
+    rng = _get_rng(rng)
+    x = add_noise(x, rng=rng)
+    y = add_noise(y, rng=rng)
     points = [x, y]
     if z is not None:
         z = np.asarray(z)
@@ -359,24 +707,36 @@ def mi(x, y, z=None, k=3, base=2, alpha=0):
     return max(0, (-a - b + c + d) / np.log(base))
 
 
-def entropy(x, k=3, base=2):
+def entropy(x, k=3, base=2, rng=None):
     """The classic K-L k-nearest neighbor continuous entropy estimator
     x should be a list of vectors, e.g. x = [[1.3], [3.7], [5.1], [2.4]]
     if x is a one-dimensional scalar and we have four samples
+    rng is a seed or np.random.Generator for the noise (see add_noise)
     """
     assert k <= len(x) - 1, "Set k smaller than num. samples - 1"
     x = np.asarray(x)
     n_elements, n_features = x.shape
-    x = add_noise(x)
+    x = add_noise(x, rng=rng)
     tree = build_tree(x)
     nn = query_neighbors(tree, x, k)
     const = digamma(n_elements) - digamma(k) + n_features * np.log(2)
     return max(0, (const + n_features * np.log(nn).mean()) / np.log(base))
 
 
-def add_noise(x, intens=1e-10):
-    # small noise to break degeneracy, see doc.
-    return x + intens * np.random.random_sample(x.shape)
+def add_noise(x, intens=1e-10, rng=None):
+    # small noise to break degeneracy, see doc. Without a seed or generator, ties
+    # are broken deterministically by adding noise proportional to the rank of
+    # each value in its column (ties are ranked by sample order)
+    if rng is None:
+        ranks = stats.rankdata(x, method="ordinal", axis=0)
+        return x + intens * ranks / x.shape[0]
+    return x + intens * np.random.default_rng(rng).random(x.shape)
+
+
+def _get_rng(rng):
+    # Turn seeds into a single generator, so that successive calls to add_noise
+    # draw different noise
+    return None if rng is None else np.random.default_rng(rng)
 
 
 def build_tree(points):
@@ -399,26 +759,23 @@ def avgdigamma(points, dvec):
 
 
 def lnc_correction(tree, points, k, alpha):
-    e = 0
     n_sample = points.shape[0]
-    for point in points:
-        # Find k-nearest neighbors in joint space, p=inf means max norm
-        knn = tree.query(point[None, :], k=k + 1, return_distance=False)[0]
-        knn_points = points[knn]
-        # Substract mean of k-nearest neighbor points
-        knn_points = knn_points - knn_points[0]
-        # Calculate covariance matrix of k-nearest neighbor points, obtain eigen vectors
-        covr = knn_points.T @ knn_points / k
-        _, v = np.linalg.eig(covr)
-        # Calculate PCA-bounding box using eigen vectors
-        V_rect = np.log(np.abs(knn_points @ v).max(axis=0)).sum()
-        # Calculate the volume of original box
-        log_knn_dist = np.log(np.abs(knn_points).max(axis=0)).sum()
-
-        # Perform local non-uniformity checking and update correction term
-        if V_rect < log_knn_dist + np.log(alpha):
-            e += (log_knn_dist - V_rect) / n_sample
-    return e
+    # Find k-nearest neighbors of all points in joint space, p=inf means max norm
+    knn = tree.query(points, k=k + 1, return_distance=False)
+    # Substract the query point from its k-nearest neighbor points
+    knn_points = points[knn]
+    knn_points = knn_points - knn_points[:, :1]
+    # Calculate covariance matrices of k-nearest neighbor points, obtain eigen vectors
+    covr = np.einsum("nki,nkj->nij", knn_points, knn_points) / k
+    _, v = np.linalg.eigh(covr)
+    # Calculate PCA-bounding boxes using eigen vectors
+    V_rect = np.log(np.abs(knn_points @ v).max(axis=1)).sum(axis=1)
+    # Calculate the volumes of the original boxes
+    log_knn_dist = np.log(np.abs(knn_points).max(axis=1)).sum(axis=1)
+
+    # Perform local non-uniformity checking and sum correction terms
+    non_uniform = V_rect < log_knn_dist + np.log(alpha)
+    return (log_knn_dist - V_rect)[non_uniform].sum() / n_sample
 
 
 def count_neighbors(tree, x, r):